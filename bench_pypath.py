@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+"""
+Benchmark pypath.py script.
+
+Benchmarks run against synthetic directory trees & path files, created
+in a temporary directory, using the pypath files in the current working
+directory.  Results are written as JSON, and can be compared against a
+baseline results file to catch regressions.
+"""
+
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import pypath_core as pypath
+
+
+SIZES = [10, 100, 1000]     # Numbers of paths.
+REPEAT = 5
+TOLERANCE = 0.25    # Allowed slowdown, as a fraction of the baseline.
+INSTALL_FILES = ["pypath.py", "pypath_core.py", "pypath.sh", "pypathd.py",
+    "pypath_import.py", "codes"]
+EPILOG = """
+Results are the best time of each benchmark, in seconds, keyed by name.
+
+Examples:
+  bench_pypath.py -o base.json          # Save results as a baseline.
+  bench_pypath.py -b base.json          # Fail if slower than the baseline.
+  bench_pypath.py -n 10 10000 -r 3      # Benchmark 10 & 10000 paths.
+"""
+
+
+def main():
+    """
+    Parse command line, run benchmarks & compare results with baseline.
+    """
+    args = get_parser().parse_args()
+    results = run_benchmarks(args.sizes, args.repeat, args.server)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print
+    if args.baseline:
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+        regressions = compare(results, baseline, args.tolerance)
+        for name, ratio in regressions:
+            sys.stderr.write("Regression: '{}' took {:.2f}x baseline\n"
+                .format(name, ratio))
+        if regressions:
+            sys.exit(1)
+
+
+def get_parser():
+    """
+    Get command line parser.
+    """
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n')[0],
+        epilog=EPILOG,
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument('-n', dest='sizes', type=int, nargs='+',
+        default=SIZES, metavar='n', help=('Numbers of paths to benchmark'
+        ' (default: {}).'.format(" ".join(str(n) for n in SIZES))))
+    parser.add_argument('-r', dest='repeat', type=int, default=REPEAT,
+        metavar='n', help=('Number of times to repeat each benchmark'
+        ' (default: {}).'.format(REPEAT)))
+    parser.add_argument('-o', dest='output', metavar='json',
+        help='Write results to file, instead of stdout.')
+    parser.add_argument('-b', dest='baseline', metavar='json',
+        help='Compare results with a baseline results file.')
+    parser.add_argument('-t', dest='tolerance', type=float, default=TOLERANCE,
+        metavar='frac', help=('Allowed slowdown compared to the baseline'
+        ' (default: {}).'.format(TOLERANCE)))
+    parser.add_argument('-s', dest='server', action='store_true',
+        default=False, help=('Also benchmark pypath.sh with the pypathd.py'
+        ' server running (needs nc).'))
+    return parser
+
+
+def best_time(func, repeat, min_time=0.01):
+    """
+    Return the best wall time of calling func, in seconds.
+
+    Each of the 'repeat' timings calls func until at least 'min_time'
+    seconds have passed, so that fast functions can be timed reliably.
+    """
+    times = []
+    for _ in range(repeat):
+        count = 0
+        start = time.time()
+        while True:
+            func()
+            count += 1
+            elapsed = time.time() - start
+            if elapsed >= min_time:
+                break
+        times.append(elapsed / count)
+    return min(times)
+
+
+def make_tree(root, size):
+    """
+    Create 'size' dirs under root, and a path file listing them.
+
+    Returns the dir paths & the path file name.
+    """
+    tree = os.path.join(root, "tree{}".format(size))
+    dirs = [os.path.join(tree, "d{}".format(i // 100), "d{}".format(i))
+        for i in range(size)]
+    for path in dirs:
+        os.makedirs(path)
+    path_file = os.path.join(tree, "tree.pth")
+    with open(path_file, 'w') as fh:
+        for path in dirs:
+            fh.write("# Comment.\n{}\n".format(os.path.relpath(path, tree)))
+    mtime = time.time() - 10    # Old enough to be cached.
+    os.utime(path_file, (mtime, mtime))
+    return dirs, path_file
+
+
+def install(root):
+    """
+    Install pypath files under 'root/.pypath', for use with HOME=root.
+    """
+    pypath_dir = os.path.join(root, ".pypath")
+    os.mkdir(pypath_dir)
+    for name in INSTALL_FILES:
+        shutil.copy2(name, pypath_dir)
+
+
+def run_benchmarks(sizes, repeat=REPEAT, server=False):
+    """
+    Run benchmarks for each size, returning a dict of name to seconds.
+    """
+    root = tempfile.mkdtemp()
+    default_path = pypath.DEFAULT_PATH
+    cache_dir = pypath.CACHE_DIR
+    lock_dir = pypath.LOCK_DIR
+    snapshot_dir = pypath.SNAPSHOT_DIR
+    dir_cache_path = pypath.DIR_CACHE_PATH
+    pypath.DEFAULT_PATH = os.path.join(root, "default.pth")
+    pypath.CACHE_DIR = os.path.join(root, "cache")
+    pypath.LOCK_DIR = os.path.join(root, "locks")
+    pypath.SNAPSHOT_DIR = os.path.join(root, "snapshots")
+    pypath.DIR_CACHE_PATH = os.path.join(root, "dirs.cache")
+    results = {}
+    try:
+        install(root)
+        for size in sizes:
+            dirs, path_file = make_tree(root, size)
+            results.update(bench_size(root, size, dirs, path_file, repeat))
+            results.update(bench_imports(root, size, dirs, repeat))
+        if server:
+            for mode, seconds in bench_server(root, ['-c', '-a', root],
+                    repeat):
+                results["{}[1]".format(mode)] = seconds
+    finally:
+        pypath.DEFAULT_PATH = default_path
+        pypath.CACHE_DIR = cache_dir
+        pypath.LOCK_DIR = lock_dir
+        pypath.SNAPSHOT_DIR = snapshot_dir
+        pypath.DIR_CACHE_PATH = dir_cache_path
+        shutil.rmtree(root)
+    return results
+
+
+def bench_size(root, size, dirs, path_file, repeat):
+    """
+    Benchmark each function, & a shell round trip, with 'size' paths.
+    """
+    actions = [('-a', [path_file])]
+    path_list = pypath.set_paths([], [], actions, False)
+    env = dict(os.environ, HOME=root, PYTHONPATH="")
+    shell = ". ~/.pypath/pypath.sh -c -a '{}'".format(path_file)
+    benchmarks = [
+        ('get_file_paths', lambda: pypath.get_file_paths(path_file)),
+        ('format_path', lambda: [pypath.format_path(p) for p in dirs]),
+        ('set_paths', lambda: pypath.set_paths([], [], actions, False)),
+        ('set_paths_force', lambda: pypath.set_paths([], [], actions, True)),
+        ('join_paths', lambda: pypath.join_paths(path_list + path_list)),
+        ('set_permanently', lambda: pypath.set_permanently(path_list)),
+        ('pypath_sh', lambda: subprocess.check_call(['bash', '-c', shell],
+            env=env)),
+    ]
+    return dict(("{}[{}]".format(name, size), best_time(func, repeat))
+        for name, func in benchmarks)
+
+
+def bench_imports(root, size, dirs, repeat):
+    """
+    Compare interpreter startup & imports with 'size' dirs on the
+    PYTHONPATH against the same dirs bundled by 'pypath -z', linked from
+    one dir by 'pypath -l', & listed in a site path file by 'pypath -S'.
+    """
+    for i, path in enumerate(dirs):
+        with open(os.path.join(path, "mod{}.py".format(i)), 'w') as fh:
+            fh.write("X = {}\n".format(i))
+    modules = ["mod{}".format(i) for i in range(0, size, max(size // 10, 1))]
+    archive, _ = pypath.bundle_paths(dirs,
+        os.path.join(root, "tree{}.zip".format(size)))
+    farm, _ = pypath.farm_paths(dirs,
+        os.path.join(root, "farm{}".format(size)))
+    site_env = dict(os.environ, PYTHONPATH="",
+        PYTHONUSERBASE=os.path.join(root, "site{}".format(size)))
+    pypath.set_site(dirs, [sys.executable], site_env)
+    code = "import " + ", ".join(modules)
+
+    def importer(pythonpath, env=None, code=code):
+        env = env or dict(os.environ, PYTHONPATH=pythonpath)
+        return lambda: subprocess.check_call([sys.executable, '-c', code],
+            env=env)
+
+    return {
+        "import_dirs[{}]".format(size): best_time(importer(":".join(dirs)),
+            repeat),
+        "import_bundle[{}]".format(size): best_time(importer(archive),
+            repeat),
+        "import_farm[{}]".format(size): best_time(importer(farm), repeat),
+        "import_site[{}]".format(size): best_time(importer(None, site_env),
+            repeat),
+        "startup_dirs[{}]".format(size): best_time(importer(":".join(dirs),
+            code="pass"), repeat),
+        "startup_site[{}]".format(size): best_time(importer(None, site_env,
+            "pass"), repeat),
+    }
+
+
+def bench_server(root, args, repeat=50):
+    """
+    Compare a 'source pypath.sh' round trip with the pypathd.py server
+    stopped, so pypath.py runs for each call, & running, so each call is
+    sent to its socket by 'nc'.
+    """
+    env = dict(os.environ, HOME=root, PYTHONPATH="")
+    shell = ". ~/.pypath/pypath.sh {}".format(" ".join("'{}'".format(arg)
+        for arg in args))
+    if subprocess.call(['bash', '-c', 'command -v nc > /dev/null'],
+            env=env) != 0:
+        sys.exit("'nc' is needed to benchmark pypathd.py requests.")
+
+    def run_shell():
+        subprocess.check_call(['bash', '-c', shell], env=env)
+
+    results = [('subprocess', best_time(run_shell, repeat))]
+    pypath_dir = os.path.join(root, ".pypath")
+    socket_path = os.path.join(pypath_dir, "pypath.sock")
+    proc = subprocess.Popen([os.path.join(pypath_dir, "pypathd.py"), '-F'],
+        env=env)
+    try:
+        while not os.path.exists(socket_path):
+            time.sleep(0.01)
+        results.append(('server', best_time(run_shell, repeat)))
+    finally:
+        proc.kill()
+        proc.wait()
+    return results
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+    Return (name, ratio) for results slower than baseline by more than
+    'tolerance'.  Results missing from either are ignored.
+    """
+    regressions = []
+    for name in sorted(set(results) & set(baseline)):
+        if baseline[name] > 0:
+            ratio = results[name] / baseline[name]
+            if ratio > 1 + tolerance:
+                regressions.append((name, ratio))
+    return regressions
+
+
+if __name__ == "__main__":
+    main()
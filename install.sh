@@ -27,8 +27,9 @@ mkdir -p "${PYD}"
 
 # Install files.
 echo "${RCFS}" >> "${SITE}"
-cp "uninstall.sh" "pypath.sh" "pypath.py" "codes" "${PYD}"
-chmod 755 "${PYD}/uninstall.sh" "${PYD}/pypath.py"
+cp "uninstall.sh" "pypath.sh" "pypath.py" "pypath_core.py" "pypathd.py" \
+    "pypath_import.py" "codes" "${PYD}"
+chmod 755 "${PYD}/uninstall.sh" "${PYD}/pypath.py" "${PYD}/pypathd.py"
 chmod 644 "${SITE}" "${PYD}/pypath.sh"
 
 # Add alias & source commands to shell rc files.
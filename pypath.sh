@@ -7,11 +7,67 @@ main() {
     local OUTPUT
     local RETCODE
     local ECHO
-    while read -r LINE; do 
-        eval "${LINE}"; 
-    done < ~/.pypath/codes
-    OUTPUT="$(~/.pypath/pypath.py "${@}" 2>&1)"
-    RETCODE="${?}"
+    local ERRORS
+    local SOCKET
+    local PROFILE
+    local DEP
+    local ARG
+    local SERVER
+    local COMMAND
+    . ~/.pypath/codes
+    # Use a compiled profile if no path file it uses has changed, else use
+    # the pypathd.py server if it is running, else run pypath.py.
+    OUTPUT=""
+    SOCKET=~/.pypath/pypath.sock
+    PROFILE=""
+    SERVER=true
+    COMMAND=false
+    for ARG in "${@}"; do
+        # The server cannot read a batch from stdin.
+        test "${ARG}" = '-' && SERVER=false
+        # Commands are run by pypath.py, without capturing their output.
+        case "${ARG}" in
+            '--' | '-F') COMMAND=true ;;
+        esac
+    done
+    if "${COMMAND}"; then
+        ~/.pypath/pypath.py "${@}"
+        return "${?}"
+    fi
+    case "${1}:${#}:${3}" in
+        '-p:2:' | '-p:3:-e') PROFILE=~/.pypath/profiles/"${2}" ;;
+    esac
+    if test -r "${PROFILE}.sh" && test -r "${PROFILE}.deps"; then
+        while read -r DEP; do
+            if ! test -e "${DEP}" || test "${DEP}" -nt "${PROFILE}.sh"; then
+                PROFILE=""
+                break
+            fi
+        done < "${PROFILE}.deps"
+    else
+        PROFILE=""
+    fi
+    if test -n "${PROFILE}"; then
+        . "${PROFILE}.sh"
+        OUTPUT="${PYTHONPATH}"
+        RETCODE="${SUCCESS}"
+    elif "${SERVER}" && test -S "${SOCKET}" \
+            && command -v nc > /dev/null 2>&1; then
+        OUTPUT="$(printf '%s\0' "$((${#} + 2))" "${PWD}" "$(env)" "${@}" \
+            | nc -U "${SOCKET}" 2> /dev/null)"
+        if test -n "${OUTPUT}"; then
+            ERRORS="${OUTPUT%%$'\x1e'*}"
+            OUTPUT="${OUTPUT#*$'\x1e'}"
+            RETCODE="${OUTPUT##*$'\n'}"
+            OUTPUT="${OUTPUT%$'\n'*}"
+            test -n "${ERRORS}" && printf '%s' "${ERRORS}" 1>&2
+        fi
+    fi
+    if test -z "${RETCODE}"; then
+        # Only stdout is captured, as stderr is meant for the user.
+        OUTPUT="$(~/.pypath/pypath.py "${@}")"
+        RETCODE="${?}"
+    fi
     ECHO=false
     while test "${#}" -gt 0; do
         case "${1}" in
@@ -27,7 +83,7 @@ main() {
         echo "${OUTPUT}"
     elif test ${RETCODE} -ne "${SUCCESS}"; then
         # Echo output to stderr as it contains an error string.
-        echo "${OUTPUT}" 1>&2
+        test -n "${OUTPUT}" && echo "${OUTPUT}" 1>&2
     else
         # Set PYTHONPATH.
         export PYTHONPATH="${OUTPUT}"
@@ -0,0 +1,2798 @@
+#!/usr/bin/env python
+"""
+Configure the Python module search path.
+
+This file should be run via a shell script that can actually set the
+PYTHONPATH environment variable.
+"""
+
+
+import marshal
+import os
+import re
+import stat
+import sys
+import time
+
+
+DEFAULT_PATH = "~/.pypath/default.pth"
+DEFAULT_PROFILE = "~/.pypath/default.profile"   # Profile set as default.
+PROFILE_DIR = "~/.pypath/profiles"
+CACHE_DIR = "~/.pypath/cache"
+CACHE_SIZE = 256    # Maximum number of path files cached.
+INCLUDE = "include "    # Path file lines including another path file.
+GLOB_CHARS = re.compile(r'[*?[]')    # Wildcards in path file lines.
+GLOB_DEPTH = 8  # Maximum number of dirs matched by '**'.
+GLOB_EXCLUDE = ['__pycache__', 'node_modules']  # Dirs wildcards skip.
+DIR_CACHE_PATH = "~/.pypath/dirs.cache"
+DIR_CACHE_SIZE = 10000  # Maximum number of dir listings cached.
+SNAPSHOT_DIR = "~/.pypath/snapshots"
+SNAPSHOT_SIZE = 100     # Number of snapshots kept in the history.
+LOCK_DIR = "~/.pypath/locks"    # Locks on files written by '-d' & '-S'.
+BATCH_SIZE = 1000   # Number of paths resolved & checked at once.
+JOBS = 16       # Number of threads checking paths.
+INLINE_CHECKS = 4   # Paths checked without threads, which is faster.
+TIMEOUT = 10.0  # Seconds to wait for a path to be checked.
+TIMED_OUT = -1  # Mode of paths that could not be checked in time.
+UNREADABLE = -2     # Mode of dirs that cannot be searched for modules.
+WATCH_INTERVAL = 2.0    # Seconds between checks for changes, if polling.
+WATCH_DELAY = 0.5   # Seconds without changes before updating profiles.
+EXTENSION_SUFFIXES = ('so', 'pyd')  # Modules that cannot be bundled.
+BYTECODE_SUFFIXES = ('pyc', 'pyo')  # Files replaced when bundled.
+FARM_INDEX = ".pypath-farm"     # Modules found in each dir linked by '-l'.
+SITE_PTH = "pypath.pth"  # Path file written to site dirs by '-S'.
+# Print the dir 'site' processes path files from that the user can write:
+# the user site dir, or the site-packages dir of a virtual environment.
+SITE_CODE = \
+    "import site, sysconfig\n" \
+    "if getattr(site, 'ENABLE_USER_SITE', False):\n" \
+    "    print(site.getusersitepackages())\n" \
+    "else:\n" \
+    "    print(sysconfig.get_paths()['purelib'])\n"
+# Run 'pypath_import.main' in a child interpreter without adding its dir
+# to 'sys.path', which would change the lookups being measured.
+MEASURE_CODE = \
+    "import sys\n" \
+    "ns = {'__name__': 'pypath_measure', '__file__': sys.argv[1]}\n" \
+    "exec(compile(open(sys.argv[1]).read(), sys.argv[1], 'exec'), ns)\n" \
+    "ns['main'](sys.argv[2:])\n"
+COMPILE_CODE = MEASURE_CODE.replace("'main'", "'compile_main'")
+
+# Enumerate return codes (as in 'codes', which is used by 'pypath.sh').
+SUCCESS = 0
+ERROR = 1
+HELP = 2
+
+# Options handled by 'parse_args_fast'.
+FAST_FLAGS = {'-c': 'clear', '-d': 'permanent', '-e': 'echo', '-f': 'force',
+    '-i': 'index', '-u': 'usage', '-w': 'watch', '-R': 'canonical',
+    '-P': 'prune', '-D': 'prune_default', '-C': 'compile', '-T': 'timings',
+    '--timings': 'timings', '--history': 'history', '--undo': 'undo'}
+FAST_ACTIONS = ['-a', '-r']
+
+DESCRIPTION = __doc__.strip().split('\n')[0]
+USAGE = \
+    "pypath [-h] [-e] [-c] [-d] [-f] [-i] [-u] [-w] [-R] [-P] [-D] [-C]" \
+    " [-K dir] [-b file] [-l dir] [-z zip] [-p name] [-s name] [-j jobs]" \
+    " [-t sec] [-T] [--cprofile file]" \
+    " [-m module [module ...]] [-x python] [-S python [python ...]]" \
+    " [-F file] [-n procs] [-a path [path ...]] [-r path [path ...]]" \
+    " [--history] [--undo] [--restore snapshot]" \
+    " [--diff snapshot [snapshot]] [-- command [arg ...]]"
+EPILOG = """
+Specifying multiple options and path values is allowed.
+Path files should list one directory per line, in order of decreasing priority.
+Path files can include other path files with lines like 'include other.pth'.
+Path file lines can use wildcards, like 'plugins/*/src' or 'lib/**', which are
+replaced by the matching dirs in sorted order.
+Batch files list add & remove actions with one argument per line, like 'ls -1'.
+Batch actions are performed after any on the command line.
+
+If 'canonical' is specified, paths that are the same directory (e.g. through a
+symlink) are only listed once, as spelled by the highest priority one, and any
+spelling of a directory removes it.
+
+The 'prune' option removes entries of the starting PYTHONPATH that are blank,
+missing, not directories or unreadable, before any other action, and reports
+each one.  The 'prune_default' option does the same to the default PYTHONPATH.
+
+Each resulting PYTHONPATH (& the one it replaced) is saved as a snapshot, &
+the latest SNAPSHOT_SIZE are kept.  The 'history' option lists them on
+stderr, newest first, by number & hash.  The 'restore' option starts from a
+snapshot (by number or hash prefix), instead of the current PYTHONPATH, & the
+'undo' option starts from the snapshot before the current PYTHONPATH.  Neither
+reads path files or checks paths, & their results are not saved, so 'undo'
+can be repeated.  The 'diff' option reports the paths removed ('-') & added
+('+') between two snapshots, or a snapshot & the resulting PYTHONPATH, on
+stderr.
+
+If a command follows '--', it is run with the resulting PYTHONPATH in place of
+pypath (which echoes nothing).  Fan-out files list a command per line, each
+after any add & remove actions of its own, like '-a shard1.pth -- pytest 1'.
+The 'fanout' option runs these commands with the resulting PYTHONPATH (& their
+own actions) on up to 'procs' processes at once.  Each line of their output is
+prefixed by the command's line number, & each exit code is reported on stderr.
+Run 'pypath.py' for commands, rather than 'pypath', which would capture them.
+
+If 'echo' is specificed, the PYTHONPATH value is echoed once at the end.
+If 'clear' is specified, the PYTHONPATH is cleared once at the start.
+The 'permanent' option sets the default PYTHONPATH value once at the end.
+The 'site' option writes the resulting paths to a 'pypath.pth' file in the user
+site dir (or virtual environment) of each 'python', once at the end.  Python
+adds the paths to 'sys.path' at startup, after its site-packages, without any
+environment variable to pass on to child processes.
+Paths to add are checked on 'jobs' threads at once, waiting up to 'sec' seconds
+for each path, which helps on slow or network filesystems.
+The 'index' option indexes modules in the PYTHONPATH once at the end, and
+reports module names found in more than one directory.
+The 'usage' option moves the directories that provide the most imports (as
+recorded by 'pypath_import.record_usage') to the front of the PYTHONPATH, once,
+before the PYTHONPATH is made permanent.  Directories are never moved if that
+would change which one provides a module that is in more than one.
+The 'compile' option compiles the modules in the directories added to the
+PYTHONPATH (or all of them, if it is made permanent) for 'python', on up to
+'procs' processes at once.  Modules with current bytecode are skipped.  If a
+'dir' is given, bytecode is written under it, for read-only directories
+(this needs Python 3.8+, with PYTHONPYCACHEPREFIX set to 'dir' to use it).
+The 'farm' option links the modules & packages of the PYTHONPATH from one dir
+of symlinks, & sets the PYTHONPATH to just that dir.  Each name is linked to
+the directory it would be imported from, & names in more than one directory are
+reported.  Only links to changed directories are updated.
+The 'bundle' option packs the pure Python modules & packages of the PYTHONPATH
+into a zip archive, with bytecode, & sets the PYTHONPATH to just that archive.
+Each name is taken from the directory it would be imported from.  Extension
+modules are reported & left out.  Only changed files are compiled again.
+The 'measure' option imports modules in a child 'python', using the resulting
+PYTHONPATH, and reports the time spent searching each directory, the number of
+failed lookups, and an order that would fail less often (without changing which
+directory provides any module that is in more than one).
+The 'timings' option reports the time taken by each phase, & counts of the work
+done, on stderr.  The 'cprofile' option saves 'cProfile' stats to a file, for
+'python -m pstats', or prints the slowest functions on stderr if file is '-'.
+
+Profiles save a list of actions by name.  Each profile is compiled to a shell
+script, which 'pypath -p' runs directly until a path file it uses changes.
+The 'watch' option recompiles profiles as soon as a path file or directory
+they use changes, until interrupted.  If the default was set with
+'pypath -p name -d' it is updated too.  Updates wait for a burst of changes
+(e.g. saves) to end.
+
+Examples:
+  pypath -a .            # Add current dir to PYTHONPATH.
+  pypath -r .. .         # Remove parent & current dirs from PYTHONPATH.
+  pypath -a foo.pth      # Add the contents of './foo.pth' to PYTHONPATH.
+  pypath -r *.pth        # Remove contents of all '.pth' files from PYTHONPATH.
+  pypath -c -a .         # Clear and set PYTHONPATH to the current directory.
+  pypath -c -a .. . -e   # Clear, set, and echo the PYTHONPATH.
+  pypath -s foo -a foo.pth  # Add & save contents of './foo.pth' as 'foo'.
+  pypath -p foo          # Set PYTHONPATH to profile 'foo'.
+  pypath -p foo -d       # Set PYTHONPATH & the default to profile 'foo'.
+  pypath.py -w           # Keep profiles (& the default) up to date.
+  pypath -m foo bar      # Report the cost of importing 'foo' & 'bar'.
+  pypath -u -d           # Put the most used dirs first, & save as default.
+  gen | pypath -b -      # Perform actions listed by 'gen', one arg per line.
+  pypath -z all.zip -d   # Bundle the PYTHONPATH, & save the bundle as default.
+  pypath -C -a src       # Add 'src', & compile its modules.
+  pypath -C -K ~/pyc -x python3 -a /mnt/src  # Compile a read-only dir.
+  pypath -l ~/farm -d    # Link the PYTHONPATH from one dir, & save as default.
+  pypath.py -a foo.pth -- pytest     # Run 'pytest' with foo's paths added.
+  pypath.py -F shards -n 4  # Run commands in 'shards', 4 at a time.
+  pypath --undo          # Go back to the previous PYTHONPATH.
+  pypath --diff 3        # Report changes since snapshot 3.
+  pypath -P -D           # Prune dead entries from the current & default paths.
+  pypath -R -a ~/src/*   # Add dirs, listing symlinked dirs only once.
+  pypath -c -a . -S python2 python3  # Use current dir in both interpreters.
+
+Any number of paths can be specified after an 'add' or 'remove' flag. These are
+prepended to the PYTHONPATH as a group, so earlier additions have a higher
+priority:
+  $ pypath -c -a bin tmp usr -e
+  /bin:/tmp:/usr
+
+Any number of 'add' or 'remove' actions can be specified. These are performed
+sequentially. The PYTHONPATH is prepended by each action, so later additions
+have a higher priority:
+  $ pypath -c -a bin -a tmp -a usr -e
+  /usr:/tmp:/bin
+"""
+
+
+class PyPathError(ValueError):
+    """
+    Error in the paths, path files or profiles specified by the user.
+
+    The message is what 'pypath' prints.  The 'path' attribute is the
+    path, file or profile name the error is about, if any.
+    """
+    def __init__(self, message, path=None):
+        super(PyPathError, self).__init__(message)
+        self.path = path
+
+
+class PathError(PyPathError):
+    """
+    Path to add or remove failed its check.
+    """
+
+
+class PathNotFound(PathError):
+    """
+    Path to add does not exist.
+    """
+
+
+class NotADirectory(PathError):
+    """
+    Path to add is not a directory.
+    """
+
+
+class PathTimedOut(PathError):
+    """
+    Path to add could not be checked in time.
+    """
+
+
+class PathUnreadable(PathError):
+    """
+    Path is a directory that cannot be searched for modules.
+    """
+
+
+class NotOnPath(PathError):
+    """
+    Path to remove is not (and was not) on the PYTHONPATH.
+    """
+
+
+class PathFileError(PyPathError):
+    """
+    Path file (or batch file) cannot be used, e.g. has no paths.
+    """
+
+
+class SnapshotError(PyPathError):
+    """
+    Snapshot cannot be found, or there is none to undo to.
+    """
+
+
+class ProfileError(PyPathError):
+    """
+    Profile name is invalid, or the profile does not exist.
+    """
+
+
+def main():
+    """
+    Parse command line & perform actions on PYTHONPATH.
+    """
+    #print sys.argv
+    TIMINGS.reset()
+    with TIMINGS.phase('parse'):
+        argv, command = split_command(sys.argv[1:])
+        args = parse_args_fast(argv)
+        if args is None:
+            try:
+                if len(argv) == 0 and command is None:
+                    argv = ["-h"]   # Show help if run with no args.
+                args = get_parser().parse_args(argv)
+            except SystemExit as exc:
+                if '-h' in argv or '--help' in argv:
+                    sys.exit(HELP)
+                else:
+                    sys.exit(ERROR)
+        args.command = command
+    #print args
+    profiler = None
+    if args.cprofile is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        run(args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            write_profile(profiler, args.cprofile)
+        if args.timings:
+            TIMINGS.report(sys.stderr)
+
+
+def run(args):
+    """
+    Perform parsed actions on PYTHONPATH & echo the result.
+    """
+    try:
+        pythonpath = os.getenv("PYTHONPATH", None).split(':')
+    except AttributeError:  # pythonpath is None.
+        pythonpath = []
+    if args.clear:
+        path_list = []
+    else:
+        path_list = pythonpath
+    try:
+        actions = args.actions
+        if args.batch is not None:
+            actions = read_batch(args.batch, actions)
+            if args.save is not None:
+                actions = list(actions)     # Saved as well as performed.
+        if args.profile is not None:
+            with TIMINGS.phase('profile'):
+                profile = load_profile(args.profile)
+                path_list = use_profile(args.profile, args.jobs, args.timeout)
+        restored = args.undo or args.restore is not None
+        if restored:
+            with TIMINGS.phase('restore'):
+                if args.restore is not None:
+                    path_list = load_snapshot(args.restore)
+                else:
+                    path_list = get_undo_snapshot(join_paths(pythonpath))
+        if args.prune:
+            with TIMINGS.phase('prune'):
+                path_list, errors = prune_paths(path_list, args.jobs,
+                    args.timeout)
+            for err in errors:
+                sys.stderr.write("Pruned: {}\n".format(err))
+        if args.prune_default:
+            with TIMINGS.phase('prune_default'):
+                errors = prune_default(args.jobs, args.timeout)
+            for err in errors:
+                sys.stderr.write("Pruned: {}\n".format(err))
+        with TIMINGS.phase('set_paths'):
+            path_list = set_paths(pythonpath, path_list, actions,
+                args.force, args.jobs, args.timeout, args.canonical)
+            path_list = join_paths(path_list)
+        if args.usage:
+            with TIMINGS.phase('usage'):
+                path_list, kept = order_by_usage(path_list)
+            for (first, path), names in kept:
+                sys.stderr.write("Not reordering: '{}' must stay ahead of"
+                    " '{}' (both provide {})\n".format(first, path, ", ".join(
+                    "'{}'".format(name) for name in names)))
+        if args.compile:
+            dirs = path_list if args.permanent else [path
+                for path in path_list if path not in pythonpath]
+            with TIMINGS.phase('compile'):
+                failed = compile_paths(dirs, args.python, args.procs,
+                    args.cache_prefix)
+            for source, error in failed:
+                sys.stderr.write("Not compiled: '{}': {}\n".format(source,
+                    error))
+        if args.farm is not None:
+            with TIMINGS.phase('farm'):
+                farm, shadowed = farm_paths(path_list, args.farm)
+            for name, path, paths in shadowed:
+                sys.stderr.write("Shadowed: '{}' in '{}' (also in {})\n"
+                    .format(name, path, ", ".join(
+                    "'{}'".format(other) for other in paths)))
+            path_list = [farm]
+        if args.bundle is not None:
+            with TIMINGS.phase('bundle'):
+                archive, skipped = bundle_paths(path_list, args.bundle)
+            for name, path in skipped:
+                sys.stderr.write("Not bundled: '{}' in '{}'\n".format(name,
+                    path))
+            path_list = [archive]
+        if args.save is not None:
+            with TIMINGS.phase('save'):
+                if args.profile is not None:
+                    actions = profile['actions'] + actions
+                save_profile(args.save, actions, args.force)
+                use_profile(args.save, args.jobs, args.timeout)
+        if args.permanent:
+            with TIMINGS.phase('set_permanently'):
+                set_permanently(path_list)
+                default = None
+                if args.profile is not None and args.batch is None and \
+                        len(args.actions) == 0 and not args.usage and \
+                        args.farm is None and args.bundle is None:
+                    default = args.profile
+                set_default_profile(default)
+        if args.site is not None:
+            with TIMINGS.phase('set_site'):
+                for python, filename, written in set_site(path_list,
+                        args.site):
+                    sys.stderr.write("{} '{}' for '{}'\n".format(
+                        "Wrote" if written else "Unchanged", filename, python))
+        if args.index:
+            with TIMINGS.phase('set_index'):
+                shadowed = set_index(path_list)
+            for name, paths in shadowed:
+                sys.stderr.write("Shadowed: '{}' in '{}' (also in {})\n"
+                    .format(name, paths[0], ", ".join(
+                    "'{}'".format(path) for path in paths[1:])))
+        if args.measure is not None:
+            with TIMINGS.phase('measure'):
+                results = time_imports(path_list, args.measure, args.python)
+                report = get_import_report(results, path_list,
+                    get_providers(path_list))
+            sys.stderr.write("".join(line + "\n" for line in report))
+        if args.watch:
+            watch_profiles()
+        if args.history:
+            sys.stderr.write("".join(line + "\n"
+                for line in get_history_report()))
+        if args.diff is not None:
+            if len(args.diff) > 2:
+                raise PyPathError("Too many snapshots to diff: {}".format(
+                    ", ".join("'{}'".format(name) for name in args.diff)))
+            new = path_list if len(args.diff) == 1 else \
+                load_snapshot(args.diff[1])
+            sys.stderr.write("".join(line + "\n" for line in
+                get_snapshot_diff(load_snapshot(args.diff[0]), new)))
+        if args.fanout is not None:
+            commands = []
+            with TIMINGS.phase('fanout'):
+                for actions, command in read_fanout(args.fanout):
+                    commands.append((join_paths(set_paths(pythonpath,
+                        path_list, actions, args.force, args.jobs,
+                        args.timeout, args.canonical)), command))
+            codes = fan_out(commands, args.procs)
+            if any(code != 0 for code in codes):
+                sys.exit(ERROR)
+        elif args.command is not None:
+            exec_command(args.command, path_list)
+        else:
+            # Queries & unchanged paths are not recorded, which is slow.
+            if not restored and not args.history and args.diff is None \
+                    and path_list != join_paths(pythonpath):
+                with TIMINGS.phase('snapshot'):
+                    record_snapshot(join_paths(pythonpath))
+                    record_snapshot(path_list)
+            print ":".join(path_list)   # Always echo.
+    except Exception as exc:
+        print str(exc)  # Do not indimidate user with a traceback.
+        sys.exit(ERROR)
+
+
+def get_parser():
+    """
+    Get command line parser.
+
+    The 'argparse' module is slow to import, so it is only imported
+    here, for command lines that 'parse_args_fast' does not handle.
+    """
+    import argparse
+
+    class Parser(argparse.ArgumentParser):
+        """
+        Do not print 'self.prog' if error.
+        """
+        def exit(self, status=0, message=None):
+            try:
+                message = message.replace("{}: ".format(self.prog), "")
+            except AttributeError:
+                pass
+            super(Parser, self).exit(status, message)
+
+    class AppendWithArg(argparse._AppendAction):
+        """
+        Include option string when appending values.
+        """
+        def __call__(self, parser, namespace, values, option_string=None):
+            #values = [value for value in values if len(value) > 0]  # Remove blank.
+            values = (option_string, values)
+            super(AppendWithArg, self).__call__(parser, namespace, values,
+                option_string)
+
+    doc = __doc__.strip().split("\n")
+    parser = Parser(
+        usage=USAGE,
+        description=DESCRIPTION,
+        epilog=EPILOG,
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    # Help is provided for free.
+    # Echo is always true.
+    parser.add_argument('-e', dest='echo', action='store_true', default=True,
+        help='Echo the PYTHONPATH environment variable.')
+    parser.add_argument('-c', dest='clear', action='store_true', default=False,
+        help='Clear the PYTHONPATH environment variable completely.')
+    parser.add_argument('-a', dest='actions', action=AppendWithArg, nargs='+',
+        metavar='pth', default=[], help=('If path is a directory, add it to the'
+        ' PYTHONPATH.\nIf path is a file, add contents to the PYTHONPATH.'))
+    parser.add_argument('-r', dest='actions', action=AppendWithArg, nargs='+',
+        metavar='pth', default=[], help=('If path is a directory, remove it'
+        ' from the PYTHONPATH.\nIf path is a file, remove contents from the'
+        ' PYTHONPATH.'))
+    parser.add_argument('-d', dest='permanent', action='store_true',
+        default=False, help=('Permanently save the current PYTHONPATH value as'
+        ' the default.'))
+    parser.add_argument('-i', dest='index', action='store_true',
+        default=False, help=('Index modules in the PYTHONPATH for fast'
+        ' imports (see pypath_import.py).'))
+    parser.add_argument('-u', dest='usage', action='store_true',
+        default=False, help=('Put the PYTHONPATH directories that provide the'
+        ' most imports first.'))
+    parser.add_argument('-R', dest='canonical', action='store_true',
+        default=False, help=('Resolve symlinks, so each directory is listed'
+        ' once however it is\nspelled.'))
+    parser.add_argument('-P', dest='prune', action='store_true',
+        default=False, help=('Remove missing, unreadable & non-directory'
+        ' entries from the\nPYTHONPATH, first.'))
+    parser.add_argument('-D', dest='prune_default', action='store_true',
+        default=False, help=('Remove missing, unreadable & non-directory'
+        ' entries from the\ndefault PYTHONPATH.'))
+    parser.add_argument('-C', dest='compile', action='store_true',
+        default=False, help=('Compile the modules in added dirs (all dirs,'
+        ' with -d).'))
+    parser.add_argument('-K', dest='cache_prefix', metavar='dir',
+        help="Write bytecode compiled by '-C' under dir (Python 3.8+).")
+    parser.add_argument('-w', dest='watch', action='store_true',
+        default=False, help=('Recompile profiles when path files change,'
+        ' until interrupted.'))
+    parser.add_argument('-b', dest='batch', metavar='file',
+        help=("Read more actions from a batch file ('-' for stdin)."))
+    parser.add_argument('-l', dest='farm', metavar='dir',
+        help=('Link the PYTHONPATH modules from one dir of symlinks, & use'
+        ' only that.'))
+    parser.add_argument('-z', dest='bundle', metavar='zip',
+        help=('Bundle the PYTHONPATH into a zip archive, & use only that.'))
+    parser.add_argument('-f', dest='force', action='store_true', default=False,
+        help='Force execution without checking user input.')
+    parser.add_argument('-p', dest='profile', metavar='name',
+        help=('Use a saved profile, starting from a clear PYTHONPATH.'))
+    parser.add_argument('-s', dest='save', metavar='name',
+        help=('Save the add & remove actions (including those of any'
+        ' profile used)\nas a profile.'))
+    parser.add_argument('-j', dest='jobs', type=int, default=JOBS,
+        metavar='jobs', help=('Number of paths to check at once'
+        ' (default: {}).'.format(JOBS)))
+    parser.add_argument('-t', dest='timeout', type=float, default=TIMEOUT,
+        metavar='sec', help=('Seconds to wait for each path to be checked'
+        ' (default: {}).'.format(TIMEOUT)))
+    parser.add_argument('-m', dest='measure', nargs='+', metavar='module',
+        help=('Measure the cost of importing modules with the resulting'
+        ' PYTHONPATH.'))
+    parser.add_argument('-x', dest='python', metavar='python',
+        help=("Python interpreter used by '-m' & '-C' (default: this"
+        ' one).'))
+    parser.add_argument('-S', dest='site', nargs='+', metavar='python',
+        help=("Write the PYTHONPATH to a '{}' file in the site dir of each"
+        ' interpreter.'.format(SITE_PTH)))
+    parser.add_argument('-F', dest='fanout', metavar='file',
+        help=("Run the commands in a fan-out file ('-' for stdin), instead"
+        ' of echoing.'))
+    parser.add_argument('-n', dest='procs', type=int, metavar='procs',
+        help="Number of fan-out commands run at once (default: CPUs).")
+    parser.add_argument('--history', dest='history', action='store_true',
+        default=False, help='List saved PYTHONPATH snapshots on stderr.')
+    parser.add_argument('--undo', dest='undo', action='store_true',
+        default=False, help=('Start from the snapshot before the current'
+        ' PYTHONPATH.'))
+    parser.add_argument('--restore', dest='restore', metavar='snapshot',
+        help='Start from a snapshot (by number or hash prefix).')
+    parser.add_argument('--diff', dest='diff', nargs='+', metavar='snapshot',
+        help=('Report changes from a snapshot to another (or the result) on'
+        ' stderr.'))
+    parser.add_argument('-T', '--timings', dest='timings', action='store_true',
+        default=False, help='Report time taken by each phase on stderr.')
+    parser.add_argument('--cprofile', dest='cprofile', metavar='file',
+        help="Save 'cProfile' stats to file ('-' for stderr).")
+    parser.set_defaults(**get_defaults())
+    return parser
+
+
+def get_defaults():
+    """
+    Get default values of parsed arguments.
+    """
+    return dict(echo=True, clear=False, actions=[], permanent=False,
+        force=False, index=False, usage=False, watch=False, canonical=False,
+        prune=False, prune_default=False, compile=False, cache_prefix=None,
+        history=False, undo=False, restore=None, diff=None, fanout=None,
+        procs=None, jobs=JOBS, timeout=TIMEOUT, profile=None, save=None,
+        batch=None, farm=None, bundle=None, site=None, timings=False,
+        cprofile=None, measure=None, python=None, command=None)
+
+
+class Args(object):
+    """
+    Parsed arguments, like 'argparse.Namespace'.
+    """
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class Timings(object):
+    """
+    Wall time of each phase of a run, & counts of the work done.
+
+    Phases are timed with 'with TIMINGS.phase(name):', and may be
+    nested.  Repeats of a phase (within the same phases) are added up.
+    Collecting timings is cheap, so it is always done, but they are
+    only reported with '-T'.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """
+        Forget phases & counts, restarting the total time.
+        """
+        self.start = time.time()
+        self.phases = []    # [depth, name, seconds], in start order.
+        self.keys = {}      # Names of a phase & its parents, to its index.
+        self.stack = []     # (key, phase index, start time) of open phases.
+        self.counts = {}
+        self.name = None
+
+    def phase(self, name):
+        """
+        Return a context manager timing a phase called name.
+        """
+        self.name = name
+        return self
+
+    def __enter__(self):
+        key = (self.stack[-1][0] if self.stack else ()) + (self.name,)
+        index = self.keys.get(key)
+        if index is None:
+            index = self.keys[key] = len(self.phases)
+            self.phases.append([len(key) - 1, self.name, 0.0])
+        self.stack.append((key, index, time.time()))
+        return self
+
+    def __exit__(self, *exc_info):
+        key, index, start = self.stack.pop()
+        self.phases[index][2] += time.time() - start
+
+    def count(self, name, number=1):
+        """
+        Add to the count of things called name.
+        """
+        self.counts[name] = self.counts.get(name, 0) + number
+
+    def report(self, fh):
+        """
+        Write phase times (in milliseconds) & counts to a file.
+        """
+        lines = ["Timings (ms):"]
+        for depth, name, seconds in self.phases:
+            lines.append("  {:<24}{:>10.2f}".format("  " * depth + name,
+                seconds * 1000))
+        lines.append("  {:<24}{:>10.2f}".format("total",
+            (time.time() - self.start) * 1000))
+        if len(self.counts) > 0:
+            lines.append("Counts:")
+            for name, number in sorted(self.counts.items()):
+                lines.append("  {:<24}{:>10}".format(name, number))
+        fh.write("".join(line + "\n" for line in lines))
+
+
+TIMINGS = Timings()
+
+
+def write_profile(profiler, filename):
+    """
+    Save 'cProfile' stats, or print the slowest functions if filename
+    is '-'.  The output is written to stderr, so as not to be mistaken
+    for the PYTHONPATH.
+    """
+    if filename != '-':
+        profiler.dump_stats(filename)
+        return
+    import pstats
+    stats = pstats.Stats(profiler, stream=sys.stderr)
+    stats.sort_stats('cumulative').print_stats(20)
+
+
+def split_command(argv):
+    """
+    Split arguments at the first '--', into pypath arguments & a command
+    to run (or None).
+    """
+    if '--' not in argv:
+        return argv, None
+    index = argv.index('--')
+    return argv[:index], argv[index + 1:]
+
+
+def parse_args_fast(argv):
+    """
+    Parse common command lines without building the full parser.
+
+    Only the flags in 'FAST_FLAGS' & the actions in 'FAST_ACTIONS' are
+    handled.  Returns None for anything else (including help & errors),
+    which should be parsed by 'get_parser' instead.
+    """
+    args = Args(**get_defaults())
+    paths = None    # Paths of the current action.
+    for arg in argv:
+        if paths == [] and arg.startswith('-'):
+            return None     # Action without paths.
+        if arg in FAST_ACTIONS:
+            paths = []
+            args.actions.append((arg, paths))
+        elif arg in FAST_FLAGS:
+            paths = None
+            setattr(args, FAST_FLAGS[arg], True)
+        elif arg.startswith('-') or paths is None:
+            return None
+        else:
+            paths.append(arg)
+    if paths == [] or len(argv) == 0:
+        return None
+    return args
+
+
+def set_paths(all_paths, path_list, actions, force, jobs=None, timeout=None,
+        canonical=False):
+    """
+    Add or remove paths.
+
+    Paths are specified by descending priority with: -a 1 2 3
+    Paths are specified by ascending priority with: -a 3 -a 2 -a 1
+    The 'path_list' parameter is used to track the working PYTHONPATH.
+    The 'all_paths' parameter is used to track paths that were present
+    at *any time* during or before execution.  This allows the user to
+    specify extra valid removes (like -a p1 -r p1 -r p1) without an
+    error.
+    Paths given (to tell path files from dirs) & paths to add are checked
+    up front by 'get_path_modes', with a single stat each, using 'jobs'
+    threads & waiting 'timeout' seconds per path.  Errors are still
+    raised in the order the paths were specified.
+    Wildcard lines in path files add all the dirs they match, & remove
+    those that are on the PYTHONPATH.
+    Actions may be any iterable, such as a generator reading a batch
+    file.  They are resolved & checked in chunks of about BATCH_SIZE
+    paths, so only the chunk & the resulting paths are held at once.
+    If 'canonical', paths are compared by the directory they resolve to
+    (see 'PathResolver'), and only the highest priority spelling of
+    each directory is returned.
+    """
+    key = PathResolver().key if canonical else None
+    all_paths = set(all_paths)
+    all_paths.update(path_list)
+    if key is not None:
+        all_paths = set(key(path) for path in all_paths)
+    ordered = OrderedPaths(path_list, key)
+    memo = {}   # Path files already read.
+    for chunk in get_chunks(actions):
+        with TIMINGS.phase('check'):
+            modes = get_path_modes([format_path(path)
+                for action, paths in chunk for path in paths], jobs, timeout)
+        with TIMINGS.phase('read'):
+            resolved = get_action_paths(chunk, force, memo, modes=modes)
+        if not force:
+            with TIMINGS.phase('check'):
+                modes.update(get_path_modes([item[0]
+                    for action, items in resolved if action in ['-a', '--add']
+                    for item in items if not isinstance(item, Exception)
+                    and item[0] not in modes], jobs, timeout))
+        for action, items in resolved:
+            altered = []  # Action is either adding or removing.
+            for item in items:
+                if isinstance(item, Exception):
+                    raise item
+                formatted, original, file, matched = item
+                if not force:
+                    if action in ['-a', '--add']:
+                        check_path_add(formatted, original, file, modes)
+                    if action in ['-r', '--remove'] and not matched:
+                        check_path_remove(all_paths, formatted, original,
+                            file, key)
+                altered.append(formatted)
+
+            if action in ['-a', '--add']:
+                ordered.prepend(altered)
+                all_paths.update(altered if key is None else
+                    (key(path) for path in altered))
+            else:
+                ordered.remove(altered)
+    if key is not None:
+        return ordered.unique()
+    return list(ordered)
+
+
+def get_chunks(actions, size=None):
+    """
+    Yield lists of actions, with about 'size' paths in each list.
+    """
+    size = BATCH_SIZE if size is None else size
+    chunk = []
+    count = 0
+    for action in actions:
+        chunk.append(action)
+        count += len(action[1])
+        if count >= size:
+            yield chunk
+            chunk = []
+            count = 0
+    if len(chunk) > 0:
+        yield chunk
+
+
+def read_batch(filename, actions=()):
+    """
+    Yield the actions, then the actions in a batch file.
+
+    Batch files list arguments one per line, like a command line of add
+    & remove actions.  Blank lines & comments are ignored.  Removals
+    are split into groups of up to BATCH_SIZE paths, which has the same
+    effect, so that a long batch file is never held in memory.
+    """
+    for action in actions:
+        yield action
+    fh = sys.stdin if filename == '-' else open(filename)
+    try:
+        action = None
+        paths = []
+        count = 0   # Paths of the current action.
+        number = 0
+        for number, line in enumerate(fh, 1):
+            line = line.rstrip('\n')
+            if len(line.strip()) == 0 or line.startswith('#'):
+                continue
+            if line in ['-a', '--add', '-r', '--remove']:
+                if action is not None:
+                    check_batch_action(action, count, filename, number)
+                    if len(paths) > 0:
+                        yield action, paths
+                action = line
+                paths = []
+                count = 0
+            elif action is None:
+                raise PathFileError("No action for path: '{}' (line {} in"
+                    " '{}')".format(line, number, filename), filename)
+            else:
+                paths.append(line)
+                count += 1
+                if len(paths) >= BATCH_SIZE and action in ['-r', '--remove']:
+                    yield action, paths
+                    paths = []
+        if action is not None:
+            check_batch_action(action, count, filename, number + 1)
+            if len(paths) > 0:
+                yield action, paths
+    finally:
+        if fh is not sys.stdin:
+            fh.close()
+
+
+def check_batch_action(action, count, filename, number):
+    """
+    Check that a batch file action has paths, like the command line.
+    """
+    if count == 0:
+        raise PathFileError("No paths for '{}' (before line {} in '{}')"
+            .format(action, number, filename), filename)
+
+
+def get_action_paths(actions, force, memo=None, dirs=None, modes=None):
+    """
+    Format the paths specified for each action, reading path files.
+
+    Returns (action, items) pairs, where each item is a (formatted,
+    original, file, matched) tuple.  Errors reading path files are
+    returned in place of items, so they can be raised in order.
+    Path file lines containing wildcards are expanded to the dirs they
+    match (which are 'matched'), using the 'dirs' DirCache, unless the
+    line names an existing path.  The 'memo' dict collects the path
+    files read.  Path files are told from dirs by the modes of the
+    formatted paths in 'modes', if present.
+    """
+    memo = {} if memo is None else memo     # Path files already read.
+    resolved = []
+    for action, paths in actions:
+        items = []
+        for path in paths:
+            formatted = format_path(path)
+            if modes is not None and formatted in modes:
+                mode = modes[formatted]
+                is_file = mode is not None and mode != TIMED_OUT and \
+                    stat.S_ISREG(mode)
+            else:
+                is_file = os.path.isfile(path)
+
+            if is_file:
+                try:
+                    entries = get_file_entries(path, memo)
+                    if not force and len(entries) == 0:
+                        raise PathFileError("No paths in file: '{}'".format(
+                            path), path)
+                except (IOError, OSError, PyPathError) as exc:
+                    items.append(exc)
+                    continue
+                for line, formatted, file in entries:
+                    if GLOB_CHARS.search(line) is None or \
+                            os.path.lexists(formatted):
+                        items.append((formatted, line, file, False))
+                        continue
+                    if dirs is None:
+                        dirs = DirCache(DIR_CACHE_PATH)
+                    matches = expand_glob(formatted, dirs)
+                    if not force and len(matches) == 0 and \
+                            action in ['-a', '--add']:
+                        items.append(PathFileError("No paths match: '{}'{}"
+                            .format(formatted, get_path_details(formatted,
+                            line, file)), file))
+                    items.extend((match, line, file, True)
+                        for match in matches)
+
+            else:
+                items.append((formatted, path, None, False))
+
+        resolved.append((action, items))
+    if dirs is not None:
+        dirs.save()
+    return resolved
+
+
+def expand_glob(pattern, dirs):
+    """
+    Return sorted dirs matching an absolute wildcard pattern.
+
+    Wildcards are as for 'fnmatch', and '**' matches any number of
+    nested dirs, up to GLOB_DEPTH.  Wildcards do not match hidden dirs
+    (unless the pattern starts with '.') or dirs in GLOB_EXCLUDE.
+    Dir listings come from the 'dirs' DirCache.
+    """
+    import fnmatch  # Only needed for patterns.
+    parts = pattern.split(os.sep)
+    start = 0
+    while start < len(parts) and GLOB_CHARS.search(parts[start]) is None:
+        start += 1
+    base = os.sep.join(parts[:start]) or os.sep
+    if not os.path.isdir(base):
+        return []
+    paths = [base]
+    for part in parts[start:]:
+        matches = []
+        for path in paths:
+            if part == '**':
+                matches.extend(walk_dirs(path, dirs, GLOB_DEPTH))
+            elif GLOB_CHARS.search(part) is None:
+                if part in dirs.get_subdirs(path):
+                    matches.append(os.path.join(path, part))
+            else:
+                matches.extend(os.path.join(path, name)
+                    for name in dirs.get_subdirs(path)
+                    if is_glob_match(name, part)
+                    and fnmatch.fnmatchcase(name, part))
+        paths = matches
+    return sorted(set(paths))
+
+
+def walk_dirs(path, dirs, depth):
+    """
+    Return path & the dirs nested up to 'depth' levels under it.
+    """
+    found = [path]
+    if depth > 0:
+        for name in dirs.get_subdirs(path):
+            if is_glob_match(name, '*'):
+                found.extend(walk_dirs(os.path.join(path, name), dirs,
+                    depth - 1))
+    return found
+
+
+def is_glob_match(name, part):
+    """
+    Return False if a dir name is pruned from matching a pattern part.
+    """
+    if name.startswith('.') and not part.startswith('.'):
+        return False
+    return name not in GLOB_EXCLUDE
+
+
+class DirCache(object):
+    """
+    Names of the subdirs of each dir, cached by the dir's mtime.
+
+    Only dirs that have changed are listed again, so expanding patterns
+    over large trees costs one stat per unchanged dir.
+    """
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.dirs = {}      # Dir to (mtime, subdir names).
+        self.used = set()   # Dirs listed by this instance.
+        self.changed = False
+        if filename is not None:
+            try:
+                with open(os.path.expanduser(filename), 'rb') as fh:
+                    self.dirs = marshal.load(fh)
+            except (IOError, OSError, EOFError, ValueError, TypeError):
+                pass    # Missing, unreadable or corrupt cache file.
+
+    def get_subdirs(self, path):
+        """
+        Return sorted names of subdirs of path.
+        """
+        self.used.add(path)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return []
+        entry = self.dirs.get(path)
+        if entry is None or entry[0] != mtime:
+            TIMINGS.count('dirs listed')
+            try:
+                names = os.listdir(path)
+            except OSError:
+                names = []
+            entry = (mtime, sorted(name for name in names
+                if os.path.isdir(os.path.join(path, name))))
+            # Skip caching dirs modified too recently to have a reliable
+            # mtime.
+            if time.time() - mtime > 1:
+                self.dirs[path] = entry
+                self.changed = True
+        return entry[1]
+
+    def save(self):
+        """
+        Write changes to the cache file, keeping at most DIR_CACHE_SIZE
+        dirs.  Failure to write the cache is not an error.
+        """
+        if self.filename is None or not self.changed:
+            return
+        if len(self.dirs) > DIR_CACHE_SIZE:
+            self.dirs = dict((path, entry) for path, entry in
+                self.dirs.items() if path in self.used)
+        filename = os.path.expanduser(self.filename)
+        tmp_file = "{}.{}".format(filename, os.getpid())
+        try:
+            with open(tmp_file, 'wb') as fh:
+                marshal.dump(self.dirs, fh)
+            os.rename(tmp_file, filename)
+            self.changed = False
+        except (IOError, OSError):
+            pass
+
+
+def get_path_modes(paths, jobs=None, timeout=None, readable=False):
+    """
+    Stat paths on a pool of threads, for slow or network filesystems.
+
+    Returns a dict of path to mode, which is None if the path does not
+    exist, or TIMED_OUT if it was not checked within 'timeout' seconds.
+    Threads checking a path that timed out are abandoned & replaced, &
+    all others have exited when this returns.
+    Up to INLINE_CHECKS paths (or any number, if 'jobs' is 1) are
+    checked on this thread instead, without a timeout, as starting
+    threads costs far more than a stat.
+    If 'readable', dirs that cannot be listed & searched are UNREADABLE
+    (as permissions cannot be told from the mode alone, e.g. for root).
+    """
+    jobs = JOBS if jobs is None else jobs
+    timeout = TIMEOUT if timeout is None else timeout
+    paths = set(paths)
+    count = len(paths)
+    TIMINGS.count('paths checked', count)
+    if count <= INLINE_CHECKS or jobs <= 1:
+        return dict((path, get_path_mode(path, readable)) for path in paths)
+    import Queue
+    import select
+    import threading
+    todo = Queue.Queue()
+    for path in paths:
+        todo.put(path)
+    results = Queue.Queue()     # Checked (path, mode), or None to wake.
+    wake, done = os.pipe()  # Closing 'done' wakes the watchdog at once.
+    started = {}
+    threads = []
+    hung = set()
+    modes = {}
+
+    def worker():
+        thread = threading.current_thread()
+        while True:
+            try:
+                path = todo.get_nowait()
+            except Queue.Empty:
+                return
+            started[path] = (time.time(), thread)
+            results.put((path, get_path_mode(path, readable)))
+
+    def watchdog():
+        tick = max(timeout / 10, 0.001)
+        while not select.select([wake], [], [], tick)[0]:
+            results.put(None)
+
+    def start_thread(target):
+        thread = threading.Thread(target=target)
+        thread.daemon = True    # Do not wait for hung threads on exit.
+        thread.start()
+        threads.append(thread)
+
+    try:
+        for _ in range(min(jobs, count)):
+            start_thread(worker)
+        start_thread(watchdog)
+        while len(modes) < count:
+            result = results.get()  # Blocks, where a timed wait would poll.
+            if result is not None:
+                modes.setdefault(*result)
+                continue
+            now = time.time()
+            for path, (start, thread) in started.items():
+                if path not in modes and now - start > timeout:
+                    modes[path] = TIMED_OUT
+                    hung.add(thread)
+                    start_thread(worker)
+    finally:
+        os.close(done)
+        for thread in threads:
+            if thread not in hung:
+                thread.join()
+        os.close(wake)
+    return modes
+
+
+def get_path_mode(path, readable=False):
+    """
+    Return the mode of path, or None if it does not exist, as for
+    'get_path_modes'.
+    """
+    try:
+        mode = os.stat(path).st_mode
+    except OSError:
+        return None
+    if readable and stat.S_ISDIR(mode) and \
+            not os.access(path, os.R_OK | os.X_OK):
+        return UNREADABLE
+    return mode
+
+
+def check_path_add(formatted, original, file=None, modes=None):
+    """
+    Check that path exists, and is a directory.
+
+    The path's mode is taken from 'modes' if present, else the path is
+    checked with a single stat.
+    """
+    if modes is not None and formatted in modes:
+        mode = modes[formatted]
+    else:
+        mode = get_path_mode(formatted)
+    if mode == TIMED_OUT:
+        raise PathTimedOut("Timed out: '{}'{}".format(formatted,
+            get_path_details(formatted, original, file)), formatted)
+    if mode is None:
+        raise PathNotFound("Path not found: '{}'{}".format(formatted,
+            get_path_details(formatted, original, file)), formatted)
+    if mode == UNREADABLE:
+        raise PathUnreadable("Unreadable: '{}'{}".format(formatted,
+            get_path_details(formatted, original, file)), formatted)
+    if not stat.S_ISDIR(mode):
+        raise NotADirectory("Not a directory: '{}'{}".format(formatted,
+            get_path_details(formatted, original, file)), formatted)
+
+
+def prune_paths(path_list, jobs=None, timeout=None, file=None):
+    """
+    Remove blank, missing, non-dir & unreadable paths from path_list.
+
+    All paths are checked at once, as by 'check_path_add'.  Returns the
+    remaining paths, & an error explaining each path removed.
+    """
+    formatted = [format_path(path) if len(path) > 0 else path
+        for path in path_list]
+    modes = get_path_modes([path for path in formatted if len(path) > 0],
+        jobs, timeout, readable=True)
+    kept = []
+    errors = []
+    for path, original in zip(formatted, path_list):
+        try:
+            if len(path) == 0:
+                raise PathError("Blank path: ''{}".format(
+                    get_path_details(path, original, file)), path)
+            check_path_add(path, original, file, modes)
+            kept.append(original)
+        except PathError as err:
+            errors.append(err)
+    return kept, errors
+
+
+def prune_default(jobs=None, timeout=None):
+    """
+    Prune the default PYTHONPATH, as by 'prune_paths'.
+
+    The default is only rewritten if a path was removed, & is no longer
+    kept up to date from a profile.  Returns an error for each path.
+    """
+    filename = os.path.realpath(os.path.expanduser(DEFAULT_PATH))
+    path_list, errors = prune_paths(get_default_paths(), jobs, timeout,
+        filename)
+    if len(errors) > 0:
+        set_permanently(path_list)
+        set_default_profile(None)
+    return errors
+
+
+def check_path_remove(pythonpath, formatted, original, file=None, key=None):
+    """
+    Check that path is (or was) in the PYTHONPATH.
+
+    The path doesn't actually need to exist, and may even have been
+    removed from the system.  If 'key' is given, the PYTHONPATH holds
+    the keys of paths, rather than the paths.
+    """
+    if (formatted if key is None else key(formatted)) not in pythonpath:
+        raise NotOnPath("Not on PYTHONPATH: '{}'{}".format(formatted,
+            get_path_details(formatted, original, file)), formatted)
+
+
+def get_path_details(formatted, original, file=None):
+    """
+    Return original path information in a consistent format.
+    """
+    if formatted == original:
+        if file is None:
+            message = ""
+        else:
+            message = " (in '{}')".format(file)
+    else:
+        if file is None:
+            message = " (specified as '{}')".format(original)
+        else:
+            message = " (specified as '{}' in '{}')".format(original, file)
+    return message
+
+
+# TODO catch unreadable file error?
+def get_file_paths(filename):
+    """
+    Get paths from file.
+
+    File should contain one path per line.
+    Paths may be absolute or relative to the file's directory.
+    Blank lines & comments are ignored.
+    """
+    TIMINGS.count('path files read')
+    lines = []
+    with open(filename) as fh:
+        for line in fh.readlines():
+            line = line.strip()
+            if len(line) == 0 or line.startswith('#'):
+                continue
+            lines.append(line)
+    return lines
+
+
+def get_file_entries(filename, memo=None, stack=()):
+    """
+    Get formatted paths from file, with the lines & files they came from.
+
+    Lines like 'include other.pth' are replaced by the entries of the
+    other file, which may be relative to the including file.  Each file
+    is only resolved once per 'memo' dict, however often it is included.
+    The 'stack' parameter tracks the files being included, so that an
+    include cycle is reported instead of recursing forever.
+    """
+    if memo is None:
+        memo = {}
+    key = format_path(filename)
+    if key in memo:
+        return memo[key]
+    stack = stack + (key,)
+    entries = []
+    for line, formatted in read_file_entries(key):
+        if not line.startswith(INCLUDE):
+            entries.append((line, formatted, filename))
+            continue
+        original = line[len(INCLUDE):].strip()
+        details = get_path_details(formatted, original, filename)
+        if formatted in stack:
+            chain = stack[stack.index(formatted):] + (formatted,)
+            raise PathFileError("Include cycle: {}{}".format(
+                " -> ".join("'{}'".format(f) for f in chain), details),
+                filename)
+        if not os.path.isfile(formatted):
+            raise PathFileError("Include not found: '{}'{}".format(formatted,
+                details), filename)
+        entries.extend(get_file_entries(formatted, memo, stack))
+    memo[key] = entries
+    return entries
+
+
+def read_file_entries(filename):
+    """
+    Get formatted paths from file, paired with the lines they came from.
+
+    Relative paths are converted to absolute paths using the file's
+    directory.  Results are cached by the file's path, mtime, size &
+    inode, so an unchanged file is not read or formatted again.
+    """
+    filename = format_path(filename)
+    info = os.stat(filename)
+    key = (filename, info.st_mtime, info.st_size, info.st_ino)
+    entries = read_cache(key)
+    if entries is not None:
+        TIMINGS.count('path files cached')
+        TIMINGS.count('path file entries', len(entries))
+        return entries
+    entries = []
+    env = {}
+    file_dir = os.path.dirname(filename)
+    for line in get_file_paths(filename):
+        path = line
+        if line.startswith(INCLUDE):
+            path = line[len(INCLUDE):].strip()
+        # Convert file-relative paths to absolute paths.
+        converted = os.path.expandvars(os.path.expanduser(path))
+        if not os.path.isabs(converted):
+            converted = os.path.join(file_dir, converted)
+        entries.append((line, format_path(converted)))
+        # Track environment variables the result depends on.
+        names = re.findall(r'\$(\w+|\{[^}]*\})', path)
+        if path.startswith('~'):
+            names.append('HOME')
+        for name in names:
+            name = name.strip('{}')
+            env[name] = os.environ.get(name)
+    TIMINGS.count('path file entries', len(entries))
+    # Skip caching files modified too recently to have a reliable mtime.
+    if time.time() - info.st_mtime > 1:
+        write_cache(key, env, entries)
+    return entries
+
+
+def get_cache_file(key):
+    """
+    Get the cache file used to store entries for a cache key.
+    """
+    import hashlib  # Only needed for path files.
+    name = hashlib.sha1(key[0]).hexdigest()
+    return os.path.join(os.path.expanduser(CACHE_DIR), name)
+
+
+def read_cache(key):
+    """
+    Return cached entries for key, or None if not cached.
+
+    Cached entries are ignored if any environment variables they
+    depend on have changed.  A cache hit marks the entry as recently
+    used.
+    """
+    cache_file = get_cache_file(key)
+    try:
+        with open(cache_file, 'rb') as fh:
+            cached_key, env, entries = marshal.load(fh)
+        if cached_key != key:
+            return None
+        for name, value in env.items():
+            if os.environ.get(name) != value:
+                return None
+        os.utime(cache_file, None)
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        return None     # Missing, unreadable or corrupt cache file.
+    return entries
+
+
+def write_cache(key, env, entries):
+    """
+    Cache entries for key, evicting the least recently used entries.
+
+    Failure to write the cache is not an error.
+    """
+    cache_file = get_cache_file(key)
+    cache_dir = os.path.dirname(cache_file)
+    tmp_file = "{}.{}".format(cache_file, os.getpid())
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        with open(tmp_file, 'wb') as fh:
+            marshal.dump((key, env, entries), fh)
+        os.rename(tmp_file, cache_file)
+        names = os.listdir(cache_dir)
+        if len(names) > CACHE_SIZE:
+            files = [os.path.join(cache_dir, name) for name in names]
+            files.sort(key=os.path.getmtime)
+            for name in files[:len(files) - CACHE_SIZE]:
+                os.remove(name)
+    except (IOError, OSError):
+        pass
+
+
+def format_path(path):
+    """
+    Format path consistently.
+
+    Changes to a path file should not break the remove function (same
+    path specified differently, etc).  Symlinks are kept, as users may
+    rely on them (see 'PathResolver' for resolving them with '-R').
+    """
+    if len(path) == 0:
+        return path     # 'os.path.abspath' converts empty path to cwd.
+    else:
+        return os.path.normpath(os.path.abspath(path))
+
+
+def join_paths(path_list):
+    """
+    Clean up extra ':' characters & duplicates in PYTHONPATH.
+    """
+    found = []
+    seen = set([''])
+    for path in path_list:
+        if path not in seen:
+            seen.add(path)
+            found.append(path)
+    return found
+
+
+class OrderedPaths(object):
+    """
+    Paths in priority order, built from groups of added & removed paths.
+
+    Adding a group prepends it, so later groups have a higher priority.
+    Removing a group drops every occurrence of its paths that was added
+    earlier.  Both cost O(len(group)), and membership tests cost O(1).
+    Iterating yields paths by descending priority, duplicates included.
+    Once removed & repeated paths outnumber the others, the groups are
+    compacted, so memory use stays in proportion to the unique paths.
+    If a 'key' function is given, paths with the same key are treated
+    as the same path (e.g. removing one spelling removes the others).
+    """
+    __slots__ = ('groups', 'added', 'removed', 'size', 'limit', 'key')
+
+    def __init__(self, paths=(), key=None):
+        self.key = key
+        self.groups = []    # Sequence of (action number, paths).
+        self.added = {}     # Path to number of the last action adding it.
+        self.removed = {}   # Path to number of the last action removing it.
+        self.size = 0       # Number of paths stored in groups & 'removed'.
+        self.limit = 1024   # Size at which to compact.
+        self.prepend(paths)
+
+    def prepend(self, paths):
+        """
+        Add a group of paths, in descending priority.
+        """
+        number = self.groups[-1][0] + 1 if self.groups else 1
+        paths = list(paths)
+        self.groups.append((number, paths))
+        for path in paths if self.key is None else map(self.key, paths):
+            self.added[path] = number
+        self.size += len(paths)
+        if self.size > self.limit:
+            self.compact()
+
+    def remove(self, paths):
+        """
+        Remove all occurrences of a group of paths.
+        """
+        number = self.groups[-1][0] + 1 if self.groups else 1
+        self.groups.append((number, []))
+        for path in paths if self.key is None else map(self.key, paths):
+            self.removed[path] = number
+            self.size += 1
+        if self.size > self.limit:
+            self.compact()
+
+    def compact(self):
+        """
+        Replace the groups with a single group of the unique paths.
+
+        Only the first (highest priority) occurrence of a path is kept,
+        as in 'join_paths'.
+        """
+        found = self.unique(blanks=True)
+        number = self.groups[-1][0]
+        self.groups = [(number, found)]
+        self.added = dict.fromkeys(found if self.key is None else
+            map(self.key, found), number)
+        self.removed = {}
+        self.size = len(found)
+        self.limit = max(2 * self.size, 1024)
+
+    def __contains__(self, path):
+        if self.key is not None:
+            path = self.key(path)
+        return self.added.get(path, 0) > self.removed.get(path, 0)
+
+    def __iter__(self):
+        removed = self.removed
+        key = self.key
+        for number, paths in reversed(self.groups):
+            for path in paths:
+                if removed.get(path if key is None else key(path), 0) < \
+                        number:
+                    yield path
+
+    def unique(self, blanks=False):
+        """
+        Return paths in priority order, without blanks & duplicates.
+        """
+        if self.key is None and not blanks:
+            return join_paths(self)
+        found = []
+        seen = set() if blanks else set([''])
+        for path in self:
+            key = path if self.key is None else self.key(path)
+            if key not in seen:
+                seen.add(key)
+                found.append(path)
+        return found
+
+
+class PathResolver(object):
+    """
+    Resolve symlinks in paths, identifying each directory by its inode.
+
+    Each path prefix is only checked with 'lstat' once (per resolver),
+    so resolving many paths under common prefixes does not repeat
+    system calls.
+    """
+    __slots__ = ('links', 'keys')
+
+    def __init__(self):
+        self.links = {}     # Path with a real parent dir to its real path.
+        self.keys = {}      # Path to key.
+
+    def realpath(self, path):
+        """
+        Return path with symlinks resolved, like 'os.path.realpath'.
+        """
+        return self.join('/', os.path.abspath(path), ())
+
+    def join(self, base, path, seen):
+        """
+        Resolve path relative to a real dir.  Symlinks in 'seen' are
+        being resolved, so are left as they are (as in a symlink loop).
+        """
+        for name in path.split('/'):
+            if name in ['', '.']:
+                continue
+            if name == '..':
+                base = os.path.dirname(base)
+                continue
+            link = os.path.join(base, name)
+            real = self.links.get(link)
+            if real is None:
+                TIMINGS.count('paths resolved')
+                try:
+                    is_link = stat.S_ISLNK(os.lstat(link).st_mode)
+                except OSError:
+                    is_link = False
+                real = link
+                if is_link and link not in seen:
+                    target = os.readlink(link)
+                    real = self.join('/' if target.startswith('/') else base,
+                        target, seen + (link,))
+                if len(seen) == 0:
+                    self.links[link] = real     # Not part of a loop.
+            base = real
+        return base
+
+    def key(self, path):
+        """
+        Return (device, inode) of the dir path resolves to, or the real
+        path if it does not exist.  Blank paths are their own key.
+        """
+        key = self.keys.get(path)
+        if key is None:
+            key = self.realpath(path) if len(path) > 0 else path
+            try:
+                info = os.stat(key)
+                key = (info.st_dev, info.st_ino)
+            except OSError:
+                pass
+            self.keys[path] = key
+        return key
+
+
+class PathSet(object):
+    """
+    A PYTHONPATH value, changed by actions as on the command line.
+
+    This is the library API, for computing path lists in-process:
+
+        paths = PathSet.from_env().add('src', 'deps.pth').remove('old')
+        subprocess.call(cmd, env=paths.to_env())
+
+    Actions raise 'PyPathError' subclasses (or IOError for unreadable
+    path files), leaving the set unchanged.  Removes are checked against
+    the paths in the set at any time, as with 'set_paths'.
+    """
+    __slots__ = ('paths', 'seen', 'force', 'jobs', 'timeout')
+
+    def __init__(self, paths=(), force=False, jobs=None, timeout=None):
+        self.paths = join_paths(paths)
+        self.seen = set(self.paths)     # Paths in the set at any time.
+        self.force = force
+        self.jobs = jobs
+        self.timeout = timeout
+
+    @classmethod
+    def from_env(cls, env=None, **kwargs):
+        """
+        Return the PYTHONPATH of env (default: 'os.environ').
+        """
+        env = os.environ if env is None else env
+        return cls(env.get('PYTHONPATH', '').split(':'), **kwargs)
+
+    @classmethod
+    def from_file(cls, filename, **kwargs):
+        """
+        Return the paths listed in a path file.
+        """
+        return cls(**kwargs).add(filename)
+
+    def add(self, *paths):
+        """
+        Add paths (or the contents of path files), as with '-a'.
+        """
+        return self.apply([('-a', paths)])
+
+    def remove(self, *paths):
+        """
+        Remove paths (or the contents of path files), as with '-r'.
+        """
+        return self.apply([('-r', paths)])
+
+    def clear(self):
+        """
+        Remove all paths, as with '-c'.
+        """
+        self.paths = []
+        return self
+
+    def apply(self, actions):
+        """
+        Perform any number of ('-a' or '-r', paths) actions in order.
+
+        Actions may be a generator, e.g. 'read_batch(filename)'.
+        """
+        paths = join_paths(set_paths(self.seen, self.paths, actions,
+            self.force, self.jobs, self.timeout))
+        self.paths = paths
+        self.seen.update(paths)
+        return self
+
+    def to_env(self, env=None):
+        """
+        Return a copy of env (default: 'os.environ') with this PYTHONPATH.
+        """
+        env = dict(os.environ if env is None else env)
+        env['PYTHONPATH'] = str(self)
+        return env
+
+    def __str__(self):
+        return ":".join(self.paths)
+
+    def __repr__(self):
+        return "PathSet({!r})".format(self.paths)
+
+    def __iter__(self):
+        return iter(self.paths)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __contains__(self, path):
+        return path in self.paths
+
+    def __eq__(self, other):
+        return isinstance(other, PathSet) and self.paths == other.paths
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None     # Mutable.
+
+
+def set_permanently(path_list):
+    """
+    Permanently set the PYTHONPATH environment variable.
+
+    Alters the contents of '~/.pypath/default.pth', which should be
+    sourced by the shell on startup.  The file is replaced by renaming
+    a synced temp file, so a shell never sources a partly written file.
+    Writers are serialized by an advisory lock, and the file is left
+    alone if its contents would not change.  Returns True if written.
+    """
+    filename = os.path.realpath(os.path.expanduser(DEFAULT_PATH))
+    return update_file(filename, get_shell_script(path_list))
+
+
+def update_file(filename, contents):
+    """
+    Replace a file's contents, under an advisory lock, unless they would
+    not change.  Returns True if written.
+    """
+    with lock_file(filename):
+        mode = None
+        try:
+            with open(filename) as fh:
+                if fh.read() == contents:
+                    return False
+                mode = stat.S_IMODE(os.fstat(fh.fileno()).st_mode)
+        except IOError:
+            pass    # No file yet.
+        replace_file(filename, contents, mode)
+    return True
+
+
+def lock_file(filename):
+    """
+    Take an advisory lock for writing a file, returning the open lock
+    file, which releases it when closed.
+
+    The lock file is in LOCK_DIR, named by a hash of the file's path, so
+    none is left beside the file (e.g. in a site dir).
+    """
+    import fcntl    # Only needed for files shared between processes.
+    import hashlib
+    lock_dir = os.path.expanduser(LOCK_DIR)
+    if not os.path.isdir(lock_dir):
+        try:
+            os.makedirs(lock_dir)
+        except OSError:
+            if not os.path.isdir(lock_dir):     # Not made by another writer.
+                raise
+    name = hashlib.sha1(os.path.realpath(filename)).hexdigest()
+    lock = open(os.path.join(lock_dir, name), 'a')
+    try:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+    except IOError:
+        lock.close()
+        raise
+    return lock
+
+
+def replace_file(filename, contents, mode=None):
+    """
+    Write a file by renaming a synced temp file over it, so readers see
+    either the old or the new contents.
+    """
+    tmp_file = "{}.{}".format(filename, os.getpid())
+    with open(tmp_file, 'w') as fh:
+        fh.write(contents)
+        fh.flush()
+        os.fsync(fh.fileno())
+    if mode is not None:
+        os.chmod(tmp_file, mode)
+    os.rename(tmp_file, filename)
+
+
+def set_default_profile(name):
+    """
+    Record the profile the default PYTHONPATH was set from, if any, so
+    that 'watch_profiles' keeps the default up to date.
+    """
+    filename = os.path.expanduser(DEFAULT_PROFILE)
+    if name is not None:
+        replace_file(filename, name + '\n')
+    elif os.path.exists(filename):
+        os.remove(filename)
+
+
+def get_default_profile():
+    """
+    Return the profile the default PYTHONPATH was set from, or None.
+    """
+    try:
+        with open(os.path.expanduser(DEFAULT_PROFILE)) as fh:
+            return fh.read().strip() or None
+    except IOError:
+        return None
+
+
+def set_site(path_list, pythons, env=None):
+    """
+    Write paths to a path file in the site dir of each interpreter.
+
+    Returns (python, path file, True if written) for each interpreter.
+    """
+    contents = get_site_file(path_list)
+    results = []
+    for python in pythons:
+        site_dir = get_site_dir(python, env)
+        if not os.path.isdir(site_dir):
+            os.makedirs(site_dir)
+        filename = os.path.join(site_dir, SITE_PTH)
+        results.append((python, filename, update_file(filename, contents)))
+    return results
+
+
+def get_site_dir(python, env=None):
+    """
+    Get the dir 'site' reads path files from, for an interpreter.
+    """
+    import subprocess
+    try:
+        proc = subprocess.Popen([python, '-c', SITE_CODE], env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError:
+        raise PyPathError("Python not found: '{}'".format(python), python)
+    out, err = proc.communicate()
+    if proc.returncode != 0:
+        lines = err.strip().split('\n')
+        raise PyPathError("Could not find site dir of '{}': {}".format(
+            python, lines[-1]), python)
+    return out.strip()
+
+
+def get_site_file(path_list):
+    """
+    Get the contents of a 'site' path file listing paths.
+
+    'site' reads paths relative to the site dir, and runs lines that
+    start with 'import', so paths are made absolute.  Blank paths (the
+    current dir) cannot be listed, and are left out.
+    """
+    lines = ["# Written by pypath.\n"]
+    for path in path_list:
+        if '\n' in path:
+            raise PathError("Path can not be in a '.pth' file: '{}'".format(
+                path), path)
+        if len(path) > 0:
+            lines.append(os.path.abspath(path) + '\n')
+    return "".join(lines)
+
+
+def get_default_paths():
+    """
+    Get the paths in the default PYTHONPATH, as set by 'set_permanently'.
+    """
+    paths = []
+    try:
+        with open(os.path.expanduser(DEFAULT_PATH)) as fh:
+            lines = fh.read().splitlines()
+    except IOError:
+        return paths    # No default yet.
+    for line in lines:
+        for prefix in ["PYTHONPATH=", "PYTHONPATH+=:"]:
+            value = line[len(prefix):]
+            if line.startswith(prefix) and value.startswith("'"):
+                paths.append(value[1:-1])
+    return paths
+
+
+def get_shell_script(path_list):
+    """
+    Get shell commands that set the PYTHONPATH environment variable.
+    """
+    path_strings = ["'{}'".format(pth) for pth in path_list]
+    path_string = "\nPYTHONPATH+=:".join(path_strings)
+    return "PYTHONPATH={0}\nexport PYTHONPATH\n".format(path_string)
+
+
+def get_profile_file(name, extension):
+    """
+    Get the file used to store part of a profile.
+
+    A profile is stored as its actions ('.json'), its PYTHONPATH as a
+    shell script ('.sh'), and the path files it depends on ('.deps').
+    """
+    if len(name) == 0 or name.startswith('.') or '/' in name:
+        raise ProfileError("Invalid profile name: '{}'".format(name), name)
+    return os.path.join(os.path.expanduser(PROFILE_DIR), name + extension)
+
+
+def save_profile(name, actions, force):
+    """
+    Save profile actions, with paths made absolute.
+    """
+    import json     # Only needed for profiles.
+    actions = [(action, [format_path(path) for path in paths])
+        for action, paths in actions]
+    filename = get_profile_file(name, '.json')
+    if not os.path.isdir(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+    with open(filename, 'w') as fh:
+        json.dump({'actions': actions, 'force': force}, fh)
+
+
+def load_profile(name):
+    """
+    Load profile actions.
+    """
+    import json
+    try:
+        with open(get_profile_file(name, '.json')) as fh:
+            profile = json.load(fh)
+    except IOError:
+        raise ProfileError("Profile not found: '{}'".format(name), name)
+    profile['actions'] = [(action.encode('utf-8'),
+        [path.encode('utf-8') for path in paths])
+        for action, paths in profile['actions']]
+    return profile
+
+
+def use_profile(name, jobs=None, timeout=None):
+    """
+    Get profile PYTHONPATH, compiling the profile shell script.
+
+    The script is written after the list of path files (& dirs matched
+    by wildcards) it depends on, so 'pypath.sh' can run it directly
+    while none of them is newer.
+    """
+    profile = load_profile(name)
+    path_list = join_paths(set_paths([], [], profile['actions'],
+        profile['force'], jobs, timeout))
+    memo = {}
+    dirs = DirCache(DIR_CACHE_PATH)
+    get_action_paths(profile['actions'], True, memo, dirs)
+    deps = sorted(memo) + sorted(dirs.used)
+    replace_file(get_profile_file(name, '.deps'),
+        "".join(path + '\n' for path in deps))
+    replace_file(get_profile_file(name, '.sh'), get_shell_script(path_list))
+    return path_list
+
+
+def get_profile_deps():
+    """
+    Return a dict of the files & dirs saved profiles depend on, to the
+    names of the profiles depending on them.
+
+    Each profile depends on its actions file & the path files & dirs
+    listed in its '.deps' file.  The profile dir is included (for no
+    profile), so that new profiles are noticed.
+    """
+    profile_dir = os.path.expanduser(PROFILE_DIR)
+    deps = {profile_dir: set()}
+    try:
+        filenames = sorted(os.listdir(profile_dir))
+    except OSError:
+        return deps
+    for filename in filenames:
+        name, extension = os.path.splitext(filename)
+        if extension != '.json' or name.startswith('.'):
+            continue
+        paths = [os.path.join(profile_dir, filename)]
+        try:
+            with open(get_profile_file(name, '.deps')) as fh:
+                paths.extend(line.rstrip('\n') for line in fh)
+        except IOError:
+            pass    # Not compiled yet.
+        for path in paths:
+            deps.setdefault(path, set()).add(name)
+    return deps
+
+
+def get_signatures(paths):
+    """
+    Return a dict of paths to (mtime, size, inode), or None if missing.
+    """
+    signatures = {}
+    for path in paths:
+        try:
+            info = os.stat(path)
+            signatures[path] = (info.st_mtime, info.st_size, info.st_ino)
+        except OSError:
+            signatures[path] = None
+    return signatures
+
+
+def update_profiles(names):
+    """
+    Recompile profiles, & the default PYTHONPATH if it uses one.
+
+    Path files that have not changed are not read again (see
+    'read_file_entries').  Errors are reported, but do not stop other
+    profiles from being updated.  Returns the names updated.
+    """
+    default = get_default_profile()
+    updated = []
+    for name in sorted(names):
+        try:
+            path_list = use_profile(name)
+            if name == default:
+                set_permanently(path_list)
+        except (IOError, OSError, PyPathError) as exc:
+            sys.stderr.write("Profile '{}' not updated: {}\n".format(name,
+                exc))
+            continue
+        sys.stderr.write("Profile '{}' updated{}\n".format(name,
+            " (& default)" if name == default else ""))
+        updated.append(name)
+    return updated
+
+
+def watch_profiles(interval=None, delay=None, rounds=None):
+    """
+    Update profiles whenever a file or dir they depend on changes.
+
+    Changes are found by comparing the stat signatures of every
+    dependency.  Where inotify is available, it wakes the watcher as
+    soon as a watched dir changes; otherwise dependencies are polled
+    every 'interval' seconds.  Updates wait until there have been no
+    changes for 'delay' seconds.  Runs until interrupted, or for
+    'rounds' updates.
+    """
+    interval = WATCH_INTERVAL if interval is None else interval
+    delay = WATCH_DELAY if delay is None else delay
+    try:
+        watcher = Inotify()
+    except (OSError, AttributeError):
+        watcher = None  # Not Linux, so poll.
+    deps = get_profile_deps()
+    signatures = get_signatures(deps)
+    try:
+        while rounds is None or rounds > 0:
+            if watcher is not None:
+                watcher.watch(deps)
+                watcher.wait(interval * 30)     # In case events are missed.
+            else:
+                time.sleep(interval)
+            current = get_signatures(deps)
+            if current == signatures:
+                continue
+            while True:     # Wait for a burst of changes to end.
+                if watcher is not None:
+                    watcher.wait(delay)
+                else:
+                    time.sleep(delay)
+                latest = get_signatures(deps)
+                if latest == current:
+                    break
+                current = latest
+            names = set()
+            for path, signature in current.items():
+                if signature != signatures[path]:
+                    names.update(deps[path])
+            # Also compile profiles saved since the last check.
+            old_names = set().union(*deps.values())
+            deps = get_profile_deps()
+            names.update(set().union(*deps.values()) - old_names)
+            update_profiles(names)
+            deps = get_profile_deps()
+            signatures = get_signatures(deps)
+            if rounds is not None:
+                rounds -= 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if watcher is not None:
+            watcher.close()
+
+
+class Inotify(object):
+    """
+    Wait for changes to dirs, using Linux inotify via 'ctypes'.
+    """
+    MASK = 0x2 | 0x4 | 0x8 | 0x40 | 0x80 | 0x100 | 0x200 | 0x400 | 0x800
+    # Modify, attrib, close write, moved from & to, create, delete, delete
+    # self & move self.
+
+    def __init__(self):
+        import ctypes
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init failed")
+        self.dirs = set()
+
+    def watch(self, paths):
+        """
+        Watch the dirs of paths (& dirs themselves) not yet watched.
+        """
+        for path in paths:
+            for dir in [path, os.path.dirname(path)]:
+                if dir not in self.dirs and os.path.isdir(dir):
+                    self.dirs.add(dir)
+                    self.libc.inotify_add_watch(self.fd, dir, self.MASK)
+
+    def wait(self, timeout):
+        """
+        Wait up to timeout seconds for events, returning True if any.
+        """
+        import select
+        readable = select.select([self.fd], [], [], timeout)[0]
+        if len(readable) > 0:
+            os.read(self.fd, 65536)
+        return len(readable) > 0
+
+    def close(self):
+        os.close(self.fd)
+
+
+def record_snapshot(path_list):
+    """
+    Save path_list as a snapshot, unless it is the latest snapshot.
+
+    Each distinct path list is stored once, compressed, in a file named
+    by the hash of its contents.  The history is a log of 'time hash
+    count' lines, appended with a single write.  Once it holds twice
+    SNAPSHOT_SIZE lines, it is cut to the latest SNAPSHOT_SIZE, & the
+    snapshots no longer in it are removed.  Failure to save a snapshot
+    is not an error.  Returns the hash, or None if not saved.
+
+    Writes are made under the lock 'update_file' uses, so a history cut
+    short does not drop a line, or a snapshot file, another process has
+    just added.
+    """
+    import hashlib
+    if any('\n' in path for path in path_list):
+        return None
+    contents = "\n".join(path_list)
+    digest = hashlib.sha1(contents).hexdigest()
+    history = read_history()
+    if len(history) > 0 and history[-1][1] == digest:
+        return digest
+    dirname = os.path.expanduser(SNAPSHOT_DIR)
+    filename = os.path.join(dirname, "history")
+    entry = (int(time.time()), digest, len(path_list))
+    try:
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with lock_file(filename):
+            if not os.path.exists(os.path.join(dirname, digest)):
+                import zlib     # Only needed for new snapshots.
+                replace_file(os.path.join(dirname, digest),
+                    zlib.compress(contents))
+            fd = os.open(filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                0o600)
+            try:
+                os.write(fd, "{} {} {}\n".format(*entry))
+            finally:
+                os.close(fd)
+            history = read_history()    # With lines other writers added.
+            if len(history) >= 2 * SNAPSHOT_SIZE:
+                history = history[-SNAPSHOT_SIZE:]
+                replace_file(filename, "".join("{} {} {}\n".format(*entry)
+                    for entry in history))
+                kept = set(digest for _, digest, _ in history)
+                for name in os.listdir(dirname):
+                    if len(name) == 40 and name not in kept:
+                        os.remove(os.path.join(dirname, name))
+    except (IOError, OSError):
+        return None
+    return digest
+
+
+def read_history():
+    """
+    Return the (time, hash, number of paths) of each snapshot in the
+    history, oldest first.  Snapshot contents are not read.
+    """
+    history = []
+    try:
+        with open(os.path.join(os.path.expanduser(SNAPSHOT_DIR),
+                "history")) as fh:
+            for line in fh:
+                fields = line.split()
+                if len(fields) == 3 and fields[0].isdigit() and \
+                        len(fields[1]) == 40 and fields[2].isdigit():
+                    history.append((int(fields[0]), fields[1],
+                        int(fields[2])))
+    except IOError:
+        pass    # No history yet.
+    return history
+
+
+def load_snapshot(name, history=None):
+    """
+    Return the paths of a snapshot, by number (0 is the latest) or hash
+    prefix (of at least 6 characters).
+    """
+    import zlib
+    history = read_history() if history is None else history
+    digests = [digest for _, digest, _ in reversed(history)]
+    if name.isdigit() and len(name) < 6:
+        matches = digests[int(name):int(name) + 1]
+    else:
+        matches = sorted(set(digest for digest in digests
+            if len(name) >= 6 and digest.startswith(name)))
+    if len(matches) != 1:
+        raise SnapshotError("Snapshot not found: '{}'".format(name), name)
+    try:
+        with open(os.path.join(os.path.expanduser(SNAPSHOT_DIR),
+                matches[0]), 'rb') as fh:
+            contents = zlib.decompress(fh.read())
+    except (IOError, zlib.error):
+        raise SnapshotError("Snapshot not readable: '{}'".format(name), name)
+    return contents.split('\n') if len(contents) > 0 else []
+
+
+def get_undo_snapshot(path_list):
+    """
+    Return the paths of the snapshot before the latest one matching
+    path_list, or the latest snapshot if none match.
+    """
+    import hashlib
+    history = read_history()
+    digest = hashlib.sha1("\n".join(path_list)).hexdigest()
+    digests = [entry[1] for entry in reversed(history)]
+    number = digests.index(digest) + 1 if digest in digests else 0
+    if number >= len(digests):
+        raise SnapshotError("Nothing to undo")
+    return load_snapshot(str(number), history)
+
+
+def get_history_report():
+    """
+    Return lines listing the snapshots in the history, newest first.
+    """
+    return ["{:>4}  {}  {}  {} path{}".format(number,
+        time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(mtime)),
+        digest[:8], count, "" if count == 1 else "s")
+        for number, (mtime, digest, count) in
+        enumerate(reversed(read_history()))]
+
+
+def get_snapshot_diff(old, new):
+    """
+    Return lines reporting the paths removed from old ('-') & added in
+    new ('+'), in priority order.
+    """
+    old_set = set(old)
+    new_set = set(new)
+    lines = ["- " + path for path in old if path not in new_set]
+    lines.extend("+ " + path for path in new if path not in old_set)
+    if len(lines) == 0 and old != new:
+        lines.append("Same paths, in a different order")
+    return lines
+
+
+def exec_command(command, path_list):
+    """
+    Replace this process with command, with path_list as PYTHONPATH.
+    """
+    if len(command) == 0:
+        raise PyPathError("No command after '--'")
+    sys.stdout.flush()
+    sys.stderr.flush()
+    env = dict(os.environ, PYTHONPATH=":".join(path_list))
+    try:
+        os.execvpe(command[0], command, env)
+    except OSError as err:
+        raise PyPathError("Could not run '{}': {}".format(command[0],
+            err.strerror), command[0])
+
+
+def read_fanout(filename):
+    """
+    Return the (actions, command) of each line of a fan-out file.
+
+    Lines are split like a shell command line, with any add & remove
+    actions before '--', & the command after it.  Blank lines &
+    comments are ignored.
+    """
+    import shlex
+    fh = sys.stdin if filename == '-' else open(filename)
+    try:
+        lines = fh.readlines()
+    finally:
+        if fh is not sys.stdin:
+            fh.close()
+    commands = []
+    for number, line in enumerate(lines, 1):
+        if len(line.strip()) == 0 or line.lstrip().startswith('#'):
+            continue
+        try:
+            argv, command = split_command(shlex.split(line))
+        except ValueError:  # Unbalanced quotes.
+            argv, command = None, None
+        args = None
+        if command is not None and len(command) > 0:
+            args = parse_args_fast(argv) if len(argv) > 0 else \
+                Args(**get_defaults())
+        if args is None or \
+                vars(args) != dict(get_defaults(), actions=args.actions):
+            raise PathFileError("Invalid fan-out line: '{}' (line {} in"
+                " '{}')".format(line.strip(), number, filename), filename)
+        commands.append((args.actions, command))
+    return commands
+
+
+def fan_out(commands, procs=None):
+    """
+    Run (path_list, command) pairs, on up to 'procs' processes at once.
+
+    Output lines (stdout & stderr) are written to stdout as they arrive,
+    prefixed by the command's number, & each exit code is reported on
+    stderr.  Returns the exit codes, in order.
+    """
+    import multiprocessing
+    import Queue
+    import subprocess
+    import threading
+    procs = procs or multiprocessing.cpu_count()
+    finished = Queue.Queue()    # Numbers & exit codes of commands.
+    lock = threading.Lock()
+    codes = [None] * len(commands)
+
+    def stream(number, proc):
+        for line in iter(proc.stdout.readline, ''):
+            with lock:
+                sys.stdout.write("[{}] {}{}".format(number, line,
+                    '' if line.endswith('\n') else '\n'))
+                sys.stdout.flush()
+        proc.stdout.close()
+        finished.put((number, proc.wait()))
+
+    def report():
+        number, code = finished.get()
+        codes[number - 1] = code
+        with lock:
+            sys.stderr.write("[{}] Exit code {}: {}\n".format(number, code,
+                " ".join(commands[number - 1][1])))
+
+    running = 0
+    with open(os.devnull) as devnull:
+        for number, (path_list, command) in enumerate(commands, 1):
+            if running >= procs:
+                report()
+                running -= 1
+            env = dict(os.environ, PYTHONPATH=":".join(path_list))
+            running += 1
+            try:
+                proc = subprocess.Popen(command, env=env, stdin=devnull,
+                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            except OSError as err:
+                with lock:
+                    sys.stderr.write("[{}] Could not run '{}': {}\n".format(
+                        number, command[0], err.strerror))
+                finished.put((number, 127))     # As in the shell.
+                continue
+            thread = threading.Thread(target=stream, args=(number, proc))
+            thread.daemon = True
+            thread.start()
+        while running > 0:
+            report()
+            running -= 1
+    return codes
+
+
+def set_index(path_list):
+    """
+    Index the modules provided by each path, for 'pypath_import'.
+
+    Directories that have not changed since they were last indexed are
+    not scanned again.  Returns (name, paths) for shadowed names.
+    """
+    import pypath_import
+    index = pypath_import.update_index(path_list, pypath_import.read_index())
+    pypath_import.write_index(index)
+    return pypath_import.get_shadowed(index)
+
+
+def bundle_paths(path_list, filename):
+    """
+    Bundle the modules & packages in path_list into a zip archive.
+
+    Archive entries are stored uncompressed, with bytecode compiled by
+    this interpreter ('zipimport' uses the source if it is for another
+    version).  Entries whose source is unchanged are copied from the
+    existing archive, which is only replaced if anything has changed.
+    Returns the archive path, & the (name, path) of skipped extension
+    modules.
+    """
+    import zipfile
+    filename = format_path(filename)
+    files, skipped = get_bundle_files(path_list)
+    try:
+        old = zipfile.ZipFile(filename)
+    except (IOError, zipfile.BadZipfile):
+        old = None
+    entries = {} if old is None else dict(
+        (info.filename, info) for info in old.infolist())
+    bundled = []    # (name, source, mtime, key, old entry or None).
+    for name, source in files:
+        info = os.stat(source)
+        key = "{}\0{!r}\0{}".format(source, info.st_mtime, info.st_size)
+        if time.time() - info.st_mtime <= 1:
+            key = ""    # Too recently modified to have a reliable mtime.
+        entry = entries.get(name)
+        if entry is None or entry.comment != key or key == "":
+            entry = None
+        bundled.append((name, source, info.st_mtime, key, entry))
+    names = set(name for name, _, _, _, _ in bundled)
+    stale = [name for name in entries if name not in names
+        and not (name[:-1] in names and name[-3:] in ['pyc', 'pyo'])]
+    if old is not None and len(stale) == 0 and \
+            all(entry is not None for _, _, _, _, entry in bundled):
+        old.close()
+        return filename, skipped
+    tmp_file = "{}.{}".format(filename, os.getpid())
+    try:
+        with zipfile.ZipFile(tmp_file, 'w', zipfile.ZIP_STORED) as archive:
+            for name, source, mtime, key, entry in bundled:
+                if entry is not None:
+                    archive.writestr(entry, old.read(entry))
+                    bytecode = entries.get(name + 'c')
+                    if bytecode is not None and bytecode.comment == key:
+                        archive.writestr(bytecode, old.read(bytecode))
+                    continue
+                with open(source, 'rb') as fh:
+                    data = fh.read()
+                date_time = get_zip_date_time(mtime)
+                entry = zipfile.ZipInfo(name, date_time)
+                entry.comment = key
+                entry.external_attr = 0o644 << 16
+                archive.writestr(entry, data)
+                if name.endswith('.py'):
+                    bytecode = get_bytecode(data, source, date_time)
+                    if bytecode is not None:
+                        entry = zipfile.ZipInfo(name + 'c', date_time)
+                        entry.comment = key
+                        entry.external_attr = 0o644 << 16
+                        archive.writestr(entry, bytecode)
+        os.rename(tmp_file, filename)
+    finally:
+        if old is not None:
+            old.close()
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    return filename, skipped
+
+
+def farm_paths(path_list, dirname):
+    """
+    Link the modules & packages in path_list from one dir of symlinks.
+
+    Each top-level name is linked to the first path providing it, as in
+    'get_bundle_files'.  The names found in each path are kept in the
+    FARM_INDEX file, so only paths whose mtime changed are listed again,
+    & only links whose target changed are replaced.  Returns the dir, &
+    the (name, path, other paths) of names provided by more than one.
+    """
+    dirname = format_path(dirname)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    index_file = os.path.join(dirname, FARM_INDEX)
+    try:
+        with open(index_file, 'rb') as fh:
+            old = marshal.load(fh)
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        old = {}    # Missing, unreadable or corrupt index file.
+    index = {}      # Path to (mtime, names found).
+    links = {}      # Link name to target.
+    providers = {}  # Name to paths, by priority.
+    for path in path_list:
+        path = os.path.abspath(path) if len(path) > 0 else path
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            continue    # Blank or missing.
+        if path in index or path == dirname:
+            continue    # Repeated, or the links themselves.
+        entry = old.get(path)
+        if entry is None or entry[0] != mtime:
+            TIMINGS.count('dirs listed')
+            entry = (mtime, get_module_entries(path))
+        if time.time() - mtime > 1:     # Otherwise, list again next time.
+            index[path] = entry
+        for name, (kind, module) in sorted(entry[1].items()):
+            paths = providers.setdefault(name, [])
+            if len(paths) == 0:
+                links[module] = os.path.join(path, module)
+            paths.append(path)
+    current = {}
+    for name in os.listdir(dirname):
+        link = os.path.join(dirname, name)
+        if name.startswith('.'):
+            continue    # Index & temp files.
+        if not os.path.islink(link):
+            raise PathError("Not a link: '{}'".format(link), link)
+        current[name] = os.readlink(link)
+    for name in current:
+        if name not in links:
+            TIMINGS.count('links updated')
+            os.remove(os.path.join(dirname, name))
+    for name, target in sorted(links.items()):
+        if current.get(name) != target:
+            TIMINGS.count('links updated')
+            tmp_link = os.path.join(dirname, ".{}.{}".format(name,
+                os.getpid()))
+            os.symlink(target, tmp_link)
+            os.rename(tmp_link, os.path.join(dirname, name))
+    if index != old:
+        replace_file(index_file, marshal.dumps(index))
+    shadowed = [(name, paths[0], paths[1:])
+        for name, paths in sorted(providers.items()) if len(paths) > 1]
+    return dirname, shadowed
+
+
+def get_bundle_files(path_list):
+    """
+    Return the (entry name, source) files to bundle from path_list, &
+    the (name, path) of extension modules that cannot be bundled.
+
+    Each top-level name is taken from the first path providing it, as
+    a package, extension or '.py' module (in the order imports find
+    them).  Hidden & '__pycache__' dirs, & bytecode, are left out.
+    """
+    files = []
+    skipped = []
+    claimed = set()
+    for path in path_list:
+        for name, (kind, entry) in sorted(get_module_entries(path).items()):
+            if name in claimed:
+                continue
+            claimed.add(name)
+            full = os.path.join(path, entry)
+            if kind == 1:
+                skipped.append((name, full))
+            elif kind == 2:
+                files.append((entry, full))
+            else:
+                add_package_files(full, entry, files, skipped)
+    return sorted(files), skipped
+
+
+def get_module_entries(path):
+    """
+    Return a dict of the top-level names in a dir to (kind, entry).
+
+    Kinds are 0 for a package, 1 for an extension & 2 for a '.py'
+    module, & entry is the package dir or module file name that imports
+    find first.  Blank, missing & non-dirs have no names.
+    """
+    import pypath_import
+    try:
+        listing = sorted(os.listdir(path))
+    except OSError:
+        return {}
+    found = {}
+    for entry in listing:
+        name, dot, suffix = entry.partition('.')
+        if not pypath_import.is_identifier(name):
+            continue
+        if not dot:
+            if os.path.isfile(os.path.join(path, entry, '__init__.py')):
+                found[name] = (0, entry)
+        elif suffix.rsplit('.', 1)[-1] in EXTENSION_SUFFIXES:
+            found[name] = min(found.get(name, (1, entry)), (1, entry))
+        elif suffix == 'py':
+            found.setdefault(name, (2, entry))
+    return found
+
+
+def add_package_files(package, name, files, skipped):
+    """
+    Add the files in a package dir to the files & skipped lists.
+    """
+    for path, dirs, filenames in os.walk(package):
+        dirs[:] = sorted(d for d in dirs
+            if not d.startswith('.') and d != '__pycache__')
+        prefix = name + path[len(package):]
+        for filename in sorted(filenames):
+            suffix = filename.rsplit('.', 1)[-1]
+            if suffix in BYTECODE_SUFFIXES:
+                continue
+            full = os.path.join(path, filename)
+            entry = "/".join(prefix.split(os.sep) + [filename])
+            if suffix in EXTENSION_SUFFIXES:
+                module = prefix.split(os.sep) + [filename.split('.')[0]]
+                skipped.append((".".join(module), full))
+            else:
+                files.append((entry, full))
+
+
+def get_zip_date_time(mtime):
+    """
+    Return the zip date & time of an mtime, which has even seconds.
+    """
+    date_time = time.localtime(max(mtime, 315532800))[:6]   # Since 1980.
+    return date_time[:5] + (date_time[5] // 2 * 2,)
+
+
+def get_bytecode(data, source, date_time):
+    """
+    Return '.pyc' contents for source data, or None if it does not
+    compile.  The timestamp matches the zip entry of the source, as
+    'zipimport' ignores bytecode older than its source.
+    """
+    import imp
+    import struct
+    try:
+        code = compile(data, source, 'exec', 0, True)
+    except (SyntaxError, TypeError, ValueError):
+        return None     # E.g. Python 3 code, compiled when imported.
+    mtime = int(time.mktime(date_time + (0, 0, -1)))
+    return imp.get_magic() + struct.pack('<I', mtime) + marshal.dumps(code)
+
+
+def get_providers(path_list):
+    """
+    Return a dict of module names to the paths providing them, by
+    priority, using (without updating) the 'pypath_import' index.
+    """
+    import pypath_import
+    return pypath_import.get_providers(pypath_import.update_index(path_list,
+        pypath_import.read_index()))
+
+
+def time_imports(path_list, names, python=None):
+    """
+    Import names in a child interpreter, with path_list as PYTHONPATH.
+
+    Returns the results of 'pypath_import.measure_imports', with dir
+    stats & providers keyed by (byte string) path.
+    """
+    import json
+    import subprocess
+    import pypath_import
+    source = os.path.splitext(pypath_import.__file__)[0] + '.py'
+    env = dict(os.environ, PYTHONPATH=":".join(path_list))
+    proc = subprocess.Popen([python or sys.executable, '-c', MEASURE_CODE,
+        source] + list(names), env=env, stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+    try:
+        results = json.loads(out.rstrip('\n').rsplit('\n', 1)[-1])
+    except ValueError:
+        lines = err.strip().split('\n')
+        raise PyPathError("Could not measure imports: {}".format(lines[-1]))
+    encode = lambda path: path if path is None else path.encode('utf-8')
+    results['dirs'] = dict((encode(path), stats)
+        for path, stats in results['dirs'].items())
+    results['served'] = dict((name.encode('utf-8'), encode(path))
+        for name, path in results['served'].items())
+    return results
+
+
+def compile_paths(path_list, python=None, procs=None, prefix=None):
+    """
+    Compile the modules in path_list for 'python', on up to 'procs'
+    child processes (by default, one per CPU).
+
+    Each child runs 'pypath_import.compile_main', so bytecode matches the
+    interpreter that imports it.  Counts of the modules compiled & those
+    already current are added to the timings.  Returns the (source,
+    error) of modules that failed to compile.  Children write stderr
+    (e.g. warnings) to temp files, so a full pipe never blocks them.
+    """
+    import json
+    import multiprocessing
+    import subprocess
+    import tempfile
+    import pypath_import
+    files = get_module_files(path_list)
+    procs = min(procs or multiprocessing.cpu_count(), len(files))
+    source = os.path.splitext(pypath_import.__file__)[0] + '.py'
+    args = [python or sys.executable, '-c', COMPILE_CODE, source]
+    if prefix is not None:
+        args.append(format_path(prefix))
+    children = []
+    try:
+        for number in range(procs):
+            errors = tempfile.TemporaryFile()
+            proc = subprocess.Popen(args, stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE, stderr=errors)
+            children.append((proc, errors))
+            proc.stdin.write("".join(path + '\n'
+                for path in files[number::procs]))
+            proc.stdin.close()
+        failed = []
+        for proc, errors in children:
+            out = proc.stdout.read()
+            proc.wait()
+            try:
+                results = json.loads(out)
+            except ValueError:
+                errors.seek(0)
+                lines = errors.read().strip().split('\n')
+                raise PyPathError("Could not compile modules: {}".format(
+                    lines[-1]))
+            TIMINGS.count('modules compiled', results['compiled'])
+            TIMINGS.count('modules current', results['current'])
+            failed.extend((path.encode('utf-8'), error.encode('utf-8'))
+                for path, error in results['failed'].items())
+    finally:
+        for proc, errors in children:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+            errors.close()
+    return sorted(failed)
+
+
+def get_module_files(path_list):
+    """
+    Return the sorted source files of the modules in path_list dirs,
+    including submodules.  Dirs that are not valid package names (or
+    are in GLOB_EXCLUDE) are not searched.
+    """
+    import pypath_import
+    files = set()
+    for path in path_list:
+        if len(path) == 0:
+            continue
+        for root, dirs, filenames in os.walk(path):
+            dirs[:] = [name for name in dirs if name not in GLOB_EXCLUDE
+                and pypath_import.is_identifier(name)]
+            for filename in filenames:
+                name, dot, suffix = filename.partition('.')
+                if suffix == 'py' and pypath_import.is_identifier(name):
+                    files.add(os.path.join(os.path.abspath(root), filename))
+    return sorted(files)
+
+
+def get_import_report(results, path_list, providers=None):
+    """
+    Return lines reporting import costs, by descending lookup time.
+
+    The suggested order puts the paths that provide the most imports
+    first, as long as that does not change which path provides any
+    name in 'providers'.
+    """
+    imports = results['imports']
+    lines = ["Imported {} modules in {:.2f} ms".format(len(imports),
+        sum(imports.values()) * 1000)]
+    if len(results['failed']) > 0:
+        lines[0] += " (failed: {})".format(", ".join("'{}'".format(name)
+            for name in results['failed']))
+    lines.append("{:>10}{:>7}{:>8}  {}".format("Lookup ms", "Hits", "Misses",
+        "Dir"))
+    for path, (hits, misses, seconds) in sorted(results['dirs'].items(),
+            key=lambda item: -item[1][2]):
+        lines.append("{:>10.2f}{:>7}{:>8}  {}".format(seconds * 1000, hits,
+            misses, path or "''"))
+    weights = {}
+    for name, path in results['served'].items():
+        weights[path] = weights.get(path, 0) + 1
+    ordered = reorder_paths(path_list, weights, providers)
+    if ordered == list(path_list):
+        lines.append("No reordering suggested.")
+    else:
+        lines.append("Suggested order ({} -> {} misses):".format(
+            count_misses(path_list, results['served']),
+            count_misses(ordered, results['served'])))
+        lines.extend("  " + path for path in ordered)
+    return lines
+
+
+def reorder_paths(path_list, weights, providers=None):
+    """
+    Return paths by descending weight, keeping shadowed names' providers.
+
+    A path is only moved ahead of paths that provide none of the same
+    names in 'providers', so the first provider of each name is
+    unchanged.  A path that must precede others is moved up by the
+    highest weight among them.  Paths of equal weight keep their order.
+    """
+    position = dict((path, i) for i, path in enumerate(path_list))
+    before = {}     # Paths that must precede each path.
+    for paths in (providers or {}).values():
+        for path in paths[1:]:
+            before.setdefault(path, set()).add(paths[0])
+    priority = dict((path, weights.get(path, 0)) for path in path_list)
+    for path in reversed(path_list):
+        for first in before.get(path, ()):
+            priority[first] = max(priority[first], priority[path])
+    ordered = []
+    placed = set()
+    remaining = list(path_list)
+    while len(remaining) > 0:
+        best = min((path for path in remaining
+            if before.get(path, placed) <= placed),
+            key=lambda path: (-priority[path], position[path]))
+        remaining.remove(best)
+        placed.add(best)
+        ordered.append(best)
+    return ordered
+
+
+def order_by_usage(path_list, usage=None):
+    """
+    Return path_list with the paths that provided most imports first.
+
+    Usage is read from the 'pypath_import' usage log by default.  Also
+    returns ((first, path), names) for each pair of paths left in order
+    because moving 'path' ahead would change the provider of names.
+    """
+    import pypath_import
+    if usage is None:
+        usage = pypath_import.read_usage()
+    providers = get_providers(path_list)
+    unchecked = reorder_paths(path_list, usage)
+    position = dict((path, i) for i, path in enumerate(unchecked))
+    kept = {}
+    for name, paths in sorted(providers.items()):
+        path = min(paths, key=position.get)
+        if path != paths[0]:
+            kept.setdefault((paths[0], path), []).append(name)
+    return reorder_paths(path_list, usage, providers), sorted(kept.items())
+
+
+def count_misses(path_list, served):
+    """
+    Count the paths searched before the path providing each name.
+    """
+    position = dict((path, i) for i, path in enumerate(path_list))
+    return sum(position[path] for path in served.values()
+        if path in position)
+
+
+if __name__ == "__main__":
+    main()
+
+
@@ -0,0 +1,545 @@
+"""
+Import top-level modules using an index of pypath-managed directories.
+
+The index maps each directory to its modification time & the top-level
+module & package names it provides.  It is written by 'pypath -i', and
+read by 'IndexFinder', which resolves imports from the index instead of
+searching every directory on the path.
+
+To use the finder, add something like this to a 'usercustomize' module:
+
+    import os, sys
+    sys.path.append(os.path.expanduser("~/.pypath"))
+    import pypath_import
+    pypath_import.install()
+
+To record which pypath-managed directories provide imports, for
+'pypath -u' to put the most used first, call 'record_usage()' instead
+(or as well), e.g. from a 'sitecustomize' module.
+
+This module supports both Python 2 & 3, as it is imported by any
+interpreter that uses the index.  'pypath -m' also runs 'main' in a
+child interpreter, to measure the cost of imports on a PYTHONPATH, &
+'pypath -C' runs 'compile_main' in child interpreters, to compile the
+modules of a PYTHONPATH for them.
+"""
+
+
+import json
+import os
+import struct
+import sys
+import time
+
+try:
+    from importlib.machinery import FrozenImporter, PathFinder
+except ImportError:     # Python 2.
+    import imp
+    PathFinder = None
+
+clock = getattr(time, 'perf_counter', time.time)
+
+
+INDEX_PATH = "~/.pypath/index.json"
+USAGE_PATH = "~/.pypath/usage.log"
+MODULE_SUFFIXES = ('py', 'pyc', 'pyo', 'pyw', 'so', 'pyd')
+PACKAGE_FILES = ('__init__.py', '__init__.pyc', '__init__.pyo')
+
+
+def scan_dir(path):
+    """
+    Return sorted top-level module & package names provided by a dir.
+
+    Directories are packages only if they contain an '__init__' file.
+    """
+    names = set()
+    try:
+        entries = os.listdir(path or '.')
+    except OSError:
+        return []
+    for entry in entries:
+        name, dot, suffix = entry.partition('.')
+        if not is_identifier(name):
+            continue
+        if dot:
+            if suffix.rsplit('.', 1)[-1] in MODULE_SUFFIXES:
+                names.add(name)     # Includes 'name.cpython-35m.so', etc.
+        elif any(os.path.isfile(os.path.join(path, entry, init))
+                for init in PACKAGE_FILES):
+            names.add(name)
+    return sorted(names)
+
+
+def is_identifier(name):
+    """
+    Return True if name is a valid module name.
+    """
+    return len(name) > 0 and not name[0].isdigit() and \
+        name.replace('_', 'a').isalnum()
+
+
+def read_index(path=None):
+    """
+    Read index file, returning an empty index if it is missing or invalid.
+    """
+    if path is None:
+        path = INDEX_PATH
+    try:
+        with open(os.path.expanduser(path)) as fh:
+            index = json.load(fh)
+        if isinstance(index.get('paths'), list) and \
+                isinstance(index.get('dirs'), dict):
+            return index
+    except (IOError, OSError, ValueError, AttributeError):
+        pass
+    return {'paths': [], 'dirs': {}}
+
+
+def update_index(paths, index=None):
+    """
+    Return an index of paths, in priority order.
+
+    Directories are only scanned if their mtime has changed since they
+    were last indexed.  Paths that are not directories are skipped.
+    """
+    old_dirs = {} if index is None else index['dirs']
+    dirs = {}
+    for path in paths:
+        try:
+            mtime = os.stat(path or '.').st_mtime
+        except OSError:
+            continue
+        entry = old_dirs.get(path)
+        if entry is None or entry['mtime'] != mtime:
+            entry = {'mtime': mtime, 'names': scan_dir(path)}
+        dirs[path] = entry
+    return {'paths': [path for path in paths if path in dirs], 'dirs': dirs}
+
+
+def write_index(index, path=None):
+    """
+    Write index file.
+    """
+    if path is None:
+        path = INDEX_PATH
+    path = os.path.expanduser(path)
+    tmp_path = "{0}.{1}".format(path, os.getpid())
+    with open(tmp_path, 'w') as fh:
+        json.dump(index, fh)
+    os.rename(tmp_path, path)
+
+
+def get_providers(index):
+    """
+    Return a dict of names to the dirs providing them, by priority.
+    """
+    providers = {}
+    for path in index['paths']:
+        for name in index['dirs'][path]['names']:
+            providers.setdefault(name, []).append(path)
+    return providers
+
+
+def get_shadowed(index):
+    """
+    Return a sorted list of (name, dirs) for names in more than one dir.
+    """
+    return sorted((name, paths) for name, paths in
+        get_providers(index).items() if len(paths) > 1)
+
+
+class IndexFinder(object):
+    """
+    Find top-level modules in indexed dirs without searching 'sys.path'.
+
+    The finder covers 'sys.path' up to the last indexed dir.  Dirs in
+    that range that are not indexed are scanned once.  Indexed dirs
+    whose mtime has changed are scanned again.  Names not provided by
+    any covered dir are searched for in the rest of 'sys.path' only.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.sys_path = None
+        self.providers = {}
+        self.remaining = []
+        self.hooks = True   # Whether 'remaining' needs path hooks.
+
+    def update(self):
+        """
+        Map names to dirs for the current 'sys.path'.
+        """
+        self.sys_path = list(sys.path)
+        indexed = [path for path in sys.path if path in self.index['dirs']]
+        if len(indexed) == 0:
+            self.providers, self.remaining, self.hooks = {}, [], True
+            return
+        end = self.sys_path.index(indexed[-1]) + 1
+        covered = self.sys_path[:end]
+        for path in covered:
+            if not os.path.isdir(path or '.'):
+                covered = covered[:covered.index(path)]   # Path hook.
+                end = len(covered)
+                break
+        index = update_index(covered, self.index)
+        self.providers = get_providers(index)
+        self.remaining = [path for path in self.sys_path[end:]
+            if path not in index['dirs'] and os.path.exists(path or '.')]
+        self.hooks = not all(os.path.isdir(path or '.')
+            for path in self.remaining)
+
+    def lookup(self, fullname, path):
+        """
+        Return dirs that may provide a top-level module, or None if the
+        module is not covered.
+        """
+        if path is not None or '.' in fullname:
+            return None     # Not a top-level module.
+        if self.sys_path != sys.path:
+            self.update()
+        return self.providers.get(fullname, [])
+
+    def find_spec(self, fullname, path=None, target=None):
+        """
+        Find module spec (Python 3).
+        """
+        dirs = self.lookup(fullname, path)
+        if dirs is None:
+            return None
+        for dir in dirs:
+            spec = PathFinder.find_spec(fullname, [dir])
+            if spec is not None and spec.loader is not None:
+                return spec
+        if len(self.providers) > 0:
+            spec = PathFinder.find_spec(fullname, self.remaining)
+            if spec is not None and spec.loader is not None:
+                return spec
+        return None     # Defer namespace packages to the default search.
+
+    def find_module(self, fullname, path=None):
+        """
+        Find module loader (Python 2).
+        """
+        if imp.is_builtin(fullname) or imp.is_frozen(fullname):
+            return None
+        dirs = self.lookup(fullname, path)
+        if dirs is None:
+            return None
+        searches = [[dir] for dir in dirs]
+        if len(self.providers) > 0 and not self.hooks:
+            searches.append(self.remaining)
+        for search in searches:
+            try:
+                return IndexLoader(imp.find_module(fullname, search))
+            except ImportError:
+                continue
+        return None
+
+
+class IndexLoader(object):
+    """
+    Load a module found by 'imp.find_module' (Python 2).
+    """
+
+    def __init__(self, found):
+        self.found = found
+
+    def load_module(self, fullname):
+        """
+        Load module, closing its file.
+        """
+        if fullname in sys.modules:
+            return sys.modules[fullname]
+        fh, pathname, description = self.found
+        try:
+            return imp.load_module(fullname, fh, pathname, description)
+        finally:
+            if fh is not None:
+                fh.close()
+
+
+class LookupTimer(object):
+    """
+    Time the search of each 'sys.path' dir for top-level modules.
+
+    The timer does not find modules itself, so imports proceed as normal
+    after it has searched for them.  Each dir searched before the one
+    providing a module counts as a miss.
+    """
+
+    def __init__(self):
+        self.dirs = {}      # Dir to [hits, misses, seconds].
+        self.served = {}    # Module name to the dir providing it.
+
+    def search(self, fullname, path):
+        """
+        Search 'sys.path' for a top-level module, in order.
+        """
+        if path is not None or '.' in fullname or fullname in self.served \
+                or fullname in sys.builtin_module_names:
+            return
+        if PathFinder is None:
+            if imp.is_frozen(fullname):
+                return
+        elif FrozenImporter.find_spec(fullname) is not None:
+            return
+        self.served[fullname] = None
+        for dir in sys.path:
+            stats = self.dirs.setdefault(dir, [0, 0, 0.0])
+            start = clock()
+            found = find_in_dir(fullname, dir)
+            stats[2] += clock() - start
+            if found:
+                stats[0] += 1
+                self.served[fullname] = dir
+                return
+            stats[1] += 1
+
+    def find_spec(self, fullname, path=None, target=None):
+        """
+        Time search, finding nothing (Python 3).
+        """
+        self.search(fullname, path)
+        return None
+
+    def find_module(self, fullname, path=None):
+        """
+        Time search, finding nothing (Python 2).
+        """
+        self.search(fullname, path)
+        return None
+
+
+def find_in_dir(fullname, dir):
+    """
+    Return True if a dir provides a top-level module.
+    """
+    if PathFinder is not None:
+        spec = PathFinder.find_spec(fullname, [dir])
+        return spec is not None and spec.loader is not None
+    try:
+        fh = imp.find_module(fullname, [dir])[0]
+    except ImportError:
+        return False
+    if fh is not None:
+        fh.close()
+    return True
+
+
+def measure_imports(names):
+    """
+    Import names, timing the search of each dir on 'sys.path'.
+
+    Returns a dict of 'sys.path', the dir stats & providers found by a
+    'LookupTimer', the seconds taken by each import (including the
+    timer's searches), and the names that failed to import.
+    """
+    timer = LookupTimer()
+    sys.meta_path.insert(0, timer)
+    imports = {}
+    failed = []
+    try:
+        for name in names:
+            start = clock()
+            try:
+                __import__(name)
+            except Exception:
+                failed.append(name)
+            imports[name] = clock() - start
+    finally:
+        sys.meta_path.remove(timer)
+    return {'path': sys.path, 'dirs': timer.dirs, 'served': timer.served,
+        'imports': imports, 'failed': failed}
+
+
+def main(names):
+    """
+    Measure imports, writing the results as JSON on the last line of
+    stdout (after any output of the imported modules).
+    """
+    results = measure_imports(names)
+    sys.stdout.write("\n" + json.dumps(results) + "\n")
+
+
+def get_bytecode_file(source):
+    """
+    Return the bytecode file this interpreter imports source from.
+    """
+    if PathFinder is None:
+        return source + ('c' if __debug__ else 'o')
+    import importlib.util
+    return importlib.util.cache_from_source(source)
+
+
+def is_compiled(source):
+    """
+    Return True if the bytecode of source is current, as checked by
+    imports: the magic number, & the source mtime (& size) it records.
+    """
+    try:
+        with open(get_bytecode_file(source), 'rb') as fh:
+            header = fh.read(16)
+    except (IOError, OSError):
+        return False
+    if PathFinder is None:
+        magic = imp.get_magic()
+    else:
+        import importlib.util
+        magic = importlib.util.MAGIC_NUMBER
+    if len(header) < 16 or header[:4] != magic:
+        return False
+    info = os.stat(source)
+    if sys.version_info >= (3, 7):
+        if struct.unpack('<I', header[4:8])[0] != 0:
+            return True     # Hash based, so checked by imports.
+        header = header[4:]
+    mtime, size = struct.unpack('<II', header[4:12])
+    if mtime != int(info.st_mtime) & 0xFFFFFFFF:
+        return False
+    return PathFinder is None or size == info.st_size & 0xFFFFFFFF
+
+
+def compile_files(files, prefix=None):
+    """
+    Compile source files whose bytecode is not current.
+
+    If 'prefix' is given, bytecode is written under that dir instead of
+    beside the source, for use with 'PYTHONPYCACHEPREFIX' (3.8+).
+    Returns the numbers of files compiled & current, & a dict of files
+    that failed to compile to the error.
+    """
+    import py_compile
+    if prefix is not None:
+        if not hasattr(sys, 'pycache_prefix'):
+            raise ValueError("Cache prefix needs Python 3.8 or later")
+        sys.pycache_prefix = prefix
+    results = {'compiled': 0, 'current': 0, 'failed': {}}
+    for source in files:
+        try:
+            if is_compiled(source):
+                results['current'] += 1
+                continue
+            py_compile.compile(source, doraise=True)
+            results['compiled'] += 1
+        except (py_compile.PyCompileError, IOError, OSError) as err:
+            results['failed'][source] = str(err).strip().split('\n')[-1]
+    return results
+
+
+def compile_main(args):
+    """
+    Compile the source files listed on stdin, writing the results as
+    JSON to stdout.  The optional argument is a cache prefix.
+    """
+    files = [line.rstrip('\n') for line in sys.stdin if line.strip()]
+    results = compile_files(files, args[0] if len(args) > 0 else None)
+    sys.stdout.write(json.dumps(results) + "\n")
+
+
+def get_usage(modules, pythonpath):
+    """
+    Return a dict of PYTHONPATH dirs to the number of top-level modules
+    each provided.
+    """
+    dirs = set(pythonpath)
+    usage = {}
+    for name, module in list(modules.items()):
+        filename = getattr(module, '__file__', None)
+        if '.' in name or filename is None:
+            continue    # Submodule, builtin or namespace package.
+        path = os.path.dirname(filename)
+        if hasattr(module, '__path__'):
+            path = os.path.dirname(path)    # Package.
+        if path in dirs:
+            usage[path] = usage.get(path, 0) + 1
+    return usage
+
+
+def write_usage(usage, path=None):
+    """
+    Append usage counts to the usage log, as 'count<TAB>dir' lines.
+
+    The lines are written with a single append, so that concurrent
+    interpreters do not interleave their lines.
+    """
+    if path is None:
+        path = USAGE_PATH
+    data = "".join("{0}\t{1}\n".format(count, dir)
+        for dir, count in sorted(usage.items()) if '\n' not in dir)
+    if len(data) == 0:
+        return
+    if not isinstance(data, bytes):
+        data = data.encode('utf-8')     # Python 3.
+    fd = os.open(os.path.expanduser(path),
+        os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
+
+def read_usage(path=None, compact=True):
+    """
+    Read usage log, returning a dict of dirs to total counts.
+
+    If 'compact', a log with repeated dirs is rewritten with one line
+    per dir.  Counts appended while it is rewritten may be lost.
+    """
+    if path is None:
+        path = USAGE_PATH
+    path = os.path.expanduser(path)
+    usage = {}
+    lines = 0
+    try:
+        with open(path) as fh:
+            for line in fh:
+                count, _, dir = line.rstrip('\n').partition('\t')
+                if count.isdigit() and dir:
+                    usage[dir] = usage.get(dir, 0) + int(count)
+                    lines += 1
+    except (IOError, OSError):
+        return usage
+    if compact and lines > len(usage):
+        tmp_path = "{0}.{1}".format(path, os.getpid())
+        try:
+            write_usage(usage, tmp_path)
+            os.rename(tmp_path, path)
+        except (IOError, OSError):
+            pass
+    return usage
+
+
+def record_usage(path=None):
+    """
+    Record the PYTHONPATH dirs that provided imports, on exit.
+
+    Only the modules imported by the time the interpreter exits are
+    counted, so recording adds no cost to each import.
+    """
+    import atexit
+
+    def record():
+        pythonpath = os.environ.get('PYTHONPATH', '').split(os.pathsep)
+        try:
+            write_usage(get_usage(sys.modules, pythonpath), path)
+        except (IOError, OSError):
+            pass    # Recording must never break the interpreter.
+
+    atexit.register(record)
+
+
+def install(path=None):
+    """
+    Install an 'IndexFinder' for the index file on 'sys.meta_path'.
+
+    The finder is placed before the default path finder, so builtin &
+    frozen modules are still found first.
+    """
+    if path is None:
+        path = INDEX_PATH
+    finder = IndexFinder(read_index(path))
+    position = len(sys.meta_path)
+    if PathFinder is not None and PathFinder in sys.meta_path:
+        position = sys.meta_path.index(PathFinder)
+    sys.meta_path.insert(position, finder)
+    return finder
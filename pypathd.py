@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+"""
+Serve pypath requests over a Unix socket.
+
+This avoids starting a Python interpreter for every 'pypath' call.  The
+server is optional: 'pypath.sh' uses it when it is running, and runs
+'pypath.py' directly when it is not.
+"""
+
+
+import argparse
+import os
+import signal
+import socket
+import StringIO
+import sys
+
+import pypath_core
+
+
+SOCKET_PATH = "~/.pypath/pypath.sock"
+IDLE_TIMEOUT = 600  # Seconds.
+DESCRIPTION = __doc__.strip().split('\n')[0]
+EPILOG = """
+Requests are NUL separated fields: the number of fields that follow, the
+working directory, the output of 'env', and the pypath arguments.
+The response is the pypath stderr, an ASCII record separator, the pypath
+stdout, a newline, and the return code.
+
+Examples:
+  pypathd.py             # Start server in the background.
+  pypathd.py -F -t 60    # Run in the foreground, exit after idle 60 seconds.
+"""
+
+
+def main():
+    """
+    Parse command line & serve requests until idle.
+    """
+    args = get_parser().parse_args()
+    path = os.path.expanduser(args.socket)
+    server = get_server(path)
+    if not args.foreground:
+        daemonize()
+    try:
+        serve(server, args.timeout)
+    finally:
+        server.close()
+        remove_socket(path)
+
+
+def get_parser():
+    """
+    Get command line parser.
+    """
+    parser = argparse.ArgumentParser(
+        description=DESCRIPTION,
+        epilog=EPILOG,
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument('-s', dest='socket', default=SOCKET_PATH,
+        metavar='path', help='Socket path (default: {}).'.format(SOCKET_PATH))
+    parser.add_argument('-t', dest='timeout', type=float, default=IDLE_TIMEOUT,
+        metavar='sec', help=('Exit after this many idle seconds'
+        ' (default: {}).'.format(IDLE_TIMEOUT)))
+    parser.add_argument('-F', dest='foreground', action='store_true',
+        default=False, help='Run in the foreground.')
+    return parser
+
+
+def get_server(path):
+    """
+    Bind a listening Unix socket that only the current user can access.
+    """
+    remove_socket(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o077)
+    try:
+        server.bind(path)
+    finally:
+        os.umask(umask)
+    server.listen(16)
+    return server
+
+
+def remove_socket(path):
+    """
+    Remove socket file, if it exists.
+    """
+    try:
+        os.remove(path)
+    except OSError as err:
+        if err.errno != 2:  # Ignore error if already removed.
+            raise
+
+
+def daemonize():
+    """
+    Detach from the controlling terminal.
+    """
+    if os.fork() > 0:
+        os._exit(0)
+    os.setsid()
+    if os.fork() > 0:
+        os._exit(0)
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in range(3):
+        os.dup2(devnull, fd)
+
+
+def serve(server, timeout):
+    """
+    Handle each request in a forked child, until idle for 'timeout'.
+
+    Forking keeps the interpreter & 'pypath' module loaded, while each
+    request still gets its own working directory & environment.
+    """
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)  # Reap children.
+    server.settimeout(timeout)
+    while True:
+        try:
+            conn, _ = server.accept()
+        except socket.timeout:
+            return
+        if os.fork() == 0:
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            server.close()
+            conn.settimeout(None)
+            try:
+                handle(conn)
+            finally:
+                os._exit(0)
+        conn.close()
+
+
+def handle(conn):
+    """
+    Run pypath for one request, sending its output & return code.
+    """
+    cwd, env, args = read_request(conn)
+    os.chdir(cwd)
+    os.environ.clear()
+    os.environ.update(env)
+    code, output, errors = run(args)
+    conn.sendall("{}\x1e{}\n{}".format(errors, output.rstrip('\n'), code))
+    conn.close()
+
+
+def read_request(conn):
+    """
+    Read request fields from connection.
+
+    Returns the working directory, environment dict & argument list.
+    """
+    data = ""
+    while True:
+        fields = data.split('\0')[:-1]   # Last field is incomplete.
+        if len(fields) > 0 and len(fields) > int(fields[0]):
+            break
+        chunk = conn.recv(65536)
+        if not chunk:
+            raise EOFError("Incomplete request")
+        data += chunk
+    cwd, env, args = fields[1], fields[2], fields[3:int(fields[0]) + 1]
+    return cwd, parse_env(env), args
+
+
+def parse_env(output):
+    """
+    Parse the output of 'env' into a dict.
+
+    Lines that do not start with a variable name continue the value of
+    the previous variable.
+    """
+    env = {}
+    name = None
+    for line in output.split('\n'):
+        key, sep, value = line.partition('=')
+        if sep and key.replace('_', 'a').isalnum():
+            name = key
+            env[name] = value
+        elif name is not None:
+            env[name] += '\n' + line
+    return env
+
+
+def run(args):
+    """
+    Run 'pypath_core.main' with arguments.
+
+    Returns the return code, stdout & stderr.  Commands (after '--' or
+    in a fan-out file) are not run, as they would replace or outlive
+    the request.
+    """
+    if '--' in args or '-F' in args:
+        return pypath_core.ERROR, "Commands are not run by the server", ""
+    output = StringIO.StringIO()
+    errors = StringIO.StringIO()
+    sys.stdout, sys.stderr = output, errors
+    sys.argv = ['pypath'] + args
+    try:
+        pypath_core.main()
+        code = pypath_core.SUCCESS
+    except SystemExit as exc:
+        code = exc.code if exc.code is not None else pypath_core.SUCCESS
+    finally:
+        sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+    return code, output.getvalue(), errors.getvalue()
+
+
+def request(args, path=SOCKET_PATH, cwd=None, env=None):
+    """
+    Send a request to a running server.
+
+    Returns the return code, stdout & stderr of the request.
+    This is the client side of the protocol used by 'pypath.sh'.
+    """
+    if cwd is None:
+        cwd = os.getcwd()
+    if env is None:
+        env = os.environ
+    env = "\n".join("{}={}".format(k, v) for k, v in env.items())
+    fields = [str(len(args) + 2), cwd, env] + list(args)
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(os.path.expanduser(path))
+        client.sendall("".join(field + '\0' for field in fields))
+        chunks = []
+        while True:
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        client.close()
+    errors, _, response = "".join(chunks).partition('\x1e')
+    output, _, code = response.rpartition('\n')
+    return int(code), output, errors
+
+
+if __name__ == "__main__":
+    main()
@@ -9,11 +9,17 @@ import StringIO
 import os
 import shlex
 import shutil
+import stat
 import subprocess
 import sys
+import tempfile
+import threading
+import time
 import unittest
+import zipfile
 
-import pypath
+import pypath_core as pypath
+import pypath_import
 
 
 # Dirs & files used in testing.
@@ -59,11 +65,15 @@ def restore():
             pass
 
 
-def write_file(filename, contents):
+def write_file(filename, contents, age=0):
     """
+    Write file, optionally setting its mtime 'age' seconds in the past.
     """
     with open(filename, 'w') as fh:
         fh.write(contents)
+    if age:
+        mtime = time.time() - age
+        os.utime(filename, (mtime, mtime))
 
 
 def mk_test_files():
@@ -132,11 +142,26 @@ class TestPyPath(unittest.TestCase):
         rm_test_files()
         mk_test_files()
         backup()
+        cls.cache_dir = pypath.CACHE_DIR
+        pypath.CACHE_DIR = tempfile.mkdtemp()
+        cls.dir_cache_path = pypath.DIR_CACHE_PATH
+        pypath.DIR_CACHE_PATH = os.path.join(pypath.CACHE_DIR, "dirs")
+        cls.lock_dir = pypath.LOCK_DIR
+        pypath.LOCK_DIR = os.path.join(pypath.CACHE_DIR, "locks")
+        # Scripts run with a temp HOME, so they leave '~/.pypath' alone.
+        cls.home = tempfile.mkdtemp()
+        os.mkdir(os.path.join(cls.home, ".pypath"))
+        cls.env = dict(os.environ, HOME=cls.home)
 
     @classmethod
     def tearDownClass(cls):
         rm_test_files()
         restore()
+        shutil.rmtree(pypath.CACHE_DIR)
+        pypath.CACHE_DIR = cls.cache_dir
+        pypath.DIR_CACHE_PATH = cls.dir_cache_path
+        pypath.LOCK_DIR = cls.lock_dir
+        shutil.rmtree(cls.home)
 
     def test_join_paths(self):
         # Blanks & repeats ignored.
@@ -174,6 +199,108 @@ class TestPyPath(unittest.TestCase):
         self.assertEqual(['.', '~', 'foo', 'foo/foo bar'],
             pypath.get_file_paths(PATH_FILE))
 
+    def test_set_index(self):
+        index_path = pypath_import.INDEX_PATH
+        pypath_import.INDEX_PATH = os.path.join(pypath.CACHE_DIR, "index")
+        modules = [os.path.join(path, "shadow.py") for path in TEST_DIRS[1:]]
+        try:
+            for module in modules:
+                write_file(module, "")
+            # Test shadowed names are returned.
+            self.assertEqual([('shadow', TEST_DIRS_OUT[1:])],
+                pypath.set_index(TEST_DIRS_OUT[1:]))
+            self.assertEqual(TEST_DIRS_OUT[1:],
+                pypath_import.read_index()['paths'])
+        finally:
+            pypath_import.INDEX_PATH = index_path
+            for module in modules:
+                os.remove(module)
+
+    def test_get_file_entries(self):
+        # Test relative & absolute paths are formatted.
+        write_file(PATH_FILE, "# Comment\n.\n{}\n".format(TEST_DIRS[0]),
+            age=10)
+        entries = [('.', os.path.abspath('.'), PATH_FILE),
+            (TEST_DIRS[0], TEST_DIRS_OUT[0], PATH_FILE)]
+        self.assertEqual(entries, pypath.get_file_entries(PATH_FILE))
+        # Test unchanged file is not read again.
+        get_file_paths = pypath.get_file_paths
+        pypath.get_file_paths = None
+        try:
+            self.assertEqual(entries, pypath.get_file_entries(PATH_FILE))
+        finally:
+            pypath.get_file_paths = get_file_paths
+        # Test changed file is read again.
+        write_file(PATH_FILE, "{}\n".format(TEST_DIRS[1]), age=5)
+        self.assertEqual([(TEST_DIRS[1], TEST_DIRS_OUT[1], PATH_FILE)],
+            pypath.get_file_entries(PATH_FILE))
+
+    def test_get_file_entries_include(self):
+        # Test included files are relative to the including file, and
+        # files included more than once are read once.
+        nested = [os.path.join(path, "nested.pth") for path in TEST_DIRS]
+        write_file(nested[2], ".\n")
+        write_file(nested[1], "include nested 2/nested.pth\n..\n")
+        write_file(PATH_FILE, "include {0}\n.\ninclude {0}\n".format(
+            nested[1]))
+        read_file_entries = pypath.read_file_entries
+        read = []
+        pypath.read_file_entries = lambda fn: read.append(fn) or \
+            read_file_entries(fn)
+        try:
+            self.assertEqual([
+                ('.', TEST_DIRS_OUT[2], TEST_DIRS_OUT[2] + "/nested.pth"),
+                ('..', TEST_DIRS_OUT[0], TEST_DIRS_OUT[1] + "/nested.pth"),
+                ('.', os.path.abspath('.'), PATH_FILE),
+                ('.', TEST_DIRS_OUT[2], TEST_DIRS_OUT[2] + "/nested.pth"),
+                ('..', TEST_DIRS_OUT[0], TEST_DIRS_OUT[1] + "/nested.pth"),
+            ], pypath.get_file_entries(PATH_FILE))
+            self.assertEqual(3, len(read))
+        finally:
+            pypath.read_file_entries = read_file_entries
+        # Test include cycles & missing files are reported.
+        write_file(nested[2], "include ../../../test_pypath.pth\n")
+        with self.assertRaises(ValueError) as err:
+            pypath.get_file_entries(PATH_FILE)
+        self.assertTrue("Include cycle: '{0}' -> '{1}' -> '{2}' -> '{0}'"
+            .format(os.path.abspath(PATH_FILE), os.path.abspath(nested[1]),
+            os.path.abspath(nested[2])) in str(err.exception))
+        write_file(nested[2], "include not.pth\n")
+        with self.assertRaises(ValueError) as err:
+            pypath.get_file_entries(PATH_FILE)
+        self.assertTrue("Include not found" in str(err.exception))
+        for fn in nested[1:]:
+            os.remove(fn)
+
+    def test_get_file_entries_env(self):
+        # Test cached entries depend on environment variables.
+        write_file(PATH_FILE, "$PYPATH_TEST\n", age=10)
+        os.environ['PYPATH_TEST'] = TEST_DIRS_OUT[0]
+        try:
+            self.assertEqual([('$PYPATH_TEST', TEST_DIRS_OUT[0])],
+                pypath.read_file_entries(PATH_FILE))
+            os.environ['PYPATH_TEST'] = TEST_DIRS_OUT[1]
+            self.assertEqual([('$PYPATH_TEST', TEST_DIRS_OUT[1])],
+                pypath.read_file_entries(PATH_FILE))
+        finally:
+            del os.environ['PYPATH_TEST']
+
+    def test_write_cache(self):
+        # Test least recently used entries are evicted.
+        cache_size = pypath.CACHE_SIZE
+        pypath.CACHE_SIZE = 2
+        try:
+            for i in range(4):
+                key = ("p{}".format(i), 0.0, 0, 0)
+                pypath.write_cache(key, {}, [('p', 'p')])
+                os.utime(pypath.get_cache_file(key), (i, i))
+            self.assertEqual(2, len(os.listdir(pypath.CACHE_DIR)))
+            self.assertEqual(None, pypath.read_cache(("p1", 0.0, 0, 0)))
+            self.assertEqual([('p', 'p')],
+                pypath.read_cache(("p3", 0.0, 0, 0)))
+        finally:
+            pypath.CACHE_SIZE = cache_size
+
     def test_check_path_add(self):
         # Test path not exist.
         p1 = os.path.join(TEST_DIRS[0], "p1")
@@ -192,6 +319,59 @@ class TestPyPath(unittest.TestCase):
         p2 = TEST_DIRS[1]
         pypath.check_path_add(p1, p2, "filename")
 
+    def test_get_path_modes(self):
+        # Test a few paths are checked without starting threads.
+        thread = threading.Thread
+        threading.Thread = None
+        try:
+            modes = pypath.get_path_modes(TEST_DIRS[:1] + TEST_FILES[:1] +
+                NOT_DIRS[:1])
+        finally:
+            threading.Thread = thread
+        self.assertTrue(stat.S_ISDIR(modes[TEST_DIRS[0]]))
+        self.assertTrue(stat.S_ISREG(modes[TEST_FILES[0]]))
+        self.assertEqual(None, modes[NOT_DIRS[0]])
+        # Test no threads are left running after repeated calls.
+        count = threading.active_count()
+        inline_checks = pypath.INLINE_CHECKS
+        pypath.INLINE_CHECKS = 0
+        try:
+            for _ in range(100):
+                self.assertTrue(stat.S_ISDIR(pypath.get_path_modes(TEST_DIRS,
+                    2)[TEST_DIRS[0]]))
+                self.assertLessEqual(threading.active_count(), count)
+            # Test slow paths time out, without holding up other paths.
+            os_stat = os.stat
+            def slow_stat(path):
+                if path == TEST_DIRS[0]:
+                    time.sleep(1)
+                return os_stat(path)
+            os.stat = slow_stat
+            try:
+                modes = pypath.get_path_modes(TEST_DIRS, 2, 0.1)
+            finally:
+                os.stat = os_stat
+        finally:
+            pypath.INLINE_CHECKS = inline_checks
+        self.assertEqual(pypath.TIMED_OUT, modes[TEST_DIRS[0]])
+        self.assertTrue(stat.S_ISDIR(modes[TEST_DIRS[1]]))
+        self.assertTrue(stat.S_ISDIR(modes[TEST_DIRS[2]]))
+        with self.assertRaises(ValueError) as err:
+            pypath.check_path_add(TEST_DIRS[0], TEST_DIRS[0], None, modes)
+        self.assertTrue("Timed out" in str(err.exception))
+
+    def test_set_paths_error_order(self):
+        # Test the first error in input order is raised.
+        with self.assertRaises(ValueError) as err:
+            pypath.set_paths([], [], [('-a', [TEST_DIRS[0], NOT_DIRS[1]]),
+                ('-a', [NOT_DIRS[0]])], False)
+        self.assertTrue(NOT_DIRS_OUT[1] in str(err.exception))
+        write_file(PATH_FILE, "")
+        with self.assertRaises(ValueError) as err:
+            pypath.set_paths([], [], [('-r', [NOT_DIRS[2]]),
+                ('-a', [PATH_FILE])], False)
+        self.assertTrue("Not on PYTHONPATH" in str(err.exception))
+
     def test_check_path_remove(self):
         p1 = os.path.join(TEST_DIRS[0], "p1")
         p2 = os.path.join(TEST_DIRS[0], "p2")
@@ -207,6 +387,260 @@ class TestPyPath(unittest.TestCase):
             contents = fh.read()
         self.assertEqual(contents, "PYTHONPATH={}\nexport PYTHONPATH\n".format(
             "\nPYTHONPATH+=:".join(["'{}'".format(td) for td in TEST_DIRS])))
+        # Test unchanged contents are not written again.
+        os.utime(DEFAULT_PATH_FILE, (0, 0))
+        self.assertFalse(pypath.set_permanently(TEST_DIRS))
+        self.assertEqual(0, os.stat(DEFAULT_PATH_FILE).st_mtime)
+        self.assertTrue(pypath.set_permanently(TEST_DIRS[:1]))
+        self.assertNotEqual(0, os.stat(DEFAULT_PATH_FILE).st_mtime)
+
+    def test_set_permanently_concurrent(self):
+        default_path = pypath.DEFAULT_PATH
+        tmp_dir = tempfile.mkdtemp()
+        pypath.DEFAULT_PATH = os.path.join(tmp_dir, "default.pth")
+        code = ("import sys, pypath_core as pypath\n"
+            "pypath.DEFAULT_PATH, pypath.LOCK_DIR = sys.argv[1:3]\n"
+            "for i in range(50):\n"
+            "    pypath.set_permanently([sys.argv[3] * (i % 5 + 1) * 100])\n")
+        valid = set(pypath.get_shell_script([name * n * 100])
+            for name in "abcdefgh" for n in range(1, 6))
+        procs = []
+        try:
+            procs.extend(subprocess.Popen([sys.executable, '-c', code,
+                pypath.DEFAULT_PATH, pypath.LOCK_DIR, name])
+                for name in "abcdefgh")
+            # Test readers only see complete files while writers race.
+            while any(proc.poll() is None for proc in procs):
+                try:
+                    with open(pypath.DEFAULT_PATH) as fh:
+                        self.assertTrue(fh.read() in valid)
+                except IOError:
+                    pass    # Not written yet.
+            self.assertEqual([0] * len(procs), [proc.returncode
+                for proc in procs])
+            # Test no temp or lock files are left behind.
+            self.assertEqual(["default.pth"], os.listdir(tmp_dir))
+        finally:
+            for proc in procs:
+                proc.wait()
+            pypath.DEFAULT_PATH = default_path
+            shutil.rmtree(tmp_dir)
+
+    def test_prune_paths(self):
+        saved = (pypath.DEFAULT_PATH, pypath.DEFAULT_PROFILE, os.access)
+        tmp_dir = tempfile.mkdtemp()
+        pypath.DEFAULT_PATH = os.path.join(tmp_dir, "default.pth")
+        pypath.DEFAULT_PROFILE = os.path.join(tmp_dir, "default.profile")
+        unreadable = os.path.join(tmp_dir, "unreadable")
+        os.mkdir(unreadable)
+        # Root can read anything, so fake an unreadable dir.
+        os.access = lambda path, mode: path != unreadable
+        try:
+            path_list = [TEST_DIRS[0], '', 'not', PATH_FILE, unreadable,
+                TEST_DIRS_OUT[1]]
+            kept, errors = pypath.prune_paths(path_list)
+            self.assertEqual([TEST_DIRS[0], TEST_DIRS_OUT[1]], kept)
+            self.assertEqual([
+                (pypath.PathError, "Blank path: ''"),
+                (pypath.PathNotFound, "Path not found: '{}' (specified as"
+                    " 'not')".format(os.path.abspath('not'))),
+                (pypath.NotADirectory, "Not a directory: '{}' (specified as"
+                    " '{}')".format(os.path.abspath(PATH_FILE), PATH_FILE)),
+                (pypath.PathUnreadable, "Unreadable: '{}'".format(
+                    unreadable)),
+            ], [(type(err), str(err)) for err in errors])
+            # Test default is only rewritten if paths were removed.
+            pypath.set_permanently(TEST_DIRS_OUT)
+            pypath.set_default_profile('p')
+            self.assertEqual([], pypath.prune_default())
+            self.assertEqual('p', pypath.get_default_profile())
+            pypath.set_permanently(path_list[2:])
+            self.assertEqual(["Path not found: '{}' (specified as 'not' in"
+                " '{}')".format(os.path.abspath('not'), pypath.DEFAULT_PATH)],
+                [str(err) for err in pypath.prune_default()][:1])
+            self.assertEqual([TEST_DIRS_OUT[1]], pypath.get_default_paths())
+            self.assertEqual(None, pypath.get_default_profile())
+        finally:
+            pypath.DEFAULT_PATH, pypath.DEFAULT_PROFILE, os.access = saved
+            shutil.rmtree(tmp_dir)
+
+    def test_snapshots(self):
+        saved = (pypath.SNAPSHOT_DIR, pypath.SNAPSHOT_SIZE)
+        pypath.SNAPSHOT_DIR = tempfile.mkdtemp()
+        pypath.SNAPSHOT_SIZE = 3
+        try:
+            # Test repeats of the latest snapshot are not saved, & each
+            # distinct path list is stored once.
+            for path_list in [['p1'], ['p1'], ['p2', 'p1'], ['p1'], []]:
+                pypath.record_snapshot(path_list)
+            self.assertEqual([1, 2, 1, 0], [count for _, _, count in
+                pypath.read_history()])
+            self.assertEqual(4, len(os.listdir(pypath.SNAPSHOT_DIR)))
+            self.assertEqual([], pypath.load_snapshot('0'))
+            self.assertEqual(['p2', 'p1'], pypath.load_snapshot('2'))
+            digest = pypath.read_history()[1][1]
+            self.assertEqual(['p2', 'p1'], pypath.load_snapshot(digest[:6]))
+            for name in ['4', digest[:5], 'abcdef']:
+                with self.assertRaises(pypath.SnapshotError):
+                    pypath.load_snapshot(name)
+            report = pypath.get_history_report()
+            self.assertEqual(4, len(report))
+            self.assertTrue(report[2].startswith("   2  ") and
+                report[2].endswith("  {}  2 paths".format(digest[:8])))
+            # Test undo goes back from the latest match, or to the latest.
+            self.assertEqual(['p1'], pypath.get_undo_snapshot([]))
+            self.assertEqual(['p2', 'p1'], pypath.get_undo_snapshot(['p1']))
+            self.assertEqual(['p1'], pypath.get_undo_snapshot(['p2', 'p1']))
+            self.assertEqual([], pypath.get_undo_snapshot(['p3']))
+            # Test history is cut to the latest snapshots, & others removed.
+            for path_list in [['p3'], ['p4']]:
+                pypath.record_snapshot(path_list)
+            self.assertEqual([['p4'], ['p3'], []],
+                [pypath.load_snapshot(name) for name in "012"])
+            self.assertEqual(3, len(pypath.read_history()))
+            self.assertEqual(4, len(os.listdir(pypath.SNAPSHOT_DIR)))
+            with self.assertRaises(pypath.SnapshotError):
+                pypath.get_undo_snapshot([])    # Oldest snapshot.
+            # Test diff.
+            self.assertEqual(["- p3", "+ p5"],
+                pypath.get_snapshot_diff(['p1', 'p3'], ['p5', 'p1']))
+            self.assertEqual(["Same paths, in a different order"],
+                pypath.get_snapshot_diff(['p1', 'p2'], ['p2', 'p1']))
+        finally:
+            shutil.rmtree(pypath.SNAPSHOT_DIR)
+            pypath.SNAPSHOT_DIR, pypath.SNAPSHOT_SIZE = saved
+
+    def test_snapshots_locked(self):
+        saved = pypath.SNAPSHOT_DIR
+        pypath.SNAPSHOT_DIR = tempfile.mkdtemp()
+        code = ("import sys, pypath_core as pypath\n"
+            "pypath.SNAPSHOT_DIR, pypath.LOCK_DIR = sys.argv[1:3]\n"
+            "pypath.record_snapshot(['p1'])\n")
+        try:
+            # Test snapshots are written under the lock 'update_file' uses.
+            with pypath.lock_file(os.path.join(pypath.SNAPSHOT_DIR,
+                    "history")):
+                proc = subprocess.Popen([sys.executable, '-c', code,
+                    pypath.SNAPSHOT_DIR, pypath.LOCK_DIR], close_fds=True)
+                time.sleep(0.5)
+                self.assertEqual(None, proc.poll())
+                self.assertEqual([], os.listdir(pypath.SNAPSHOT_DIR))
+            self.assertEqual(0, proc.wait())
+            self.assertEqual(['p1'], pypath.load_snapshot('0'))
+        finally:
+            shutil.rmtree(pypath.SNAPSHOT_DIR)
+            pypath.SNAPSHOT_DIR = saved
+
+    def test_set_site(self):
+        tmp_dir = tempfile.mkdtemp()
+        env = dict(os.environ, PYTHONUSERBASE=tmp_dir, PYTHONPATH="")
+        try:
+            site_dir = pypath.get_site_dir(sys.executable, env)
+            self.assertTrue(site_dir.startswith(tmp_dir))
+            # Test paths are written as absolute paths, without blanks.
+            self.assertEqual([(sys.executable, os.path.join(site_dir,
+                pypath.SITE_PTH), True)], pypath.set_site(TEST_DIRS + [''],
+                [sys.executable], env))
+            # Test no lock file is left in the site dir.
+            self.assertEqual([pypath.SITE_PTH], os.listdir(site_dir))
+            output = subprocess.check_output([sys.executable, '-c',
+                'import sys; print("\\n".join(sys.path))'], env=env)
+            self.assertEqual(TEST_DIRS_OUT, [path for path in
+                output.splitlines() if path in TEST_DIRS_OUT])
+            # Test unchanged contents are not written again.
+            self.assertEqual([(sys.executable, os.path.join(site_dir,
+                pypath.SITE_PTH), False)], pypath.set_site(TEST_DIRS_OUT,
+                [sys.executable], env))
+            # Test invalid paths & interpreters.
+            for path_list, pythons in [(['a\nb'], [sys.executable]),
+                    (TEST_DIRS, ['not-a-python']), (TEST_DIRS, ['false'])]:
+                with self.assertRaises(pypath.PyPathError):
+                    pypath.set_site(path_list, pythons, env)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_profile(self):
+        profile_dir = pypath.PROFILE_DIR
+        pypath.PROFILE_DIR = tempfile.mkdtemp()
+        nested = os.path.join(TEST_DIRS[1], "nested.pth")
+        write_file(nested, ".\n")
+        write_file(PATH_FILE, "include {}\n".format(nested))
+        try:
+            # Test paths are saved as absolute paths.
+            pypath.save_profile('p', [('-a', [PATH_FILE, TEST_DIRS[0]])],
+                False)
+            self.assertEqual({'actions': [('-a', [os.path.abspath(PATH_FILE),
+                TEST_DIRS_OUT[0]])], 'force': False},
+                pypath.load_profile('p'))
+            # Test script & path files used are written.
+            self.assertEqual([TEST_DIRS_OUT[1], TEST_DIRS_OUT[0]],
+                pypath.use_profile('p'))
+            with open(pypath.get_profile_file('p', '.sh')) as fh:
+                self.assertEqual(pypath.get_shell_script(TEST_DIRS_OUT[1::-1]),
+                    fh.read())
+            with open(pypath.get_profile_file('p', '.deps')) as fh:
+                self.assertEqual(sorted([os.path.abspath(PATH_FILE),
+                    os.path.abspath(nested)]), fh.read().splitlines())
+            # Test invalid & missing profiles.
+            for name in ['', '.p', '../p', 'not']:
+                with self.assertRaises(ValueError) as err:
+                    pypath.load_profile(name)
+        finally:
+            shutil.rmtree(pypath.PROFILE_DIR)
+            pypath.PROFILE_DIR = profile_dir
+            os.remove(nested)
+
+    def test_watch_profiles(self):
+        saved = (pypath.PROFILE_DIR, pypath.DEFAULT_PATH,
+            pypath.DEFAULT_PROFILE, pypath.Inotify)
+        tmp_dir = tempfile.mkdtemp()
+        pypath.PROFILE_DIR = os.path.join(tmp_dir, "profiles")
+        pypath.DEFAULT_PATH = os.path.join(tmp_dir, "default.pth")
+        pypath.DEFAULT_PROFILE = os.path.join(tmp_dir, "default.profile")
+        path_file = os.path.abspath(PATH_FILE)
+        try:
+            write_file(PATH_FILE, TEST_DIRS_OUT[0])
+            pypath.save_profile('p', [('-a', [PATH_FILE])], False)
+            pypath.use_profile('p')
+            pypath.set_default_profile('p')
+            self.assertEqual('p', pypath.get_default_profile())
+            # Test dependencies of each profile.
+            deps = pypath.get_profile_deps()
+            self.assertEqual({'p'}, deps[path_file])
+            self.assertEqual({'p'}, deps[pypath.get_profile_file('p',
+                '.json')])
+            # Test profile & default are updated when a path file changes,
+            # with inotify & by polling.
+            for inotify, path in [(saved[3], TEST_DIRS_OUT[1]),
+                    (None, TEST_DIRS_OUT[2])]:
+                if inotify is None:
+                    def inotify():
+                        raise OSError("No inotify")
+                pypath.Inotify = inotify
+                thread = threading.Thread(target=pypath.watch_profiles,
+                    args=(0.05, 0.1, 1))
+                with no_stderr():
+                    thread.start()
+                    time.sleep(0.2)
+                    write_file(PATH_FILE, path)
+                    thread.join(10)
+                self.assertFalse(thread.is_alive())
+                for filename in [pypath.get_profile_file('p', '.sh'),
+                        pypath.DEFAULT_PATH]:
+                    with open(filename) as fh:
+                        self.assertEqual(pypath.get_shell_script([path]),
+                            fh.read())
+            # Test errors are reported, & other profiles still updated.
+            pypath.save_profile('q', [('-a', [TEST_DIRS[0]])], False)
+            write_file(PATH_FILE, NOT_DIRS_OUT[0])
+            with no_stderr():
+                self.assertEqual(['q'], pypath.update_profiles(['p', 'q']))
+            pypath.set_default_profile(None)
+            self.assertEqual(None, pypath.get_default_profile())
+        finally:
+            (pypath.PROFILE_DIR, pypath.DEFAULT_PATH, pypath.DEFAULT_PROFILE,
+                pypath.Inotify) = saved
+            shutil.rmtree(tmp_dir)
 
     def test_set_paths_from_file(self):
         # Test file with no paths.
@@ -227,6 +661,114 @@ class TestPyPath(unittest.TestCase):
             pypath.set_paths(['p1'], ['p2'], [('-a', [PATH_FILE])], True),
         )
 
+    def test_expand_glob(self):
+        root = tempfile.mkdtemp()
+        try:
+            for path in ["b/src", "a/src", "a/x/src", ".hidden/src",
+                    "node_modules/src", "c"]:
+                os.makedirs(os.path.join(root, path))
+            write_file(os.path.join(root, "d"), "")
+            for path, _, _ in os.walk(root):
+                os.utime(path, (time.time() - 10, time.time() - 10))
+            dirs = pypath.DirCache(os.path.join(root, "dirs"))
+            # Test sorted matches, skipping files & hidden dirs.
+            self.assertEqual([os.path.join(root, p) for p in "abc"],
+                pypath.expand_glob(os.path.join(root, "*"), dirs))
+            self.assertEqual([os.path.join(root, "a", "src"),
+                os.path.join(root, "b", "src")],
+                pypath.expand_glob(os.path.join(root, "*", "src"), dirs))
+            # Test recursive match, skipping excluded dirs.
+            self.assertEqual([os.path.join(root, "a", "src"),
+                os.path.join(root, "a", "x", "src"),
+                os.path.join(root, "b", "src")],
+                pypath.expand_glob(os.path.join(root, "**", "src"), dirs))
+            # Test hidden dirs matched explicitly.
+            self.assertEqual([os.path.join(root, ".hidden")],
+                pypath.expand_glob(os.path.join(root, ".h*"), dirs))
+            # Test missing base.
+            self.assertEqual([], pypath.expand_glob(
+                os.path.join(root, "not", "*"), dirs))
+            # Test listings are cached & reused until a dir changes.
+            dirs.save()
+            dirs = pypath.DirCache(os.path.join(root, "dirs"))
+            self.assertTrue(root in dirs.dirs)
+            os.mkdir(os.path.join(root, "e"))
+            os.utime(root, (time.time() - 5, time.time() - 5))
+            self.assertTrue("e" in dirs.get_subdirs(root))
+            self.assertTrue(dirs.changed)
+        finally:
+            shutil.rmtree(root)
+
+    def test_set_paths_glob(self):
+        # Test wildcard lines are expanded in place, in sorted order.
+        write_file(PATH_FILE, "~\n{}\n.\n".format(
+            os.path.join(TEST_DIRS[0], "*", "**")))
+        self.assertEqual(
+            [os.path.expanduser('~')] + TEST_DIRS_OUT[1:] +
+                [os.path.abspath('.'), 'p2'],
+            pypath.set_paths(['p1'], ['p2'], [('-a', [PATH_FILE])], False))
+        # Test no matches is an error, unless forced.
+        write_file(PATH_FILE, os.path.join(TEST_DIRS[0], "not*"))
+        with self.assertRaises(ValueError) as err:
+            pypath.set_paths(['p1'], ['p2'], [('-a', [PATH_FILE])], False)
+        self.assertTrue("No paths match" in str(err.exception))
+        self.assertEqual(['p2'],
+            pypath.set_paths(['p1'], ['p2'], [('-a', [PATH_FILE])], True))
+        # Test lines naming existing paths are not patterns.
+        literal = os.path.join(TEST_DIRS[0], "lib[1]")
+        os.mkdir(literal)
+        try:
+            write_file(PATH_FILE, "{}\n".format(literal))
+            for force in [False, True]:
+                self.assertEqual([os.path.abspath(literal), 'p2'],
+                    pypath.set_paths([], ['p2'], [('-a', [PATH_FILE])], force))
+            # Test removing ignores matches that are not on the PYTHONPATH.
+            write_file(PATH_FILE, os.path.join(TEST_DIRS[0], "*"))
+            self.assertEqual(['p2'], pypath.set_paths([], ['p2'],
+                [('-r', [PATH_FILE])], False))
+            self.assertEqual(['p2'], pypath.set_paths([], TEST_DIRS_OUT[1:2] +
+                ['p2'], [('-r', [PATH_FILE])], False))
+        finally:
+            os.rmdir(literal)
+
+    def test_set_paths_canonical(self):
+        root = tempfile.mkdtemp()
+        try:
+            real = os.path.join(root, "real")
+            link = os.path.join(root, "link")
+            os.makedirs(os.path.join(real, "sub"))
+            os.symlink("real", link)
+            os.symlink(os.path.join("..", "link", "sub"),
+                os.path.join(real, "up"))
+            resolver = pypath.PathResolver()
+            for path in [link, os.path.join(link, "sub"),
+                    os.path.join(real, "up"), os.path.join(root, "missing")]:
+                self.assertEqual(os.path.realpath(path),
+                    resolver.realpath(path))
+            # Test symlink loops are left as they are.
+            os.symlink("loop", os.path.join(root, "loop"))
+            self.assertEqual(os.path.join(root, "loop", "x"),
+                resolver.realpath(os.path.join(root, "loop", "x")))
+            # Test each path component is only looked up once.
+            pypath.TIMINGS.reset()
+            resolver.realpath(os.path.join(link, "sub", "x"))
+            self.assertEqual({'paths resolved': 1}, pypath.TIMINGS.counts)
+            # Test spellings of the same dir are listed once, highest first.
+            sub = [os.path.join(real, "sub"), os.path.join(link, "sub"),
+                os.path.join(real, "up")]
+            self.assertEqual([sub[1], 'p2'], pypath.set_paths([],
+                ['p2'], [('-a', sub[:1]), ('-a', sub[1:])], False, None,
+                None, True))
+            self.assertEqual(sub[:2] + ['p2'], pypath.set_paths([], ['p2'],
+                [('-a', sub[:2])], False))
+            # Test removing by another spelling.
+            self.assertEqual(['p2'], pypath.set_paths([], ['p2'],
+                [('-a', sub[:2]), ('-r', sub[2:])], False, None, None, True))
+            self.assertEqual(['p2'], pypath.set_paths([sub[0]], ['p2'],
+                [('-r', sub[2:])], False, None, None, True))
+        finally:
+            shutil.rmtree(root)
+
     def test_set_paths_add(self):
         # Test add not exist (as group).
         with self.assertRaises(ValueError) as err:
@@ -307,6 +849,138 @@ class TestPyPath(unittest.TestCase):
             ('-a', [TEST_DIRS[1]]),
         ], False))
 
+    def test_read_batch(self):
+        # Test one argument per line, after any other actions.
+        write_file(PATH_FILE, "# Comment\n-a\n{}\n\n{}\n-r\n{}\n--add\n"
+            "{}\n".format(*TEST_DIRS + TEST_DIRS[:1]))
+        actions = [('-a', TEST_DIRS[2:])] + [('-a', TEST_DIRS[:2]),
+            ('-r', TEST_DIRS[2:]), ('--add', TEST_DIRS[:1])]
+        self.assertEqual(actions, list(pypath.read_batch(PATH_FILE,
+            actions[:1])))
+        self.assertEqual(
+            pypath.set_paths(['p1'], ['p2'], actions, False),
+            pypath.set_paths(['p1'], ['p2'], pypath.read_batch(PATH_FILE,
+                actions[:1]), False))
+        # Test errors.
+        for contents in ["foo\n-a\nbar\n", "-a\nfoo\n-r\n", "-a\n-r\nx"]:
+            write_file(PATH_FILE, contents)
+            with self.assertRaises(ValueError):
+                list(pypath.read_batch(PATH_FILE))
+        # Test long removals are split, & chunks are limited in size.
+        batch_size = pypath.BATCH_SIZE
+        pypath.BATCH_SIZE = 2
+        try:
+            write_file(PATH_FILE,
+                "-r\n/p1\n/p2\n/p3\n-a\n/p4\n/p5\n/p6\n")
+            actions = list(pypath.read_batch(PATH_FILE))
+            self.assertEqual([('-r', ['/p1', '/p2']), ('-r', ['/p3']),
+                ('-a', ['/p4', '/p5', '/p6'])], actions)
+            self.assertEqual([actions[:1], actions[1:]],
+                list(pypath.get_chunks(actions)))
+            self.assertEqual(['/p4', '/p5', '/p6', '/p0'],
+                pypath.set_paths([], ['/p0', '/p1', '/p3'], actions, True))
+        finally:
+            pypath.BATCH_SIZE = batch_size
+
+    def test_path_set(self):
+        # Test actions, matching the command line.
+        paths = pypath.PathSet.from_env({'PYTHONPATH': '::/p1:/p2:/p1'})
+        self.assertEqual(['/p1', '/p2'], list(paths))
+        self.assertTrue(paths.add(*TEST_DIRS[:2]) is paths)
+        self.assertEqual(TEST_DIRS_OUT[:2] + ['/p1', '/p2'], list(paths))
+        paths.remove('/p1').add(TEST_DIRS[2]).remove(TEST_DIRS[0])
+        self.assertEqual(TEST_DIRS_OUT[2:0:-1] + ['/p2'], list(paths))
+        self.assertEqual(3, len(paths))
+        self.assertTrue(TEST_DIRS_OUT[1] in paths and '/p1' not in paths)
+        self.assertEqual(":".join(TEST_DIRS_OUT[2:0:-1] + ['/p2']),
+            paths.to_env({'HOME': 'h'})['PYTHONPATH'])
+        self.assertEqual('h', paths.to_env({'HOME': 'h'})['HOME'])
+        # Test paths that were in the set can be removed again.
+        self.assertEqual([], list(paths.clear().remove('/p1')))
+        # Test typed errors leave the set unchanged.
+        for action, error in [
+            (lambda: paths.add(NOT_DIRS[0]), pypath.PathNotFound),
+            (lambda: paths.add(os.devnull), pypath.NotADirectory),
+            (lambda: paths.remove('/p3'), pypath.NotOnPath),
+        ]:
+            paths = pypath.PathSet(['/p1'])
+            with self.assertRaises(error) as err:
+                action()
+            self.assertTrue(isinstance(err.exception, pypath.PathError))
+            self.assertEqual(['/p1'], list(paths))
+        self.assertEqual('/p3', err.exception.path)
+        with self.assertRaises(pypath.ProfileError):
+            pypath.load_profile('.invalid')
+        # Test path files & batches of actions.
+        write_file(PATH_FILE, "\n".join(TEST_DIRS))
+        self.assertEqual(pypath.PathSet(TEST_DIRS_OUT),
+            pypath.PathSet.from_file(PATH_FILE))
+        self.assertEqual(TEST_DIRS_OUT[:1], list(pypath.PathSet().apply(
+            ('-a' if i % 2 else '-r', TEST_DIRS[:1]) for i in range(1, 100))))
+        write_file(PATH_FILE, "# Comment\n")
+        with self.assertRaises(pypath.PathFileError) as err:
+            pypath.PathSet().add(PATH_FILE)
+        self.assertEqual(PATH_FILE, err.exception.path)
+        # Test forced actions.
+        self.assertEqual(NOT_DIRS_OUT, list(pypath.PathSet(
+            force=True).add(*NOT_DIRS)))
+        # Test thousands of path sets, checked on threads, leave none running.
+        tmp_dir = tempfile.mkdtemp()
+        dirs = [os.path.join(tmp_dir, str(i))
+            for i in range(pypath.INLINE_CHECKS + 1)]
+        for path in dirs:
+            os.mkdir(path)
+        count = threading.active_count()
+        try:
+            for _ in range(3000):
+                self.assertEqual(dirs, list(pypath.PathSet().add(*dirs)))
+            self.assertLessEqual(threading.active_count(), count)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_ordered_paths(self):
+        ordered = pypath.OrderedPaths(['p1', 'p2'])
+        ordered.prepend(['p3', 'p1'])
+        ordered.remove(['p2'])
+        ordered.prepend(['p2', 'p4'])
+        ordered.remove(['p4', 'p5'])
+        self.assertEqual(['p2', 'p3', 'p1', 'p1'], list(ordered))
+        self.assertEqual(['p2', 'p3', 'p1'], ordered.unique())
+        self.assertTrue('p1' in ordered and 'p2' in ordered)
+        self.assertFalse('p4' in ordered or 'p5' in ordered)
+        # Test compacting keeps unique paths only, in order.
+        ordered.compact()
+        self.assertEqual(['p2', 'p3', 'p1'], list(ordered))
+        ordered.prepend(['p5', 'p3'])
+        ordered.remove(['p1'])
+        self.assertEqual(['p5', 'p3', 'p2', 'p3'], list(ordered))
+        # Test stored paths stay in proportion to unique paths.
+        for i in range(10 ** 4):
+            ordered.prepend(['p1', 'p2'])
+            ordered.remove(['p1'])
+        self.assertEqual(['p2', 'p5', 'p3'], ordered.unique())
+        self.assertLess(ordered.size, 2048)
+
+    def test_set_paths_scaling(self):
+        # Test run time grows linearly with the number of paths.
+        def per_path(n):
+            paths = ["/p{}".format(i) for i in range(n)]
+            start = time.time()
+            path_list = pypath.join_paths(pypath.set_paths([], paths, [
+                ('-a', paths[::2]),
+                ('-r', paths[::3]),
+                ('-a', paths[::-5]),
+            ], True))
+            seconds = time.time() - start
+            removed = set(paths[::3]) - set(paths[::-5])
+            expected = pypath.join_paths([p for p in
+                paths[::-5] + paths[::2] + paths if p not in removed])
+            self.assertEqual(expected, path_list)
+            return seconds / n
+        base = min(per_path(10 ** 3) for _ in range(3))
+        self.assertLess(per_path(10 ** 4), base * 20)
+        self.assertLess(per_path(10 ** 5), base * 20)
+
     def test_parser(self):
         parser = pypath.get_parser()
         # Test flags.
@@ -330,8 +1004,284 @@ class TestPyPath(unittest.TestCase):
             ('-r', ['3']),
         ])
 
+    def test_parse_args_fast(self):
+        # Test results match the full parser.
+        parser = pypath.get_parser()
+        for argv in [
+            ['-c', '-a', '1', '2', '-r', '3', '-e', '-d', '-f', '-i'],
+            ['-a', '', '-a', '1'],
+            ['-T', '-u', '-a', '1'],
+            ['-R', '-w'],
+            ['-P', '-D', '-a', '1'],
+            ['-C', '-d'],
+            ['--undo', '--history'],
+            ['--timings', '-a', '1'],
+            ['-e'],
+        ]:
+            self.assertEqual(vars(parser.parse_args(argv)),
+                vars(pypath.parse_args_fast(argv)))
+        # Test anything else is left to the full parser.
+        for argv in [[], ['-h'], ['-a'], ['-a', '-c'], ['1'], ['-ce'],
+                ['-j', '2'], ['--help'], ['-a', '1', '--', '-2']]:
+            self.assertEqual(None, pypath.parse_args_fast(argv))
+
+    def test_fan_out(self):
+        write_file(PATH_FILE,
+            "# Shards.\n-a '{}' -- echo 1\n\n-- echo 2 '3 4'\n".format(
+            TEST_DIRS[0]))
+        self.assertEqual([([('-a', [TEST_DIRS[0]])], ['echo', '1']),
+            ([], ['echo', '2', '3 4'])], pypath.read_fanout(PATH_FILE))
+        for line in ["echo 1", "-a x --", "-c -- echo", "-a 'x -- echo"]:
+            write_file(PATH_FILE, line + "\n")
+            with self.assertRaises(pypath.PathFileError):
+                pypath.read_fanout(PATH_FILE)
+        # Test output is streamed & prefixed, & exit codes are reported.
+        code = ("import os, sys, time; time.sleep(float(sys.argv[1]));"
+            " print os.environ['PYTHONPATH']; sys.exit(int(sys.argv[1]))")
+        write_file(PATH_FILE, "".join("-a '{}' -- {} -c \"{}\" {}\n".format(
+            path, sys.executable, code, number)
+            for number, path in enumerate(TEST_DIRS)))
+        start = time.time()
+        r, o, e = run(['./pypath.py', '-c', '-F', PATH_FILE, '-n', '2'],
+            env=self.env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.assertLess(time.time() - start, 3)     # Runs 2 at once.
+        self.assertEqual(pypath.ERROR, r)
+        self.assertEqual(["[{}] {}".format(number, path) for number, path in
+            enumerate(TEST_DIRS_OUT, 1)], o.splitlines())
+        self.assertEqual(["[{}] Exit code {}: {}".format(number, number - 1,
+            sys.executable) for number in range(1, 4)],
+            [line.split(' -c')[0] for line in e.splitlines()])
+
+    def test_reorder_paths(self):
+        paths = ['p1', 'p2', 'p3', 'p4']
+        weights = {'p2': 1, 'p3': 3, 'p4': 2}
+        # Test paths are ordered by weight, ties keeping their order.
+        self.assertEqual(['p3', 'p4', 'p2', 'p1'],
+            pypath.reorder_paths(paths, weights))
+        # Test first providers of shadowed names stay first.
+        self.assertEqual(['p1', 'p3', 'p4', 'p2'],
+            pypath.reorder_paths(paths, weights, {'x': ['p1', 'p3']}))
+        self.assertEqual(['p2', 'p3', 'p4', 'p1'],
+            pypath.reorder_paths(paths, weights, {'x': ['p2', 'p3', 'p4']}))
+        self.assertEqual(6, pypath.count_misses(paths, {'a': 'p2', 'b': 'p3',
+            'c': 'p4', 'd': None, 'e': 'other'}))
+
+    def test_order_by_usage(self):
+        index_path = pypath_import.INDEX_PATH
+        pypath_import.INDEX_PATH = os.path.join(pypath.CACHE_DIR, "index")
+        usage = {TEST_DIRS_OUT[1]: 1, TEST_DIRS_OUT[2]: 5}
+        module = os.path.join(TEST_DIRS[2], "shadow.py")
+        try:
+            # Test most used paths first.
+            self.assertEqual(([TEST_DIRS_OUT[2], TEST_DIRS_OUT[1],
+                TEST_DIRS_OUT[0]], []),
+                pypath.order_by_usage(TEST_DIRS_OUT, usage))
+            # Test paths are not moved ahead of paths they shadow.
+            write_file(os.path.join(TEST_DIRS[0], "shadow.py"), "")
+            write_file(module, "")
+            self.assertEqual(([TEST_DIRS_OUT[0], TEST_DIRS_OUT[2],
+                TEST_DIRS_OUT[1]], [((TEST_DIRS_OUT[0], TEST_DIRS_OUT[2]),
+                ['shadow'])]), pypath.order_by_usage(TEST_DIRS_OUT, usage))
+        finally:
+            pypath_import.INDEX_PATH = index_path
+            for path in [module, os.path.join(TEST_DIRS[0], "shadow.py")]:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def test_bundle_paths(self):
+        root = tempfile.mkdtemp()
+        dirs = [os.path.join(root, name) for name in ["d1", "d2"]]
+        archive = os.path.join(root, "all.zip")
+        try:
+            for name, contents in [("d1/mod.py", "X = 1\n"),
+                    ("d2/mod.py", "X = 2\n"), ("d2/other.py", "Y = 2\n"),
+                    ("d1/pkg/__init__.py", "from . import sub\n"),
+                    ("d1/pkg/sub.py", ""), ("d1/pkg/data.txt", "data"),
+                    ("d1/pkg/fast.so", ""), ("d1/pkg/sub.pyc", ""),
+                    ("d2/pkg/__init__.py", ""), ("d2/ext.so", ""),
+                    ("d2/ext.py", ""), ("d2/not-mod.py", "")]:
+                path = os.path.join(root, name)
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                write_file(path, contents, age=10)
+            # Test names come from the first dir providing them, & extension
+            # modules are skipped.
+            self.assertEqual((archive, [('pkg.fast', os.path.join(dirs[0],
+                "pkg", "fast.so")), ('ext', os.path.join(dirs[1], "ext.so"))]),
+                pypath.bundle_paths(dirs, archive))
+            with contextlib.closing(zipfile.ZipFile(archive)) as bundle:
+                self.assertEqual(["mod.py", "mod.pyc", "other.py",
+                    "other.pyc", "pkg/__init__.py", "pkg/__init__.pyc",
+                    "pkg/data.txt", "pkg/sub.py", "pkg/sub.pyc"],
+                    sorted(bundle.namelist()))
+            # Test bundled bytecode is imported.
+            code = "import mod, pkg.sub; print mod.X, mod.__file__"
+            r, o, e = run([sys.executable, '-c', code], env=dict(os.environ,
+                PYTHONPATH=archive), stdout=subprocess.PIPE)
+            self.assertEqual("1 {}\n".format(os.path.join(archive,
+                "mod.pyc")), o)
+            # Test unchanged archive is not rewritten.
+            os.utime(archive, (0, 0))
+            pypath.bundle_paths(dirs, archive)
+            self.assertEqual(0, os.stat(archive).st_mtime)
+            # Test changed files are bundled again, & others copied.
+            write_file(os.path.join(dirs[1], "other.py"), "Y = 3\n", age=5)
+            read = zipfile.ZipFile.read
+            copied = []
+            zipfile.ZipFile.read = lambda self, name: copied.append(
+                getattr(name, 'filename', name)) or read(self, name)
+            try:
+                pypath.bundle_paths(dirs, archive)
+            finally:
+                zipfile.ZipFile.read = read
+            self.assertTrue("mod.pyc" in copied and "other.py" not in copied)
+            with contextlib.closing(zipfile.ZipFile(archive)) as bundle:
+                self.assertEqual("Y = 3\n", bundle.read("other.py"))
+        finally:
+            shutil.rmtree(root)
+
+    def test_compile_paths(self):
+        root = tempfile.mkdtemp()
+        try:
+            for name in ["mod.py", "pkg/__init__.py", "pkg/sub/x.py",
+                    "bad.py", "not-mod.py", "not-pkg/x.py", ".hidden/x.py",
+                    "node_modules/x.py"]:
+                path = os.path.join(root, name)
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                write_file(path, "def\n" if
+                    name == "bad.py" else "", age=10)
+            files = [os.path.join(root, name) for name in ["bad.py",
+                "mod.py", "pkg/__init__.py", "pkg/sub/x.py"]]
+            self.assertEqual(files, pypath.get_module_files([root, '']))
+            # Test modules are compiled, & failures returned.
+            pypath.TIMINGS.reset()
+            failed = pypath.compile_paths([root], procs=2)
+            self.assertEqual([files[0]], [path for path, _ in failed])
+            self.assertEqual({'modules compiled': 3, 'modules current': 0},
+                pypath.TIMINGS.counts)
+            self.assertTrue(os.path.isfile(files[3] + 'c'))
+            # Test current bytecode is skipped.
+            pypath.TIMINGS.reset()
+            pypath.compile_paths([root], procs=2)
+            self.assertEqual({'modules compiled': 0, 'modules current': 3},
+                pypath.TIMINGS.counts)
+            # Test errors of the child interpreter.
+            with self.assertRaises(pypath.PyPathError):
+                pypath.compile_paths([root], prefix=root)
+            # Test warnings filling a pipe do not block the children.
+            write_file(os.path.join(root, "warn.py"), "".join(
+                "def f{0}():\n    x{0} = 1\n    global x{0}\n".format(i)
+                for i in range(2000)))
+            pypath.TIMINGS.reset()
+            pypath.compile_paths([root], procs=1)
+            self.assertEqual(1, pypath.TIMINGS.counts['modules compiled'])
+        finally:
+            shutil.rmtree(root)
+
+    def test_farm_paths(self):
+        root = tempfile.mkdtemp()
+        dirs = [os.path.join(root, name) for name in ["d1", "d2"]]
+        farm = os.path.join(root, "farm")
+        try:
+            for name in ["d1/mod.py", "d1/pkg/__init__.py", "d1/ext.so",
+                    "d1/ext.py", "d2/mod.py", "d2/other.py",
+                    "d2/pkg/__init__.py", "d2/nopkg/mod.py", "d2/not-mod.py"]:
+                path = os.path.join(root, name)
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                write_file(path, "X = '{}'\n".format(name), age=10)
+            for path in dirs:
+                os.utime(path, (time.time() - 10, time.time() - 10))
+            # Test names link to the first dir providing them, & shadowed
+            # names are reported.
+            self.assertEqual((farm, [('mod', dirs[0], dirs[1:]),
+                ('pkg', dirs[0], dirs[1:])]),
+                pypath.farm_paths(dirs + [farm], farm))
+            links = dict((name, os.readlink(os.path.join(farm, name)))
+                for name in os.listdir(farm) if not name.startswith('.'))
+            self.assertEqual({
+                "mod.py": os.path.join(dirs[0], "mod.py"),
+                "pkg": os.path.join(dirs[0], "pkg"),
+                "ext.so": os.path.join(dirs[0], "ext.so"),
+                "other.py": os.path.join(dirs[1], "other.py"),
+            }, links)
+            code = "import mod, other; print mod.X, other.X"
+            r, o, e = run([sys.executable, '-c', code], env=dict(os.environ,
+                PYTHONPATH=farm), stdout=subprocess.PIPE)
+            self.assertEqual("d1/mod.py d2/other.py\n", o)
+            # Test unchanged dirs are not listed again.
+            pypath.TIMINGS.reset()
+            pypath.farm_paths(dirs, farm)
+            self.assertEqual({}, pypath.TIMINGS.counts)
+            # Test only links to changed dirs are updated.
+            os.remove(os.path.join(dirs[0], "mod.py"))
+            os.remove(os.path.join(dirs[1], "other.py"))
+            for path in dirs:
+                os.utime(path, (time.time() - 5, time.time() - 5))
+            pypath.farm_paths(dirs, farm)
+            self.assertEqual({'dirs listed': 2, 'links updated': 2},
+                pypath.TIMINGS.counts)
+            self.assertEqual(os.path.join(dirs[1], "mod.py"),
+                os.readlink(os.path.join(farm, "mod.py")))
+            self.assertFalse(os.path.lexists(os.path.join(farm, "other.py")))
+            # Test files that are not links are left alone.
+            write_file(os.path.join(farm, "own.py"), "")
+            with self.assertRaises(pypath.PathError):
+                pypath.farm_paths([], farm)
+            self.assertTrue(os.path.lexists(os.path.join(farm, "pkg")))
+        finally:
+            shutil.rmtree(root)
+
+    def test_time_imports(self):
+        modules = [os.path.join(path, "measured.py") for path in TEST_DIRS[1:]]
+        try:
+            for module in modules:
+                write_file(module, "print 'imported'\n")
+            # Test lookups are measured in a child interpreter.
+            results = pypath.time_imports(TEST_DIRS_OUT, ['measured', 'not'])
+            self.assertEqual(['not'], results['failed'])
+            self.assertEqual({'measured': TEST_DIRS_OUT[1], 'not': None},
+                results['served'])
+            self.assertEqual([0, 2], results['dirs'][TEST_DIRS_OUT[0]][:2])
+            # Test report suggests moving the provider up, but not ahead of
+            # a dir it shadows.
+            report = pypath.get_import_report(results, TEST_DIRS_OUT)
+            self.assertTrue("failed: 'not'" in report[0])
+            self.assertEqual(["  " + path for path in
+                [TEST_DIRS_OUT[1], TEST_DIRS_OUT[0], TEST_DIRS_OUT[2]]],
+                report[-3:])
+            report = pypath.get_import_report(results, TEST_DIRS_OUT,
+                {'x': [TEST_DIRS_OUT[0], TEST_DIRS_OUT[1]]})
+            self.assertEqual("No reordering suggested.", report[-1])
+            # Test interpreter errors.
+            with self.assertRaises(ValueError):
+                pypath.time_imports(TEST_DIRS_OUT, ['measured'], 'false')
+        finally:
+            for module in modules:
+                os.remove(module)
+
+    def test_timings(self):
+        timings = pypath.Timings()
+        with timings.phase('outer'):
+            with timings.phase('inner'):
+                timings.count('things', 2)
+            timings.count('things')
+        # Test nested phases are reported in start order, with counts.
+        self.assertEqual([0, 1], [depth for depth, _, _ in timings.phases])
+        fh = StringIO.StringIO()
+        timings.report(fh)
+        lines = fh.getvalue().splitlines()
+        self.assertEqual(['Timings', 'outer', 'inner', 'total', 'Counts:',
+            'things'], [line.split()[0].strip('(') for line in lines])
+        self.assertTrue(lines[-1].endswith(" 3"))
+        # Test reset.
+        timings.reset()
+        self.assertEqual(([], {}), (timings.phases, timings.counts))
+
     def test_main(self):
-        kwargs = dict(cwd='.', stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        kwargs = dict(cwd='.', env=self.env, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
         # Test no args.
         r, o, e = run('./pypath.py', **kwargs)
         self.assertEqual(pypath.HELP, r)
@@ -355,15 +1305,49 @@ class TestPyPath(unittest.TestCase):
         self.assertEqual(pypath.SUCCESS, r)
         self.assertEqual(0, len(e))
         self.assertTrue(all([tdo in o for tdo in TEST_DIRS_OUT]))
+        # Test timings & profile stats are reported on stderr only.
+        for flags in [['-T'], ['--cprofile', '-']]:
+            r, o, e = run(['./pypath.py', '-c', '-a'] + TEST_DIRS + flags,
+                **kwargs)
+            self.assertEqual(pypath.SUCCESS, r)
+            self.assertEqual(":".join(TEST_DIRS_OUT), o.strip())
+            self.assertTrue(len(e) > 0)
+        self.assertTrue("set_paths" in run(['./pypath.py', '-T', '-a'] +
+            TEST_DIRS, **kwargs)[2])
+        # Test batch on stdin matches command line.
+        proc = subprocess.Popen(['./pypath.py', '-c', '-b', '-'],
+            stdin=subprocess.PIPE, **kwargs)
+        o, e = proc.communicate("-a\n" + "\n".join(TEST_DIRS) + "\n")
+        self.assertEqual((pypath.SUCCESS, ":".join(TEST_DIRS_OUT), ""),
+            (proc.returncode, o.strip(), e))
+        # Test command is run with the PYTHONPATH, in place of echoing.
+        code = "import os, sys; print os.environ['PYTHONPATH']; sys.exit(3)"
+        r, o, e = run(['./pypath.py', '-c', '-a'] + TEST_DIRS + ['--',
+            sys.executable, '-c', code], **kwargs)
+        self.assertEqual((3, ":".join(TEST_DIRS_OUT) + "\n", ""), (r, o, e))
+        r, o, e = run(['./pypath.py', '--', 'not-a-command'], **kwargs)
+        self.assertEqual(pypath.ERROR, r)
+        self.assertTrue("Could not run 'not-a-command'" in o)
         # Test permanent.
         r, o, e = run(['./pypath.py', '-c', '-d', '-a'] + TEST_DIRS,
             **kwargs)
         self.assertEqual(pypath.SUCCESS, r)
         self.assertEqual(0, len(e))
-        with open(DEFAULT_PATH_FILE, 'r') as fh:
+        with open(os.path.join(self.home, ".pypath", "default.pth")) as fh:
             contents = fh.read()
         self.assertEqual(contents, "PYTHONPATH={}\nexport PYTHONPATH\n".format(
             "\nPYTHONPATH+=:".join(["'{}'".format(td) for td in TEST_DIRS_OUT])))
+        # Test queries & unchanged paths do not add snapshots.
+        history = os.path.join(self.home, ".pypath", "snapshots", "history")
+        with open(history) as fh:
+            contents = fh.read()
+        kwargs['env'] = dict(self.env, PYTHONPATH=TEST_DIRS_OUT[1])
+        for args in [['--history'], ['-e'], ['--diff', '0'],
+                ['-a', TEST_DIRS[1]]]:
+            self.assertEqual(pypath.SUCCESS, run(['./pypath.py'] + args,
+                **kwargs)[0])
+        with open(history) as fh:
+            self.assertEqual(contents, fh.read())
 
 
 if __name__ == "__main__":
@@ -4,6 +4,12 @@
 
 # Main function.
 main() {
+    # Run with a temp HOME holding these scripts, leaving '~/.pypath' alone.
+    TEST_HOME="$(mktemp -d)"
+    mkdir "${TEST_HOME}/.pypath"
+    cp pypath.py pypath_core.py pypathd.py pypath_import.py codes \
+        "${TEST_HOME}/.pypath"
+    export HOME="${TEST_HOME}"
     # Test parameters.
     # test dirs, including absolute dir under '~' & dir with spaces in name.
     TEST_DIRS="${HOME}/test pypath/nested"
@@ -22,13 +28,18 @@ main() {
     test_add
     test_remove
     test_error
+    test_profile
+    test_batch
+    test_command
+    test_server
     echo ''
     trap - EXIT
     cleanup
 }
 
 cleanup() {
-    rm -rf "$(dirname "${TEST_DIRS}")"
+    rm -rf "$(dirname "${TEST_DIRS}")" "${TEST_HOME}"
+    unset TEST_HOME
     unset TEST_DIRS
     unset TEST_FILES
     unset CLEAN_PATH
@@ -126,5 +137,89 @@ test_error() {
     printf '.'
 }
 
+# Test that -p sets PYTHONPATH from a saved profile.
+# The profile is recompiled when a path file it uses changes.
+test_profile() {
+    local PTH="$(dirname "${TEST_DIRS}")/test.pth"
+    local PROFILE=~/.pypath/profiles/pypath_test
+    echo "nested" > "${PTH}"
+    export PYTHONPATH="${HOME}"
+    . ./pypath.sh -c -s pypath_test -a "${PTH}" > /dev/null 2>&1
+    local OUTPUT="$(. ./pypath.sh -p pypath_test -e 2>&1 || true)"
+    #printf "OUTPUT: ${OUTPUT}"
+    if [ "${OUTPUT}" != "${TEST_DIRS}" ]; then
+        printf "\nFail 'test_profile', expected:\n${TEST_DIRS}\nGot:\n${OUTPUT}"
+        rm -f "${PROFILE}".*
+        return 1
+    fi
+    echo "." > "${PTH}"
+    touch -t 200001010000 "${PROFILE}.sh"
+    OUTPUT="$(. ./pypath.sh -p pypath_test -e 2>&1 || true)"
+    rm -f "${PROFILE}".*
+    if [ "${OUTPUT}" != "$(dirname "${TEST_DIRS}")" ]; then
+        printf "\nFail 'test_profile', not recompiled, got:\n${OUTPUT}"
+        return 1
+    fi
+    printf '.'
+}
+
+# Test that -b - reads actions from stdin.
+test_batch() {
+    export PYTHONPATH="${HOME}"
+    local OUTPUT="$(printf -- '-a\n%s\n' "${TEST_DIRS}" \
+        | { . ./pypath.sh -c -b - -e 2>&1 || true; })"
+    if [ "${OUTPUT}" != "${TEST_DIRS}" ]; then
+        printf "\nFail 'test_batch', expected:\n${TEST_DIRS}\nGot:\n${OUTPUT}"
+        return 1
+    fi
+    printf '.'
+}
+
+# Test that a command after -- is run with the PYTHONPATH, without setting it.
+test_command() {
+    export PYTHONPATH="${HOME}"
+    local OUTPUT="$(. ./pypath.sh -c -a "${TEST_DIRS}" -- \
+        sh -c 'echo "${PYTHONPATH}"' 2>&1 || true)"
+    if [ "${OUTPUT}" != "${TEST_DIRS}" ] \
+        || [ "${PYTHONPATH}" != "${HOME}" ]; then
+        printf "\nFail 'test_command', expected:\n${TEST_DIRS}\nGot:\n${OUTPUT}"
+        return 1
+    fi
+    printf '.'
+}
+
+# Test that requests go through the pypathd.py server's socket, via nc.
+# pypath.py is moved aside, so running it directly would fail.
+test_server() {
+    if ! command -v nc > /dev/null 2>&1; then
+        printf 's'  # Skipped, as nc is needed to send requests.
+        return 0
+    fi
+    local SOCKET=~/.pypath/pypath.sock
+    ~/.pypath/pypathd.py -F -t 10 &
+    local PID="${!}"
+    local TRIES=0
+    while ! test -S "${SOCKET}" && test "${TRIES}" -lt 50; do
+        sleep 0.1
+        TRIES=$((TRIES + 1))
+    done
+    mv ~/.pypath/pypath.py ~/.pypath/pypath.py.off
+    export PYTHONPATH="${HOME}"
+    local OUTPUT="$(. ./pypath.sh -c -a "${TEST_DIRS}" -e 2>&1 || true)"
+    local ERRORS="$(. ./pypath.sh -a "${TEST_DIRS}/invalid" 2>&1 || true)"
+    mv ~/.pypath/pypath.py.off ~/.pypath/pypath.py
+    kill "${PID}"
+    wait "${PID}" 2> /dev/null
+    if [ "${OUTPUT}" != "${TEST_DIRS}" ]; then
+        printf "\nFail 'test_server', expected:\n${TEST_DIRS}\nGot:\n${OUTPUT}"
+        return 1
+    fi
+    if ! echo "${ERRORS}" | grep -q "Path not found"; then
+        printf "\nFail 'test_server', expected error, got:\n${ERRORS}"
+        return 1
+    fi
+    printf '.'
+}
+
 # Run tests.
 main "${@}"
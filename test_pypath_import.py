@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+"""
+Test pypath_import.py module.
+"""
+
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import pypath_import
+
+
+def write_file(filename, contents=""):
+    """
+    Write file, creating its directory if needed.
+    """
+    if not os.path.isdir(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+    with open(filename, 'w') as fh:
+        fh.write(contents)
+
+
+class TestPyPathImport(unittest.TestCase):
+    """
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.dirs = [os.path.join(self.tmp_dir, d) for d in ['d1', 'd2']]
+        write_file(os.path.join(self.dirs[0], 'mod_a.py'), "WHERE = 'd1'\n")
+        write_file(os.path.join(self.dirs[0], 'pkg_b', '__init__.py'))
+        write_file(os.path.join(self.dirs[0], 'not_pkg', 'x.py'))
+        write_file(os.path.join(self.dirs[0], 'not-mod.py'))
+        write_file(os.path.join(self.dirs[1], 'mod_a.py'), "WHERE = 'd2'\n")
+        write_file(os.path.join(self.dirs[1], 'ext_c.cpython-35m.so'))
+        self.sys_path = list(sys.path)
+        self.meta_path = list(sys.meta_path)
+
+    def tearDown(self):
+        sys.path[:] = self.sys_path
+        sys.meta_path[:] = self.meta_path
+        for name in ['mod_a', 'pkg_b']:
+            sys.modules.pop(name, None)
+        shutil.rmtree(self.tmp_dir)
+
+    def test_scan_dir(self):
+        self.assertEqual(['mod_a', 'pkg_b'],
+            pypath_import.scan_dir(self.dirs[0]))
+        self.assertEqual(['ext_c', 'mod_a'],
+            pypath_import.scan_dir(self.dirs[1]))
+        self.assertEqual([], pypath_import.scan_dir(
+            os.path.join(self.tmp_dir, 'not')))
+
+    def test_update_index(self):
+        missing = os.path.join(self.tmp_dir, 'not')
+        index = pypath_import.update_index(self.dirs + [missing])
+        self.assertEqual(self.dirs, index['paths'])
+        self.assertEqual([('mod_a', self.dirs)],
+            pypath_import.get_shadowed(index))
+        # Test unchanged dirs are not scanned again.
+        index['dirs'][self.dirs[0]]['names'] = ['cached']
+        index = pypath_import.update_index(self.dirs, index)
+        self.assertEqual(['cached'], index['dirs'][self.dirs[0]]['names'])
+        # Test changed dirs are scanned again.
+        os.utime(self.dirs[0], (0, 0))
+        index = pypath_import.update_index(self.dirs, index)
+        self.assertEqual(['mod_a', 'pkg_b'],
+            index['dirs'][self.dirs[0]]['names'])
+
+    def test_read_write_index(self):
+        path = os.path.join(self.tmp_dir, 'index.json')
+        self.assertEqual({'paths': [], 'dirs': {}},
+            pypath_import.read_index(path))
+        index = pypath_import.update_index(self.dirs)
+        pypath_import.write_index(index, path)
+        self.assertEqual(index, pypath_import.read_index(path))
+
+    def test_measure_imports(self):
+        sys.path[:0] = self.dirs
+        results = pypath_import.measure_imports(['mod_a', 'pkg_b', 'not_mod'])
+        # Test imports are timed, & failures recorded.
+        self.assertEqual(['mod_a', 'not_mod', 'pkg_b'],
+            sorted(results['imports']))
+        self.assertEqual(['not_mod'], results['failed'])
+        self.assertEqual('d1', sys.modules['mod_a'].WHERE)
+        # Test dirs providing modules, & lookups in each dir.
+        self.assertEqual(self.dirs[0], results['served']['mod_a'])
+        self.assertEqual(None, results['served']['not_mod'])
+        self.assertEqual([2, 1], results['dirs'][self.dirs[0]][:2])
+        self.assertEqual([0, 1], results['dirs'][self.dirs[1]][:2])
+        # Test timer is removed.
+        self.assertEqual(self.meta_path, sys.meta_path)
+
+    def test_usage(self):
+        sys.path[:0] = self.dirs
+        __import__('mod_a')
+        __import__('pkg_b')
+        # Test top-level modules are counted by the PYTHONPATH dir providing
+        # them.
+        usage = pypath_import.get_usage(sys.modules, self.dirs)
+        self.assertEqual({self.dirs[0]: 2}, usage)
+        self.assertEqual({}, pypath_import.get_usage(sys.modules, []))
+        # Test counts are appended & totalled.
+        path = os.path.join(self.tmp_dir, 'usage.log')
+        self.assertEqual({}, pypath_import.read_usage(path))
+        pypath_import.write_usage(usage, path)
+        pypath_import.write_usage({self.dirs[0]: 1, self.dirs[1]: 3}, path)
+        with open(path, 'a') as fh:
+            fh.write("bad line\n")
+        totals = {self.dirs[0]: 3, self.dirs[1]: 3}
+        self.assertEqual(totals, pypath_import.read_usage(path, False))
+        with open(path) as fh:
+            self.assertEqual(4, len(fh.readlines()))
+        # Test log is compacted.
+        self.assertEqual(totals, pypath_import.read_usage(path))
+        with open(path) as fh:
+            self.assertEqual(2, len(fh.readlines()))
+        self.assertEqual(totals, pypath_import.read_usage(path))
+
+    def test_compile_files(self):
+        files = [os.path.join(self.dirs[0], 'mod_a.py'),
+            os.path.join(self.dirs[0], 'pkg_b', '__init__.py')]
+        bad = os.path.join(self.dirs[1], 'bad.py')
+        write_file(bad, "def\n")
+        # Test only files without current bytecode are compiled.
+        results = pypath_import.compile_files(files + [bad])
+        self.assertEqual((2, 0, [bad]), (results['compiled'],
+            results['current'], list(results['failed'])))
+        self.assertTrue(all(pypath_import.is_compiled(path)
+            for path in files))
+        results = pypath_import.compile_files(files)
+        self.assertEqual((0, 2), (results['compiled'], results['current']))
+        # Test changed source is compiled again.
+        write_file(files[0], "WHERE = 'changed'\n")
+        os.utime(files[0], (0, 0))
+        self.assertFalse(pypath_import.is_compiled(files[0]))
+        self.assertEqual(1, pypath_import.compile_files(files)['compiled'])
+        # Test bytecode is written under a cache prefix.
+        if hasattr(sys, 'pycache_prefix'):
+            prefix = os.path.join(self.tmp_dir, 'cache')
+            saved = sys.pycache_prefix
+            try:
+                pypath_import.compile_files(files, prefix)
+                self.assertTrue(pypath_import.get_bytecode_file(files[0])
+                    .startswith(prefix))
+                self.assertTrue(pypath_import.is_compiled(files[0]))
+            finally:
+                sys.pycache_prefix = saved
+        else:
+            with self.assertRaises(ValueError):
+                pypath_import.compile_files(files, self.tmp_dir)
+
+    def test_install(self):
+        # Test modules are found in priority order, via the index.
+        path = os.path.join(self.tmp_dir, 'index.json')
+        pypath_import.write_index(
+            pypath_import.update_index(self.dirs[::-1]), path)
+        sys.path[:] = self.dirs[::-1] + sys.path
+        finder = pypath_import.install(path)
+        import mod_a
+        import pkg_b
+        self.assertEqual('d2', mod_a.WHERE)
+        self.assertEqual(os.path.join(self.dirs[0], 'pkg_b'),
+            os.path.dirname(pkg_b.__file__))
+        self.assertEqual(self.dirs[::-1], finder.providers['mod_a'])
+        # Test modules outside indexed dirs are still found.
+        import json
+        self.assertTrue(sys.modules['json'] is json)
+
+
+if __name__ == "__main__":
+    unittest.main()
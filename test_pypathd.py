@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+Test pypathd.py script.
+"""
+
+
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+
+import pypath_core
+import pypathd
+
+
+def run(*args, **kwargs):
+    """
+    """
+    proc = subprocess.Popen(*args, **kwargs)
+    out, err = proc.communicate()
+    return proc.returncode, out, err
+
+
+def wait_for(predicate, timeout=5):
+    """
+    Wait until predicate is true, or timeout.
+    """
+    end = time.time() + timeout
+    while not predicate() and time.time() < end:
+        time.sleep(0.01)
+    return predicate()
+
+
+class TestPyPathD(unittest.TestCase):
+    """
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.socket = os.path.join(self.tmp_dir, "pypath.sock")
+        # Requests run with a temp HOME, so they leave '~/.pypath' alone.
+        self.env = dict(os.environ, HOME=self.tmp_dir)
+        self.proc = subprocess.Popen(['./pypathd.py', '-F', '-t', '2',
+            '-s', self.socket], env=self.env)
+        self.assertTrue(wait_for(lambda: os.path.exists(self.socket)))
+
+    def tearDown(self):
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.proc.wait()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_parse_env(self):
+        self.assertEqual({'A': '1', 'B': 'x=y\nz', 'C': ''},
+            pypathd.parse_env("A=1\nB=x=y\nz\nC="))
+
+    def test_request(self):
+        # Test output matches running 'pypath.py' directly.
+        env = dict(self.env, PYTHONPATH="p1::p2")
+        cases = [
+            ['-e'],
+            ['-c', '-a', self.tmp_dir, '.'],
+            ['-r', 'p1'],
+            ['-a', os.path.join(self.tmp_dir, 'not')],
+            ['-h'],
+            ['-a'],
+        ]
+        for args in cases:
+            r, o, e = run(['./pypath.py'] + args, env=env,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            self.assertEqual((r, o.rstrip('\n'), e),
+                pypathd.request(args, self.socket, env=env))
+        # Test relative paths use the client's working directory.
+        self.assertEqual((pypath_core.SUCCESS, self.tmp_dir, ""),
+            pypathd.request(['-c', '-a', '.'], self.socket, cwd=self.tmp_dir,
+            env=self.env))
+
+    def test_idle_timeout(self):
+        # Test server exits & removes its socket when idle.
+        self.assertTrue(wait_for(lambda: self.proc.poll() is not None))
+        self.assertFalse(os.path.exists(self.socket))
+
+
+if __name__ == "__main__":
+    unittest.main()